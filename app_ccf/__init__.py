@@ -0,0 +1 @@
+default_app_config = 'app_ccf.apps.AppCcfConfig'
@@ -8,3 +8,4 @@ admin.site.register(ccf_models.VoucherCode)
 admin.site.register(ccf_models.VoucherCodeBatch)
 admin.site.register(ccf_models.VoucherCodeAttempt)
 admin.site.register(ccf_models.StatusUpdate)
+admin.site.register(ccf_models.AutoProcessJob)
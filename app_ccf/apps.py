@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AppCcfConfig(AppConfig):
     name = 'app_ccf'
+
+    def ready(self):
+        from . import checks, signals
@@ -1,5 +1,7 @@
 
+from django.core.cache import cache
 from django.test import TestCase
+from app_ccf.models import VoucherCode
 from app_ccf.twilio import twilio_client
 import mock
 
@@ -15,5 +17,9 @@ class CcfBaseTest(TestCase):
                               'trigger_text_messages', autospec=True).start()
         self.trigger_text_messages_mock = twilio_client.trigger_text_messages
 
+        # Velocity counters live in the cache, so don't carry them over.
+        cache.clear()
+        VoucherCode.forget_verifications()
+
         if not hasattr(time.sleep, 'mock'):
             mock.patch.object(time, 'sleep', autospect=True).start()
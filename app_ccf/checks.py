@@ -0,0 +1,33 @@
+"""
+System checks of the settings app_ccf depends on.
+"""
+from django.conf import settings
+from django.core import checks
+
+# Cache backends whose entries aren't shared between processes.
+LOCAL_CACHE_BACKENDS = {
+    'django.core.cache.backends.dummy.DummyCache',
+    'django.core.cache.backends.locmem.LocMemCache',
+}
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Warns unless the default cache is shared by every process.
+
+    The voucher code velocity counters live in the cache. With a cache local
+    to each process, the web processes throttle per process rather than per
+    IP, and the auto-processing worker never sees the attempts counted by the
+    web processes. Only a warning, so deployments without memcached still
+    run, with weaker throttling.
+    """
+    if settings.DEBUG or getattr(settings, 'TESTING', False):
+        return []
+    backend = settings.CACHES['default']['BACKEND']
+    if backend not in LOCAL_CACHE_BACKENDS:
+        return []
+    return [checks.Warning(
+        'The default cache (%s) is not shared between processes.' % backend,
+        hint='Set MEMCACHED_LOCATION to a memcached server.',
+        id='app_ccf.W001',
+    )]
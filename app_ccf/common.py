@@ -1,34 +1,75 @@
 import collections
+from contextlib import contextmanager
 from datetime import datetime, timezone
 import logging
 import json
 import random
+import threading
 from uuid import UUID
 
+from django.db.models import Q
 from django.forms.models import model_to_dict
 from django.utils.translation import ugettext_lazy as _
 
 from app_ccf import models
 from .encoder import ApplicationEncoder
 from .fraud_checks import (
-    AddressDedupCheck,
-    NamePhoneDedupCheck,
+    BaseDedupCheck,
+    DedupMethod,
+    FraudCheckRunner,
+    get_fraud_checks,
 )
 from .config import CONFIG
 from .models import Application, VoucherCode, VoucherCodeAttempt, VoucherCodeCheckStatus
-from django.db import transaction
-from . import notification, utils
+from django.db import connection, transaction
+from . import notification, utils, velocity
 
 
 # Logging.
 LOGGER = logging.getLogger(__name__)
 LOGGER.setLevel(logging.DEBUG)
 
+# The number of SUBMITTED applications processed at a time by background
+# auto-processing jobs.
+AUTO_PROCESS_CHUNK_SIZE = 2000
+
+# Postgres advisory lock IDs, which must be unique across the database.
+AUTO_PROCESS_LOCK_ID = 6210001
+UPDATE_STATUSES_LOCK_ID = 6210002
+
 
 class ApplicationSubmissionError(Exception):
     pass
 
 
+class AlreadyRunningError(Exception):
+    """Raised when another process is already running the same operation."""
+    pass
+
+
+@contextmanager
+def advisory_lock(lock_id):
+    """Holds a Postgres advisory lock while the block runs.
+
+    The lock is held by the database session rather than a transaction, so
+    it spans operations that commit in several transactions. It is released
+    when the block exits or, if the process dies, when its connection closes.
+
+    Raises:
+        AlreadyRunningError: If another session holds the lock.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_try_advisory_lock(%s)', [lock_id])
+        acquired = cursor.fetchone()[0]
+    if not acquired:
+        raise AlreadyRunningError()
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [lock_id])
+
+
 class ApplicationSession():
 
     def __init__(self, model_dict=None, checks=None):
@@ -75,7 +116,8 @@ class ApplicationSession():
 def is_voucher_code_valid(
         code,
         ip_address,
-        action=VoucherCodeAttempt.Action.VOUCHER_CODE_CHECK):
+        action=VoucherCodeAttempt.Action.VOUCHER_CODE_CHECK,
+        use_cache=True):
     """Checks if a given voucher code is valid to redeem.
 
     For each call to this method, it also writes an entry to VoucherCodeAttempt table for record purpose.
@@ -84,16 +126,19 @@ def is_voucher_code_valid(
         code: A given voucher code.
         ip_address: The IP address of the requester.
         action: A VoucherCodeAttempt.Action.
+        use_cache: Whether codes recently found not redeemable may be
+            answered from the cache. See VoucherCode.verify_code.
 
     Returns:
         A bool of whether the code is valid to redeem.
     """
-    status = VoucherCode.verify_code(code)
+    status = VoucherCode.verify_code(code, use_cache=use_cache)
     attempt_info = dict(code=code, ip_address=ip_address,
                         action=action, status=status)
     LOGGER.debug('#VoucherCodeAttempt: %s', attempt_info)
 
     VoucherCodeAttempt(**attempt_info).save()
+    velocity.record_attempt(code, ip_address, status)
     return status == VoucherCodeCheckStatus.SUCCESS
 
 
@@ -110,17 +155,49 @@ def submit_application(application, ip_address):
     if not is_voucher_code_valid(
             application.vouchercode_str,
             ip_address,
-            action=VoucherCodeAttempt.Action.APPLICATION_REVIEW):
+            action=VoucherCodeAttempt.Action.APPLICATION_REVIEW,
+            use_cache=False):
         return False, str(_('voucher_input_incorrect_format'))
 
     code = VoucherCode.objects.get(code=application.vouchercode_str)
     code.application = application
     assign_voucher_code_amount(application, code)
     code.save()
+    VoucherCode.forget_verifications([code.code])
     application.save()
+    if CONFIG.get('score_on_submission'):
+        score_application(application)
     return True, None
 
 
+def score_application(application):
+    """Runs the fraud checks that can score a new application inline.
+
+    Only checks answering from indexes (e.g. dedup checks using
+    DedupKeyCount) are run, so this costs a few indexed lookups. A flagged
+    application gets its status right away. An application passing them is
+    only approved if every enabled check ran, and is otherwise left
+    SUBMITTED for auto_update_application_statuses.
+
+    Args:
+        application: A saved SUBMITTED application.
+    """
+    checks = get_fraud_checks()
+    inline_checks = [check for check in checks if check.supports_inline()]
+    runner = FraudCheckRunner(inline_checks)
+    results = runner.run([application])
+    if application.status == Application.ApplicationStatus.SUBMITTED:
+        if len(inline_checks) < len(checks):
+            return
+        application.status = Application.ApplicationStatus.APPROVED
+    LOGGER.info('#ApplicationScore: %s scored %s' % (
+        application.application_id, application.status))
+    Application.bulk_save_statuses([application])
+    runner.save_results(results)
+    if application.status == Application.ApplicationStatus.REJECTED:
+        transaction.on_commit(lambda: send_rejection_texts([application]))
+
+
 def assign_voucher_code_amount(application, code):
     """Implement any code-specific special dollar amount assignments here."""
     # if <condition>:
@@ -128,24 +205,140 @@ def assign_voucher_code_amount(application, code):
     pass
 
 
-def auto_update_application_statuses():
+def auto_update_application_statuses(dedup_method=DedupMethod.INDEX,
+                                     chunk_size=None, job=None,
+                                     dry_run=False, max_duplicates=None,
+                                     workers=1):
     """Run fraud checks on newly submitted applications.
 
     Updates all applications with status SUBMITTED to APPROVED, REJECTED or
     NEEDS_REVIEW.
+
+    Args:
+        dedup_method: The DedupMethod used to find duplicates.
+        chunk_size: If set, the SUBMITTED applications are streamed this many
+            at a time, oldest first. Each chunk is saved in its own
+            transaction before the next one is loaded, so memory use and
+            transaction size don't grow with the backlog.
+        job: An optional AutoProcessJob to checkpoint after each chunk, in the
+            same transaction. A job that was interrupted resumes after its
+            last checkpoint. Requires chunk_size.
+        dry_run: If set, nothing is saved and no text is sent. The statuses
+            the checks would set are counted instead and returned in a report.
+        max_duplicates: Overrides of the max_duplicates of dedup checks, keyed
+            by check name.
+        workers: The number of processes running the checks that can be
+            partitioned. The results are the same whatever the number.
+
+    Returns:
+        The number of applications processed, or with dry_run, a dict with:
+            - num_applications: The number of applications checked.
+            - by_status: The number of them that would get each status.
+            - by_check: The stats of each check, as in
+              FraudCheckRunner.stats.
+
+    Raises:
+        AlreadyRunningError: If auto-processing is running elsewhere.
+        ValueError: If max_duplicates names an unknown dedup check.
+    """
+    checks = get_fraud_checks(dedup_method)
+    for name, value in (max_duplicates or {}).items():
+        dedup_checks = [check for check in checks
+                        if check.name == name
+                        and isinstance(check, BaseDedupCheck)]
+        if not dedup_checks:
+            raise ValueError('Unknown dedup check: %s' % name)
+        dedup_checks[0].max_duplicates = value
+
+    if dry_run:
+        with FraudCheckRunner(checks, workers=workers) as runner:
+            status_counts = _auto_update_application_statuses(
+                runner, chunk_size, None, dry_run=True)
+        runner.log_stats()
+        return {
+            'num_applications': sum(status_counts.values()),
+            'by_status': dict(status_counts),
+            'by_check': runner.stats,
+        }
+
+    with advisory_lock(AUTO_PROCESS_LOCK_ID):
+        with FraudCheckRunner(
+                checks, stats=job.check_stats if job is not None else None,
+                workers=workers) as runner:
+            status_counts = _auto_update_application_statuses(
+                runner, chunk_size, job)
+        runner.log_stats()
+        num_processed = sum(status_counts.values())
+        if job is not None:
+            num_processed = job.num_processed
+        return num_processed
+
+
+def _auto_update_application_statuses(runner, chunk_size, job,
+                                      dry_run=False):
+    """Returns the number of applications given each status."""
+    submitted = Application.objects.filter(
+        status=Application.ApplicationStatus.SUBMITTED)
+    if chunk_size is None:
+        new_applications = submitted.order_by('-submitted_date')
+        status_counts = apply_fraud_checks(
+            new_applications, runner, save=not dry_run)
+        if not dry_run:
+            send_rejection_texts(new_applications)
+        return status_counts
+
+    status_counts = collections.Counter()
+    checkpoint = None
+    if job is not None:
+        checkpoint = job.get_checkpoint()
+    while True:
+        chunk = submitted.order_by('submitted_date', 'application_id')
+        if checkpoint is not None:
+            submitted_date, application_id = checkpoint
+            chunk = chunk.filter(
+                Q(submitted_date__gt=submitted_date) |
+                Q(submitted_date=submitted_date,
+                  application_id__gt=application_id))
+        new_applications = list(chunk[:chunk_size])
+        if not new_applications:
+            return status_counts
+
+        checkpoint = (new_applications[-1].submitted_date,
+                      new_applications[-1].application_id)
+        if dry_run:
+            status_counts += apply_fraud_checks(
+                new_applications, runner, save=False)
+            continue
+
+        with transaction.atomic():
+            status_counts += apply_fraud_checks(new_applications, runner)
+            if job is not None:
+                job.save_checkpoint(
+                    job.num_processed + len(new_applications), *checkpoint,
+                    check_stats=runner.stats)
+        send_rejection_texts(new_applications)
+
+
+def apply_fraud_checks(new_applications, runner, save=True):
+    """Sets and saves the statuses of the given new applications.
+
+    Fraud checks are added by registering them in app_ccf.fraud_checks. The
+    reasons each application was flagged are saved as FraudFlags, and the
+    duplicates as DuplicateClusters.
+
+    Args:
+        new_applications: The SUBMITTED applications to check.
+        runner: The FraudCheckRunner running the fraud checks.
+        save: Whether to save the statuses, flags and clusters, rather than
+            just set the statuses.
+
+    Returns:
+        A Counter of the statuses set.
     """
-    new_applications = Application.objects.filter(
-        status=Application.ApplicationStatus.SUBMITTED
-    ).order_by('-submitted_date')
     LOGGER.info('Setting statuses for %d new applications...' %
                 len(new_applications))
 
-    apply_dedup_check(AddressDedupCheck(), new_applications)
-    apply_dedup_check(NamePhoneDedupCheck(), new_applications)
-
-    ###########################################################################
-    #                  ADD ADDITIONAL FRAUD CHECKS HERE                       #
-    ###########################################################################
+    results = runner.run(new_applications)
 
     # Approve all applications that weren't flagged for review.
     for application in new_applications:
@@ -154,56 +347,107 @@ def auto_update_application_statuses():
             Application.ApplicationStatus.REJECTED,
         ):
             application.status = Application.ApplicationStatus.APPROVED
-        application.save()
-        LOGGER.info('Application %d: %s' % (application.application_id,
-                                            application.status))
-
-    notification.send_text([a for a in new_applications if a.status ==
-                            Application.ApplicationStatus.REJECTED], notification.TextType.REJECTION)
+    if save:
+        Application.bulk_save_statuses(new_applications)
+        runner.save_results(results)
+    status_counts = collections.Counter(
+        application.status for application in new_applications)
+    for status, count in status_counts.items():
+        LOGGER.info('%d applications: %s' % (count, status))
     LOGGER.info('Set statuses for %d new applications.' %
                 len(new_applications))
+    return status_counts
 
 
-def apply_dedup_check(dedup_check, new_apps):
-    """Applies the provided dedup_check to new_apps.
+def send_rejection_texts(applications):
+    """Texts the applicants whose applications were rejected."""
+    notification.send_text([a for a in applications if a.status ==
+                            Application.ApplicationStatus.REJECTED], notification.TextType.REJECTION)
 
-    Any duplicates found will have their status updated to the status
-    specified in the provided dedup_check.
 
-    Args:
-      dedup_check: The DedupCheck to use for duplicate checking.
-      new_apps: The apps on which to apply duplicate checking.
+@contextmanager
+def job_heartbeat(job):
+    """Refreshes the heartbeat of a RUNNING AutoProcessJob while the block runs.
+
+    The heartbeat is refreshed every AutoProcessJob.HEARTBEAT_INTERVAL from a
+    thread with its own database connection, so it keeps going during long
+    scans and chunks, and isn't held back until a chunk's transaction commits.
     """
+    stopped = threading.Event()
 
-    dup_counts = collections.defaultdict(int)
-    all_apps = Application.objects.all()
-    for app in all_apps:
-        dup_counts[dedup_check.get_test_value(app)] += 1
+    def beat():
+        try:
+            while not stopped.wait(
+                    job.HEARTBEAT_INTERVAL.total_seconds()):
+                job.beat()
+        finally:
+            connection.close()
 
-    duplicate_apps = filter(lambda app: dup_counts[dedup_check.get_test_value(
-        app)] > dedup_check.get_max_duplicates(), new_apps)
-    for app in duplicate_apps:
-        if dedup_check.is_preapproved(app):
-            continue
-        app.status = dedup_check.new_status
-        if app.note:
-            app.note += '; %s' % dedup_check.get_error_message()
+    thread = threading.Thread(target=beat, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def run_auto_process_job(job):
+    """Runs a claimed AutoProcessJob, checkpointing it as it goes.
+
+    If auto-processing is already running elsewhere, the job is put back in
+    the queue instead.
+
+    Args:
+        job: An AutoProcessJob returned by AutoProcessJob.claim_next().
+
+    Returns:
+        Whether the job was run, rather than put back in the queue.
+    """
+    with job_heartbeat(job):
+        # A job resumed after its worker died keeps counting from where it
+        # was.
+        job.num_total = job.num_processed + Application.objects.filter(
+            status=Application.ApplicationStatus.SUBMITTED).count()
+        job.save(update_fields=['num_total'])
+        LOGGER.info('#AutoProcessJob %d: processing %d applications...' % (
+            job.id, job.num_total - job.num_processed))
+        try:
+            auto_update_application_statuses(
+                chunk_size=AUTO_PROCESS_CHUNK_SIZE, job=job,
+                workers=CONFIG['fraud_check_workers'])
+        except AlreadyRunningError:
+            LOGGER.warning('#AutoProcessJob %d: auto-processing is already '
+                           'running elsewhere, queueing it again.' % job.id)
+            job.release()
+            return False
+        except Exception as e:
+            LOGGER.exception('#AutoProcessJob %d failed.' % job.id)
+            job.finish(error=str(e))
         else:
-            app.note = dedup_check.get_error_message()
+            LOGGER.info('#AutoProcessJob %d: done.' % job.id)
+            job.finish()
+    return True
 
 
 def update_application_statuses(
         application_ids,
         status,
         send_text_messages=True):
-    applications = Application.objects.filter(pk__in=application_ids)
-    LOGGER.info('Setting status to {} for applications: {}...'.format(
-                status, application_ids))
+    """Sets the status of the given applications.
+
+    Raises:
+        AlreadyRunningError: If a status update is running elsewhere.
+    """
+    with advisory_lock(UPDATE_STATUSES_LOCK_ID):
+        applications = Application.objects.filter(pk__in=application_ids)
+        LOGGER.info('Setting status to {} for applications: {}...'.format(
+                    status, application_ids))
 
-    Application.bulk_update_status(applications, status)
+        Application.bulk_update_status(applications, status)
 
-    if status == Application.ApplicationStatus.PAYMENT_CONFIRMED and send_text_messages:
-        notification.send_text(
-            applications, notification.TextType.PAYMENT_CONFIRMED)
+        if status == Application.ApplicationStatus.PAYMENT_CONFIRMED and send_text_messages:
+            notification.send_text(
+                applications, notification.TextType.PAYMENT_CONFIRMED)
 
-    LOGGER.info('Done')
+        LOGGER.info('Done')
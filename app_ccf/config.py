@@ -26,4 +26,26 @@ CONFIG = {
                                      _('requirements_live_in_us')],
     'usio_card_design_id_en': '111',
     'usio_card_design_id_es': '222',
+    # Whether to run the indexed fraud checks on each application as it is
+    # submitted, rather than leaving it SUBMITTED until auto-processing.
+    # Applications passing them are only approved if no enabled check needs
+    # auto-processing, so none of optional_fraud_checks may be enabled.
+    'score_on_submission': False,
+    # The names of the opt-in fraud checks to run, e.g. 'fraud_ring' and
+    # 'fuzzy'. They scan the whole Application table on every
+    # auto-processing run and fraud check report.
+    'optional_fraud_checks': [],
+    # The number of processes auto-processing jobs run the partitioned fraud
+    # checks in, e.g. the fuzzy dedup check. 1 runs them in the job's process.
+    'fraud_check_workers': 1,
+    # Whether a voucher code is also considered used when an application
+    # that isn't linked to it has it as vouchercode_str. Turn off once
+    # ./manage.py link_voucher_codes --verify reports no unlinked application.
+    'legacy_vouchercode_fallback': True,
+    # How many voucher codes found not redeemable (not found, invalidated or
+    # expired) each process remembers, and for how many seconds. Codes
+    # imported or generated in another process may be reported as not found
+    # for that long.
+    'verification_cache_size': 10000,
+    'verification_cache_seconds': 60,
 }
@@ -0,0 +1,45 @@
+"""
+The worker processes running the partitioned checks of FraudCheckRunner.
+
+Workers are spawned rather than forked, since the runner's process may hold
+a database connection, a server-side cursor and running threads, e.g. the
+heartbeat of an auto-processing job. A spawned worker imports this module
+before Django is set up, so it only loads the checks, and the models they
+use, once init() has set Django up.
+"""
+import collections
+import pickle
+import time
+
+import django
+from django.db import connections
+
+# The partitioned checks of this worker, by name, and the seconds each spent
+# since its results were last collected.
+_CHECKS = {}
+_SECONDS = collections.Counter()
+
+
+def init(pickled_checks):
+    """Sets Django up and loads the checks, pickled by the runner."""
+    django.setup()
+    # The worker never queries the database, so it holds no connection.
+    connections.close_all()
+    _CHECKS.clear()
+    _CHECKS.update(
+        (check.name, check) for check in pickle.loads(pickled_checks))
+    _SECONDS.clear()
+
+
+def observe(name, fields, rows):
+    start = time.monotonic()
+    row_class = collections.namedtuple('Row', fields)
+    _CHECKS[name].observe([row_class._make(row) for row in rows])
+    _SECONDS[name] += time.monotonic() - start
+
+
+def get_flagged(name, new_apps):
+    start = time.monotonic()
+    flagged = _CHECKS[name].get_flagged(new_apps)
+    seconds = _SECONDS.pop(name, 0.0) + time.monotonic() - start
+    return flagged, seconds
@@ -1,39 +1,199 @@
-from app_ccf.models import PreapprovedAddress, Application
+from array import array
+import bisect
+import collections
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+import itertools
+import logging
+import multiprocessing
+import pickle
+import time
+import zlib
 
+import unidecode
 
-class BaseDedupCheck:
+from django.db.models import Case, Count, F, QuerySet, TextField, When
+from django.db.models.functions import Concat, Lower
+
+from app_ccf import fraud_check_workers, velocity
+from app_ccf.config import CONFIG
+from app_ccf.models import (
+    Application,
+    DedupKeyCount,
+    DuplicateCluster,
+    FraudFlag,
+    PreapprovedAddress,
+    VoucherCodeAttempt,
+    VoucherCodeCheckStatus,
+)
+from shared.utils import (
+    get_address_key,
+    get_building_key,
+    get_phone_key,
+    normalize_street_address,
+)
+
+
+# Logging.
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+
+# The number of applications fetched at a time by the shared scan of the
+# Application table, and handed to each check's observe().
+SCAN_CHUNK_SIZE = 2000
+
+# The number of leading characters of a check's partition_field, e.g. the
+# 3-digit zip prefix, deciding which worker process handles an application.
+PARTITION_PREFIX_LENGTH = 3
+
+# The fraud check classes run by auto-processing, in the order they run.
+# Add checks with the register_check decorator.
+FRAUD_CHECKS = []
+
+
+def register_check(check_class):
+    """Class decorator registering a fraud check to run on new applications."""
+    FRAUD_CHECKS.append(check_class)
+    return check_class
+
+
+class DedupMethod(Enum):
+    """How a BaseDedupCheck counts the applications sharing a test value."""
+    # Look up the counts of the new applications' test values in
+    # DedupKeyCount. Checks that aren't indexed fall back to SQL, or SCAN.
+    INDEX = 1
+    # Group all applications by the check's test expression in one query.
+    # Checks without a test expression fall back to INDEX, or SCAN.
+    SQL = 2
+    # Count the test values of all applications in the shared scan.
+    SCAN = 3
+
+
+class BaseFraudCheck:
+    """
+    Base class for the fraud checks run on new applications.
+
+    Registered checks are run together by FraudCheckRunner. Checks that need
+    to see every application, rather than just the new ones, set scan_fields:
+    the runner then streams the Application table once, whatever the number
+    of checks, and hands each check the rows in batches through observe().
+    Each check keeps whatever state it needs from those rows, and uses it in
+    get_flagged() to pick out the new applications that fail the check.
+
+    Attributes:
+        name (str): A unique name for the check.
+        scan_fields (tuple): The Application fields the check needs from the
+            shared scan, or an empty tuple if it doesn't need the scan.
+        partition_field (str): Set on checks that only ever flag an
+            application because of scanned rows sharing the prefix of this
+            field, and that don't query the database in observe() or
+            get_flagged(). FraudCheckRunner may then run the check in worker
+            processes, each observing and checking one partition of the rows.
+        opt_in (bool): Whether the check only runs when its name is listed
+            in CONFIG['optional_fraud_checks'].
+
+    Args:
+        reason (FraudFlag.Reason): The reason recorded in a FraudFlag on the
+            application when the check fails.
+        new_status (Application.Status): The status to update the application
+            to if the check fails.
+
+    """
+    name = None
+    scan_fields = ()
+    partition_field = None
+    opt_in = False
+
+    def __init__(self, reason,
+                 new_status=Application.ApplicationStatus.NEEDS_REVIEW):
+        self.reason = reason
+        self.new_status = new_status
+
+    def get_error_message(self):
+        """Returns the description of the reason the check fails."""
+        return FraudFlag.Reason(self.reason).label
+
+    def get_scan_fields(self):
+        """Returns the Application fields needed from the shared scan."""
+        return self.scan_fields
+
+    def supports_inline(self):
+        """Returns whether the check can score one application cheaply.
+
+        Checks that do are run by score_application as applications are
+        submitted, so they must answer from a few indexed lookups rather than
+        the shared scan or a pass over the table.
+        """
+        return False
+
+    def observe(self, rows):
+        """Accumulates state from a batch of rows of the shared scan.
+
+        Args:
+            rows: A list of named tuples with the fields of get_scan_fields.
+        """
+        pass
+
+    def get_flagged(self, new_apps):
+        """Returns the new applications failing the check.
+
+        Args:
+            new_apps: The SUBMITTED applications to check.
+
+        Returns:
+            A dict mapping the application_id of each flagged application to
+            the value that got it flagged, e.g. the test value it shares with
+            other applications.
+        """
+        return {}
+
+
+class BaseDedupCheck(BaseFraudCheck):
     """
     Base class for checking Applications for duplicates.
 
-    Subclasses should override get_test_value to return a value
-    to be compared across applications for duplicates. They may
+    Subclasses should set name and override get_test_value to return a value
+    to be compared across applications for duplicates, or None if an
+    application has nothing to compare, e.g. no phone number. They may
     optionally provide max_duplicates if the number of allowed
-    duplicates is greater than 1.
+    duplicates is greater than 1, and get_test_expression to let the
+    database compute the test value.
+
+    Attributes:
+        name (str): A unique name for the check, used to store its test values
+            in DedupKeyCount.
+        indexed (bool): Whether the check's test values are kept in
+            DedupKeyCount.
+        test_fields (tuple): The Application fields read by get_test_value.
+        dedup_method (DedupMethod): The preferred way to count duplicates.
+        cluster_field (str): The indexed Application field holding the test
+            value, if any. The applications sharing a flagged test value are
+            then saved as a DuplicateCluster for staff to review together.
 
     Args:
-        error_message (str): The note to append to the application when the
-            dedup check fails.
+        reason (FraudFlag.Reason): The reason recorded in a FraudFlag on the
+            application when the dedup check fails.
         max_duplicates (int): The number of applications that are allowed to
             share a common test value before the dedup check fails.
         new_status (Application.Status): The status to update the application
             to if the dedup check fails.
 
     """
+    indexed = False
+    test_fields = ()
+    dedup_method = DedupMethod.INDEX
+    cluster_field = None
 
-    def __init__(self, error_message, max_duplicates=1,
+    def __init__(self, reason, max_duplicates=1,
                  new_status=Application.ApplicationStatus.NEEDS_REVIEW):
+        super().__init__(reason, new_status=new_status)
         self.max_duplicates = max_duplicates
-        self.error_message = error_message
-        self.new_status = new_status
+        self._scan_counts = {}
 
     def get_max_duplicates(self):
         """Returns the max number of apps that may share the value tested."""
         return self.max_duplicates
 
-    def get_error_message(self):
-        """Returns the error message to use when duplicates are detected."""
-        return self.error_message
-
     def is_preapproved(self, application):
         """Returns whether this application is exempted from this check."""
         return False
@@ -42,31 +202,836 @@ class BaseDedupCheck:
         """Returns the standardized value to be tested for duplicates."""
         pass
 
+    def get_test_expression(self):
+        """Returns a database expression computing get_test_value, if any.
+
+        The expression must evaluate to the same value as get_test_value for
+        every application, and to NULL where it returns None. Checks without
+        one can only use DedupKeyCount.
+        """
+        return None
+
+    def get_dedup_method(self):
+        """Returns the DedupMethod this check can use, given dedup_method."""
+        has_expression = self.get_test_expression() is not None
+        if self.dedup_method == DedupMethod.SQL:
+            preferences = [(DedupMethod.SQL, has_expression),
+                           (DedupMethod.INDEX, self.indexed)]
+        elif self.dedup_method == DedupMethod.INDEX:
+            preferences = [(DedupMethod.INDEX, self.indexed),
+                           (DedupMethod.SQL, has_expression)]
+        else:
+            preferences = []
+        for method, available in preferences:
+            if available:
+                return method
+        return DedupMethod.SCAN
 
+    def supports_inline(self):
+        return self.get_dedup_method() == DedupMethod.INDEX
+
+    def get_scan_fields(self):
+        if self.get_dedup_method() == DedupMethod.SCAN:
+            return self.test_fields
+        return ()
+
+    def observe(self, rows):
+        for row in rows:
+            test_value = self.get_test_value(row)
+            if test_value is None:
+                continue
+            self._scan_counts[test_value] = \
+                self._scan_counts.get(test_value, 0) + 1
+
+    def get_flagged(self, new_apps):
+        method = self.get_dedup_method()
+        if method == DedupMethod.SQL:
+            duplicates = self.find_duplicates_sql(new_apps)
+        elif method == DedupMethod.INDEX:
+            duplicates = self.find_duplicates_indexed(new_apps)
+        else:
+            duplicates = self.find_duplicates_scanned(new_apps)
+        return {app.application_id: duplicates[app.application_id]
+                for app in new_apps
+                if app.application_id in duplicates
+                and not self.is_preapproved(app)}
+
+    def find_duplicates_indexed(self, new_apps):
+        """Returns the test values of new_apps failing, using DedupKeyCount.
+
+        Only the test values of new_apps are looked up, so this costs time in
+        proportion to new_apps rather than to the Application table.
+        """
+        test_values = {app.application_id: self.get_test_value(app)
+                       for app in new_apps}
+        test_values = {application_id: test_value
+                       for application_id, test_value in test_values.items()
+                       if test_value is not None}
+        dup_counts = DedupKeyCount.get_counts(
+            self.name, set(test_values.values()))
+        return {application_id: test_value
+                for application_id, test_value in test_values.items()
+                if dup_counts[test_value] > self.get_max_duplicates()}
+
+    def find_duplicates_sql(self, new_apps):
+        """Returns the test values of new_apps failing, using one SQL query.
+
+        Applications sharing a test value with new_apps are grouped by the
+        check's test expression in the database (GROUP BY ... HAVING), so no
+        application other than new_apps is loaded into memory.
+        """
+        if not isinstance(new_apps, QuerySet):
+            new_apps = Application.objects.filter(
+                pk__in=[app.application_id for app in new_apps])
+        expression = self.get_test_expression()
+        new_apps = new_apps.annotate(test_value=expression)
+        duplicate_values = Application.objects.annotate(
+            test_value=expression
+        ).filter(
+            test_value__in=new_apps.values('test_value')
+        ).values('test_value').annotate(
+            num_apps=Count('application_id')
+        ).filter(
+            num_apps__gt=self.get_max_duplicates()
+        ).values('test_value')
+        return dict(new_apps.filter(
+            test_value__in=duplicate_values
+        ).values_list('application_id', 'test_value'))
+
+    def find_duplicates_scanned(self, new_apps):
+        """Returns the test values of new_apps failing, using the shared scan.
+        """
+        duplicates = {}
+        for app in new_apps:
+            test_value = self.get_test_value(app)
+            if self._scan_counts.get(test_value, 0) > \
+                    self.get_max_duplicates():
+                duplicates[app.application_id] = test_value
+        return duplicates
+
+
+@register_check
 class AddressDedupCheck(BaseDedupCheck):
     """Flags duplicate addresses across more than 5 apps for review."""
+    name = 'address'
+    indexed = True
+    test_fields = ('addr1', 'zip_code')
+    cluster_field = 'address_key'
 
     def __init__(self):
-        super().__init__(error_message='duplicate address', max_duplicates=3)
+        super().__init__(reason=FraudFlag.Reason.DUPLICATE_ADDRESS,
+                         max_duplicates=3)
+        self._preapproved_addresses = None
 
     def is_preapproved(self, application):
-        return PreapprovedAddress.objects.filter(
-            addr1=application.addr1, zip_code=application.zip_code).exists()
+        # Loaded once per check instance (i.e. once per run), since affiliate
+        # centers produce large clusters of flagged applications.
+        if self._preapproved_addresses is None:
+            self._preapproved_addresses = get_preapproved_addresses()
+        return get_building_key(application.addr1, application.zip_code) in (
+            self._preapproved_addresses)
 
     def get_test_value(self, application):
-        return '\n'.join([application.addr1,
-                          application.city,
-                          application.state,
-                          application.zip_code])
+        return get_address_key(application.addr1, application.zip_code)
+
+    def get_test_expression(self):
+        # Kept up to date by Application.save() and backfill_keys.
+        return F('address_key')
 
 
+@register_check
 class NamePhoneDedupCheck(BaseDedupCheck):
     """Rejects apps with the same first name, last name, and phone number."""
+    name = 'name_phone'
+    indexed = True
+    test_fields = ('first_name', 'last_name', 'phone_number')
 
     def __init__(self):
-        super().__init__(error_message='duplicate first/last/phone',
+        super().__init__(reason=FraudFlag.Reason.DUPLICATE_NAME_PHONE,
                          new_status=Application.ApplicationStatus.REJECTED)
 
     def get_test_value(self, application):
+        phone_key = get_phone_key(application.phone_number)
+        if not phone_key:
+            return None
         return application.first_name.lower() + application.last_name.lower() + \
-            application.phone_number
+            phone_key
+
+    def get_test_expression(self):
+        # phone_key is kept up to date by Application.save() and
+        # backfill_keys.
+        return Case(
+            When(phone_key='', then=None),
+            default=Concat(Lower('first_name'), Lower('last_name'),
+                           'phone_key'),
+            output_field=TextField())
+
+
+class UnionFind:
+    """
+    Disjoint sets over the integers 0 to n - 1, grown with add().
+
+    Parents and set sizes are kept in flat integer arrays, so memory is a few
+    bytes per element. find() uses path halving and union() joins the
+    smaller set into the larger, so any sequence of operations runs in
+    near-linear time.
+    """
+
+    def __init__(self):
+        self._parent = array('l')
+        self._size = array('l')
+
+    def __len__(self):
+        return len(self._parent)
+
+    def add(self):
+        """Adds a new singleton set and returns its element."""
+        element = len(self._parent)
+        self._parent.append(element)
+        self._size.append(1)
+        return element
+
+    def find(self, element):
+        """Returns the root element of the set containing element."""
+        parent = self._parent
+        while parent[element] != element:
+            parent[element] = parent[parent[element]]
+            element = parent[element]
+        return element
+
+    def union(self, a, b):
+        """Merges the sets containing a and b, and returns the new root."""
+        a = self.find(a)
+        b = self.find(b)
+        if a == b:
+            return a
+        if self._size[a] < self._size[b]:
+            a, b = b, a
+        self._parent[b] = a
+        self._size[a] += self._size[b]
+        return a
+
+    def size(self, element):
+        """Returns the size of the set containing element."""
+        return self._size[self.find(element)]
+
+
+@register_check
+class FraudRingCheck(BaseFraudCheck):
+    """
+    Flags applications in large clusters linked by shared contact details.
+
+    Applications are linked when they share a normalized address, a phone
+    number, or the IP address they were submitted from (as recorded in
+    VoucherCodeAttempt). Linked applications form clusters through any chain
+    of links, which catches rings where each application only shares one
+    detail with the next. Preapproved addresses don't link applications.
+
+    The clusters are built with a UnionFind over one pass of the shared scan,
+    so memory is linear in the number of applications.
+
+    Args:
+        max_cluster_size (int): The largest cluster that isn't flagged.
+    """
+    name = 'fraud_ring'
+    scan_fields = ('application_id', 'addr1', 'zip_code', 'phone_number',
+                   'vouchercode_str')
+    opt_in = True
+
+    def __init__(self, max_cluster_size=10):
+        super().__init__(reason=FraudFlag.Reason.FRAUD_RING)
+        self.max_cluster_size = max_cluster_size
+        self._clusters = UnionFind()
+        # The element of each scanned application, and the application of
+        # each element.
+        self._elements = {}
+        self._application_ids = []
+        # The first element seen with each linking value.
+        self._linked_elements = {}
+        self._preapproved_addresses = None
+        self._submission_ips = None
+
+    def get_link_values(self, row):
+        """Returns the values linking an application to others."""
+        if row.phone_number:
+            yield ('phone', get_phone_key(row.phone_number))
+        if get_building_key(
+                row.addr1, row.zip_code) in self._preapproved_addresses:
+            return
+        yield ('address', get_address_key(row.addr1, row.zip_code))
+        ip_address = self._submission_ips.get(row.vouchercode_str)
+        if ip_address:
+            yield ('ip', ip_address)
+
+    def observe(self, rows):
+        if self._submission_ips is None:
+            self._preapproved_addresses = get_preapproved_addresses()
+            self._submission_ips = dict(
+                VoucherCodeAttempt.objects.filter(
+                    action=VoucherCodeAttempt.Action.APPLICATION_REVIEW,
+                    status=VoucherCodeCheckStatus.SUCCESS,
+                ).values_list('code', 'ip_address').iterator(
+                    chunk_size=SCAN_CHUNK_SIZE))
+
+        for row in rows:
+            element = self._clusters.add()
+            self._elements[row.application_id] = element
+            self._application_ids.append(row.application_id)
+            for link_value in self.get_link_values(row):
+                linked_element = self._linked_elements.setdefault(
+                    link_value, element)
+                if linked_element != element:
+                    self._clusters.union(linked_element, element)
+
+    def get_flagged(self, new_apps):
+        flagged = {}
+        for app in new_apps:
+            element = self._elements.get(app.application_id)
+            if element is None:
+                continue
+            if self._clusters.size(element) > self.max_cluster_size:
+                root = self._clusters.find(element)
+                flagged[app.application_id] = self._application_ids[root]
+        return flagged
+
+
+@register_check
+class VelocityCheck(BaseFraudCheck):
+    """
+    Flags applications submitted from IPs that tried many unknown codes.
+
+    The attempts of the submitting IP are read from app_ccf.velocity, which
+    only keeps recent windows, so this check is most useful when scoring
+    applications as they are submitted.
+
+    Args:
+        window (str): The name of the velocity window to look at.
+        min_attempts (int): The fewest attempts in the window for the IP to
+            be judged.
+        max_not_found_ratio (float): The largest share of those attempts
+            that may be for codes that don't exist.
+    """
+    name = 'velocity'
+
+    def __init__(self, window='24h', min_attempts=10,
+                 max_not_found_ratio=0.5):
+        super().__init__(reason=FraudFlag.Reason.CODE_GUESSING)
+        self.window = window
+        self.min_attempts = min_attempts
+        self.max_not_found_ratio = max_not_found_ratio
+
+    def supports_inline(self):
+        return True
+
+    def is_ip_guessing(self, ip_address):
+        """Returns whether an IP tried too many unknown codes."""
+        counts = velocity.get_counts(
+            'ip', ip_address, windows=[self.window])[self.window]
+        return (counts.attempts >= self.min_attempts and
+                counts.not_found > counts.attempts * self.max_not_found_ratio)
+
+    def get_flagged(self, new_apps):
+        application_ids = {app.vouchercode_str: app.application_id
+                           for app in new_apps}
+        submission_ips = VoucherCodeAttempt.objects.filter(
+            code__in=list(application_ids),
+            action=VoucherCodeAttempt.Action.APPLICATION_REVIEW,
+            status=VoucherCodeCheckStatus.SUCCESS,
+        ).values_list('code', 'ip_address')
+        guessing = {}
+        flagged = {}
+        for code, ip_address in submission_ips:
+            if ip_address not in guessing:
+                guessing[ip_address] = self.is_ip_guessing(ip_address)
+            if guessing[ip_address]:
+                flagged[application_ids[code]] = ip_address
+        return flagged
+
+
+SOUNDEX_CODES = {
+    letter: str(code)
+    for code, letters in enumerate(
+        ['aeiouy', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'])
+    for letter in letters
+}
+
+
+def soundex(name):
+    """Returns the American Soundex code of a name, e.g. R163 for Robert."""
+    letters = [letter for letter in unidecode.unidecode(name).casefold()
+               if letter.isalpha()]
+    if not letters:
+        return ''
+    codes = [letters[0].upper()]
+    previous = SOUNDEX_CODES.get(letters[0])
+    for letter in letters[1:]:
+        code = SOUNDEX_CODES.get(letter)
+        # H and W don't separate letters with the same code, vowels do.
+        if code is None:
+            continue
+        if code != previous and code != '0':
+            codes.append(code)
+        previous = code
+    return ''.join(codes + ['0', '0', '0'])[:4]
+
+
+def bounded_edit_distance(a, b, max_distance):
+    """Returns the Levenshtein distance of a and b, up to max_distance.
+
+    Only the diagonal band of the edit matrix within max_distance is
+    computed, and the computation stops as soon as every cell of a row
+    exceeds it, so this costs O(max_distance * len(a)) at most and usually
+    much less for strings far apart.
+
+    Returns:
+        The distance, or max_distance + 1 if it is larger than max_distance.
+    """
+    if a == b:
+        return 0
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if len(a) > len(b):
+        a, b = b, a
+    over = max_distance + 1
+    previous = [min(j, over) for j in range(len(b) + 1)]
+    for i in range(1, len(a) + 1):
+        current = [over] * (len(b) + 1)
+        current[0] = min(i, over)
+        row_min = current[0]
+        for j in range(max(1, i - max_distance),
+                       min(len(b), i + max_distance) + 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1,
+                             previous[j - 1] + (a[i - 1] != b[j - 1]), over)
+            row_min = min(row_min, current[j])
+        if row_min >= over:
+            return over
+        previous = current
+    return previous[len(b)]
+
+
+def is_similar(a, b, max_distance):
+    """Returns whether a and b are within max_distance edits of each other.
+
+    Short strings allow fewer edits, one per 4 characters, so that e.g.
+    "Al Li" and "Bo Li" don't match.
+    """
+    max_distance = min(max_distance, max(len(a), len(b)) // 4)
+    return bounded_edit_distance(a, b, max_distance) <= max_distance
+
+
+def find_fuzzy_matches(tasks, max_name_distance, max_street_distance):
+    """Returns the candidates fuzzy matching each application of tasks.
+
+    Args:
+        tasks: A list of (application_id, name, street, candidates) tuples,
+            candidates being a list of (application_id, name, street).
+        max_name_distance: The largest edit distance between matching names.
+        max_street_distance: The largest edit distance between matching
+            streets. House numbers must match exactly.
+
+    Returns:
+        A dict mapping the application_id of each task with a match to the
+        smallest application_id it matched.
+    """
+    matches = {}
+    for application_id, name, street, candidates in tasks:
+        house_number = street.split(' ', 1)[0]
+        for candidate_id, candidate_name, candidate_street in candidates:
+            if (candidate_street.split(' ', 1)[0] == house_number and
+                    is_similar(name, candidate_name, max_name_distance) and
+                    is_similar(street, candidate_street, max_street_distance)):
+                matches[application_id] = min(
+                    candidate_id, matches.get(application_id, candidate_id))
+    return matches
+
+
+@register_check
+class FuzzyDedupCheck(BaseFraudCheck):
+    """
+    Flags applications with nearly the same name at nearly the same address.
+
+    Catches duplicates that exact dedup misses because of typos, e.g.
+    "Jon Smith, 123 Main St" and "John Smith, 123 Mian Street". Comparing
+    every pair of applications would be quadratic, so each application is
+    only compared with those sharing one of its blocking keys:
+      - the Soundex codes of its first and last names, and its zip code,
+      - its zip code and house number.
+    Blocks larger than max_block_size are sorted by name and street, and an
+    application is only compared with its max_block_size nearest neighbors.
+    Every blocking key includes the zip code, so FraudCheckRunner can
+    partition the check by zip prefix across worker processes.
+
+    Args:
+        max_name_distance (int): The largest edit distance between the full
+            names of matching applications.
+        max_street_distance (int): The largest edit distance between the
+            normalized streets of matching applications.
+        max_block_size (int): The most applications compared with each new
+            application per block.
+    """
+    name = 'fuzzy'
+    scan_fields = ('application_id', 'first_name', 'last_name', 'addr1',
+                   'zip_code')
+    partition_field = 'zip_code'
+    opt_in = True
+
+    def __init__(self, max_name_distance=2, max_street_distance=2,
+                 max_block_size=100):
+        super().__init__(reason=FraudFlag.Reason.SIMILAR_NAME_ADDRESS)
+        self.max_name_distance = max_name_distance
+        self.max_street_distance = max_street_distance
+        self.max_block_size = max_block_size
+        # The scanned applications, by element.
+        self._elements = {}
+        self._application_ids = []
+        self._names = []
+        self._streets = []
+        # The elements of each block, and the sort order of large blocks.
+        self._blocks = {}
+        self._sorted_blocks = {}
+
+    def get_features(self, first_name, last_name, addr1, zip_code):
+        """Returns the compared name and street, and the blocking keys."""
+        name = ' '.join(unidecode.unidecode(
+            '%s %s' % (first_name, last_name)).casefold().split())
+        # Matching applicants at other units of a building are still flagged.
+        street = normalize_street_address(addr1, include_unit=False)
+        block_keys = [('name', soundex(first_name), soundex(last_name),
+                       zip_code)]
+        house_number = street.split(' ', 1)[0]
+        if house_number.isdigit():
+            block_keys.append(('address', zip_code, house_number))
+        return name, street, block_keys
+
+    def observe(self, rows):
+        for row in rows:
+            element = len(self._application_ids)
+            name, street, block_keys = self.get_features(
+                row.first_name, row.last_name, row.addr1, row.zip_code)
+            self._elements[row.application_id] = element
+            self._application_ids.append(row.application_id)
+            self._names.append(name)
+            self._streets.append(street)
+            for block_key in block_keys:
+                self._blocks.setdefault(block_key, array('l')).append(element)
+
+    def get_candidates(self, block_keys, name, street):
+        """Returns the scanned elements to compare with an application."""
+        candidates = set()
+        for block_key in block_keys:
+            members = self._blocks.get(block_key, ())
+            if len(members) > self.max_block_size:
+                members = self._get_neighbors(block_key, name, street)
+            candidates.update(members)
+        return sorted(candidates)
+
+    def _get_neighbors(self, block_key, name, street):
+        if block_key not in self._sorted_blocks:
+            members = sorted(self._blocks[block_key], key=lambda member: (
+                self._names[member], self._streets[member]))
+            self._sorted_blocks[block_key] = (members, [
+                (self._names[member], self._streets[member])
+                for member in members])
+        members, sort_keys = self._sorted_blocks[block_key]
+        position = bisect.bisect_left(sort_keys, (name, street))
+        start = max(0, min(position - self.max_block_size // 2,
+                           len(members) - self.max_block_size))
+        return members[start:start + self.max_block_size]
+
+    def get_flagged(self, new_apps):
+        tasks = []
+        for app in new_apps:
+            name, street, block_keys = self.get_features(
+                app.first_name, app.last_name, app.addr1, app.zip_code)
+            element = self._elements.get(app.application_id)
+            tasks.append((
+                app.application_id, name, street,
+                [(self._application_ids[candidate], self._names[candidate],
+                  self._streets[candidate])
+                 for candidate in self.get_candidates(block_keys, name, street)
+                 if candidate != element]))
+        return find_fuzzy_matches(
+            tasks, self.max_name_distance, self.max_street_distance)
+
+
+class FraudCheckRunner:
+    """
+    Runs fraud checks on batches of new applications.
+
+    The Application table is scanned at most once per runner, the first time
+    run() is called, through one server-side cursor shared by every check
+    that needs it. The same runner may then check any number of batches of
+    new applications.
+
+    With workers > 1, the checks setting partition_field are run in that
+    many worker processes instead, each one holding its own instances of the
+    checks. Each scanned row and new application goes to the worker of its
+    partition, and the workers' results are merged back in the order of the
+    new applications, so they are identical to a serial run. The runner
+    should then be closed, or used as a context manager, to stop them.
+
+    The time spent in each check and the number of applications it flagged
+    are added up in stats, keyed by check name. The time of a partitioned
+    check is the sum of the time spent in each worker.
+
+    Args:
+        checks: The fraud checks to run, in order.
+        stats: Stats of an earlier run to add up onto, if any.
+        workers: The number of worker processes running the partitioned
+            checks, or 1 to run every check in this process.
+    """
+
+    def __init__(self, checks, stats=None, workers=1):
+        self.checks = checks
+        self.stats = {check.name: {'seconds': 0.0, 'num_flagged': 0}
+                      for check in checks}
+        for name, check_stats in (stats or {}).items():
+            if name in self.stats:
+                self.stats[name] = dict(check_stats)
+        self.workers = workers
+        self.partitioned = []
+        if workers > 1:
+            self.partitioned = [check for check in checks
+                                if check.partition_field]
+        self._partitions = []
+        self._scanned = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stops the worker processes, if any."""
+        for partition in self._partitions:
+            partition.shutdown()
+        self._partitions = []
+
+    def _start_partitions(self):
+        # Spawned, see fraud_check_workers. One process per partition keeps
+        # the state of each partition in one place, and runs its calls in
+        # order.
+        context = multiprocessing.get_context('spawn')
+        pickled_checks = pickle.dumps(self.partitioned)
+        self._partitions = [
+            ProcessPoolExecutor(
+                max_workers=1, mp_context=context,
+                initializer=fraud_check_workers.init,
+                initargs=(pickled_checks,))
+            for _ in range(self.workers)]
+
+    def _get_partition(self, value):
+        """Returns the index of the worker handling a partition_field value."""
+        prefix = str(value)[:PARTITION_PREFIX_LENGTH]
+        return zlib.crc32(prefix.encode()) % self.workers
+
+    def scan(self):
+        """Streams all applications once to the checks that need them."""
+        scan_fields = {check: check.get_scan_fields()
+                       for check in self.checks}
+        scanning = [check for check in self.checks if scan_fields[check]]
+        self._scanned = True
+        if self.partitioned:
+            self._start_partitions()
+        if not scanning:
+            return
+
+        fields = sorted(set(itertools.chain.from_iterable(
+            scan_fields.values())))
+        LOGGER.info('#FraudCheckScan: streaming %s to %s...' % (
+            ', '.join(fields), ', '.join(check.name for check in scanning)))
+        rows = Application.objects.values_list(
+            *fields, named=True).iterator(chunk_size=SCAN_CHUNK_SIZE)
+        num_rows = 0
+        observe_futures = []
+        while True:
+            batch = list(itertools.islice(rows, SCAN_CHUNK_SIZE))
+            if not batch:
+                break
+            num_rows += len(batch)
+            for check in scanning:
+                if check in self.partitioned:
+                    observe_futures.extend(
+                        self._observe_partitioned(check, fields, batch))
+                    continue
+                start = time.monotonic()
+                check.observe(batch)
+                self.stats[check.name]['seconds'] += time.monotonic() - start
+        # Raises any error of the workers, rather than checking the new
+        # applications against partitions that missed some rows.
+        for future in observe_futures:
+            future.result()
+        LOGGER.info('#FraudCheckScan: streamed %d applications.' % num_rows)
+
+    def _observe_partitioned(self, check, fields, rows):
+        """Submits rows to the workers, and returns the futures of the calls."""
+        partition_rows = [[] for _ in self._partitions]
+        for row in rows:
+            partition = self._get_partition(
+                getattr(row, check.partition_field))
+            # Plain tuples, since the named tuple class can't be pickled.
+            partition_rows[partition].append(tuple(row))
+        return [partition.submit(fraud_check_workers.observe, check.name,
+                                 fields, rows)
+                for partition, rows in zip(self._partitions, partition_rows)
+                if rows]
+
+    def _get_flagged_partitioned(self, check, new_apps):
+        """Submits new_apps to the workers, and returns the results getter."""
+        partition_apps = [[] for _ in self._partitions]
+        for app in new_apps:
+            partition_apps[self._get_partition(
+                getattr(app, check.partition_field))].append(app)
+        futures = [partition.submit(fraud_check_workers.get_flagged,
+                                    check.name, apps)
+                   for partition, apps in zip(self._partitions, partition_apps)
+                   if apps]
+
+        def get_results():
+            merged = {}
+            for future in futures:
+                flagged, seconds = future.result()
+                merged.update(flagged)
+                self.stats[check.name]['seconds'] += seconds
+            return {app.application_id: merged[app.application_id]
+                    for app in new_apps if app.application_id in merged}
+        return get_results
+
+    def run(self, new_apps):
+        """Sets the status of the new applications failing a check.
+
+        A REJECTED application is never downgraded by a later check. Nothing
+        is saved: pass the results to save_results for that.
+
+        Args:
+            new_apps: The SUBMITTED applications to check.
+
+        Returns:
+            A dict mapping the name of each check to the dict it returned
+            from get_flagged.
+        """
+        if not self._scanned:
+            self.scan()
+        # The workers check their partitions while the other checks run.
+        partitioned_results = {
+            check: self._get_flagged_partitioned(check, new_apps)
+            for check in self.partitioned}
+        results = {}
+        for check in self.checks:
+            if check in partitioned_results:
+                flagged = partitioned_results[check]()
+            else:
+                start = time.monotonic()
+                flagged = check.get_flagged(new_apps)
+                self.stats[check.name]['seconds'] += (
+                    time.monotonic() - start)
+            self.stats[check.name]['num_flagged'] += len(flagged)
+            results[check.name] = flagged
+            for app in new_apps:
+                if app.application_id in flagged:
+                    flag_application(app, check)
+        return results
+
+    def get_fraud_flags(self, results):
+        """Returns unsaved FraudFlags for the results of run()."""
+        return [FraudFlag(application_id=application_id, reason=check.reason)
+                for check in self.checks
+                for application_id in results[check.name]]
+
+    def save_results(self, results):
+        """Saves the FraudFlags and DuplicateClusters for the results of run().
+
+        The statuses of the applications are saved separately.
+        """
+        FraudFlag.bulk_record(self.get_fraud_flags(results))
+        for check in self.checks:
+            if (isinstance(check, BaseDedupCheck) and check.cluster_field
+                    and results[check.name]):
+                DuplicateCluster.bulk_assign(
+                    check.reason, check.cluster_field,
+                    results[check.name].values())
+
+    def log_stats(self):
+        for name, check_stats in self.stats.items():
+            LOGGER.info('#FraudCheckStats: %s flagged %d applications in '
+                        '%.3fs' % (name, check_stats['num_flagged'],
+                                   check_stats['seconds']))
+
+
+def flag_application(app, check):
+    """Sets the status of an application failing a check."""
+    if app.status != Application.ApplicationStatus.REJECTED:
+        app.status = check.new_status
+
+
+def get_preapproved_addresses():
+    """Returns the set of building keys of the preapproved addresses."""
+    return set(PreapprovedAddress.objects.values_list(
+        'address_key', flat=True))
+
+
+def get_fraud_checks(dedup_method=DedupMethod.INDEX):
+    """Returns new instances of the enabled fraud checks.
+
+    Registered checks are enabled unless they are opt_in, in which case they
+    must be listed in CONFIG['optional_fraud_checks'].
+
+    Args:
+        dedup_method: The DedupMethod the dedup checks should prefer.
+    """
+    if (dedup_method == DedupMethod.INDEX and
+            not DedupKeyCount.is_built()):
+        LOGGER.warning('The dedup index is empty, counting with SQL. Run '
+                       './manage.py rebuild_dedup_index.')
+        dedup_method = DedupMethod.SQL
+    optional_checks = CONFIG.get('optional_fraud_checks', ())
+    checks = [check_class() for check_class in FRAUD_CHECKS
+              if not check_class.opt_in or
+              check_class.name in optional_checks]
+    for check in checks:
+        if isinstance(check, BaseDedupCheck):
+            check.dedup_method = dedup_method
+    return checks
+
+
+def get_indexed_dedup_checks():
+    """Returns the dedup checks whose test values are kept in DedupKeyCount."""
+    return [check_class() for check_class in FRAUD_CHECKS
+            if issubclass(check_class, BaseDedupCheck) and check_class.indexed]
+
+
+def get_dedup_keys(application):
+    """Returns the set of (check name, test value) pairs of an application."""
+    keys = {(dedup_check.name, dedup_check.get_test_value(application))
+            for dedup_check in get_indexed_dedup_checks()}
+    return {key for key in keys if key[1] is not None}
+
+
+def rebuild_dedup_index(application_model=Application,
+                        count_model=DedupKeyCount, batch_size=2000):
+    """Recounts the dedup keys of all applications in DedupKeyCount.
+
+    Args:
+        application_model: The Application model, or its historical version
+            in a data migration.
+        count_model: The DedupKeyCount model, or its historical version.
+        batch_size: The number of rows read or written at a time.
+
+    Returns:
+        The number of applications counted.
+    """
+    counts = collections.Counter()
+    num_applications = 0
+    for application in application_model.objects.iterator(
+            chunk_size=batch_size):
+        counts.update(get_dedup_keys(application))
+        num_applications += 1
+    LOGGER.info('Writing %d dedup keys for %d applications...' % (
+        len(counts), num_applications))
+    count_model.objects.all().delete()
+    count_model.objects.bulk_create(
+        (count_model(check_name=check_name, key=key, count=count)
+         for (check_name, key), count in counts.items()),
+        batch_size=batch_size)
+    return num_applications
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# backfill_keys.py
+# See LICENSE for details.
+
+"""
+Run:  ./manage.py backfill_keys [--all]
+
+Sets the normalized address_key and phone_key of applications and preapproved
+addresses loaded in bulk. Rows are updated in batches, each in its own
+transaction, so the command may be interrupted and run again. Pass --all to
+recompute every key, e.g. after get_address_key or get_phone_key changes.
+
+Run ./manage.py rebuild_dedup_index afterwards, since the dedup checks count
+normalized keys. Migrations changing how keys are computed should run both,
+as 0013_rebuild_dedup_index does.
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from app_ccf.models import Application, PreapprovedAddress
+from shared.utils import get_address_key, get_building_key, get_phone_key
+
+# Logging.
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+BATCH_SIZE = 2000
+
+# The key fields of each model, by model name so that data migrations can
+# pass historical models, with the fields they are computed from and how.
+KEY_FIELDS = {
+    'Application': {
+        'address_key': (('addr1', 'zip_code'), get_address_key),
+        'phone_key': (('phone_number', ), get_phone_key),
+    },
+    'PreapprovedAddress': {
+        'address_key': (('addr1', 'zip_code'), get_building_key),
+    },
+}
+
+
+def backfill(model, recompute_all=False):
+    """Sets the key fields of the rows of model, a batch at a time.
+
+    Returns:
+        The number of rows updated.
+    """
+    key_fields = KEY_FIELDS[model.__name__]
+    source_fields = {field for fields, _ in key_fields.values()
+                     for field in fields}
+    queryset = model.objects.order_by('pk').only(
+        'pk', *source_fields, *key_fields)
+    if not recompute_all:
+        missing = Q()
+        for key_field in key_fields:
+            missing |= Q(**{key_field: ''})
+        queryset = queryset.filter(missing)
+    num_updated = 0
+    last_pk = None
+    while True:
+        batch = queryset
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch[:BATCH_SIZE])
+        if not batch:
+            return num_updated
+
+        changed = []
+        for row in batch:
+            is_changed = False
+            for key_field, (fields, get_key) in key_fields.items():
+                key = get_key(*(getattr(row, field) for field in fields))
+                if getattr(row, key_field) != key:
+                    setattr(row, key_field, key)
+                    is_changed = True
+            if is_changed:
+                changed.append(row)
+        with transaction.atomic():
+            model.objects.bulk_update(changed, list(key_fields))
+        num_updated += len(changed)
+        last_pk = batch[-1].pk
+        LOGGER.info('%s: updated %d rows...' % (model.__name__, num_updated))
+
+
+class Command(BaseCommand):
+
+    help = 'Sets the normalized address and phone keys of existing rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Recompute every key, not just missing ones.')
+
+    def handle(self, *args, **kwargs):
+        for model in (Application, PreapprovedAddress):
+            num_updated = backfill(model, recompute_all=kwargs['all'])
+            LOGGER.info('%s: done, updated %d rows.' % (
+                model.__name__, num_updated))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# benchmark_fraud_checks.py
+# See LICENSE for details.
+
+"""
+Run:  ./manage.py benchmark_fraud_checks --workers=3 [--limit=100000]
+
+Runs the fraud checks on the SUBMITTED applications twice without saving
+anything, once in this process and once with the partitioned checks spread
+over --workers processes. Prints the time each run took and the speedup, and
+fails if the two runs didn't flag exactly the same applications.
+"""
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app_ccf.common import AUTO_PROCESS_CHUNK_SIZE
+from app_ccf.fraud_checks import (
+    DedupMethod,
+    FraudCheckRunner,
+    get_fraud_checks,
+)
+from app_ccf.models import Application
+
+
+class Command(BaseCommand):
+
+    help = ('Compares the fraud checks run serially and in parallel on the '
+            'new applications, without changing them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2,
+                            help='The number of processes of the parallel run.')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Only checks this many new applications.')
+        parser.add_argument('--dedup-method', type=str, default='index',
+                            choices=[method.name.lower()
+                                     for method in DedupMethod],
+                            help='How the dedup checks count duplicates.')
+
+    def handle(self, *args, **kwargs):
+        dedup_method = DedupMethod[kwargs['dedup_method'].upper()]
+        serial_seconds, serial_results = self._run(
+            1, dedup_method, kwargs['limit'])
+        parallel_seconds, parallel_results = self._run(
+            kwargs['workers'], dedup_method, kwargs['limit'])
+
+        self.stdout.write('serial:   %10.3fs' % serial_seconds)
+        self.stdout.write('parallel: %10.3fs with %d workers' % (
+            parallel_seconds, kwargs['workers']))
+        self.stdout.write('speedup:  %10.2fx' % (
+            serial_seconds / max(parallel_seconds, 1e-9)))
+        if serial_results != parallel_results:
+            raise CommandError('The parallel run flagged other applications.')
+        self.stdout.write('Both runs flagged the same applications.')
+
+    def _run(self, workers, dedup_method, limit):
+        """Returns the seconds the checks took, and the results of each chunk."""
+        new_apps = Application.objects.filter(
+            status=Application.ApplicationStatus.SUBMITTED).order_by(
+                'submitted_date', 'application_id')
+        new_apps = list(new_apps[:limit] if limit else new_apps)
+
+        start = time.monotonic()
+        with FraudCheckRunner(get_fraud_checks(dedup_method),
+                              workers=workers) as runner:
+            results = [
+                runner.run(new_apps[i:i + AUTO_PROCESS_CHUNK_SIZE])
+                for i in range(0, len(new_apps), AUTO_PROCESS_CHUNK_SIZE)]
+        seconds = time.monotonic() - start
+        runner.log_stats()
+        return seconds, results
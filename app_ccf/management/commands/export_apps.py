@@ -29,7 +29,8 @@ TABLES = {
 
 def write_table(name, metadata, timestamp):
     applications = Application.objects.filter(
-        status=metadata['status']).order_by('-submitted_date')
+        status=metadata['status']).order_by(
+            '-submitted_date').prefetch_related('fraud_flags')
 
     if len(applications) == 0:
         LOGGER.info('No applications with status "%s" to export.', name)
@@ -54,6 +55,8 @@ def write_table(name, metadata, timestamp):
             ('USPS Verified', application.usps_standardized),
             ('USPS Standardized', application.usps_standardized),
             ('Status', application.status),
+            ('Flags', '; '.join(flag.get_reason_display()
+                                for flag in application.fraud_flags.all())),
             ('Note', application.note),
         ])
         rows.append(data)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# fraud_check_report.py
+# See LICENSE for details.
+
+"""
+Run:  ./manage.py fraud_check_report [--max-duplicates=address=5]
+
+Runs the fraud checks on the SUBMITTED applications without saving anything,
+and prints how many applications each check would flag and how many would get
+each status. Use --max-duplicates to try out other thresholds for the dedup
+checks, e.g. before changing AddressDedupCheck.
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from app_ccf.common import (
+    AUTO_PROCESS_CHUNK_SIZE,
+    DedupMethod,
+    auto_update_application_statuses,
+)
+
+
+class Command(BaseCommand):
+
+    help = ('Reports what auto-processing would do to the new applications, '
+            'without changing them.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-duplicates', action='append', default=[],
+                            metavar='CHECK=N',
+                            help=('Overrides the max_duplicates of a dedup '
+                                  'check, e.g. address=5. May be repeated.'))
+        parser.add_argument('--dedup-method', type=str, default='index',
+                            choices=[method.name.lower()
+                                     for method in DedupMethod],
+                            help='How the dedup checks count duplicates.')
+        parser.add_argument('--workers', type=int, default=1,
+                            help=('The number of processes running the '
+                                  'checks that can be partitioned.'))
+
+    def handle(self, *args, **kwargs):
+        max_duplicates = {}
+        for override in kwargs['max_duplicates']:
+            name, _, value = override.partition('=')
+            try:
+                max_duplicates[name] = int(value)
+            except ValueError:
+                raise CommandError('Invalid --max-duplicates: %s' % override)
+
+        try:
+            report = auto_update_application_statuses(
+                dedup_method=DedupMethod[kwargs['dedup_method'].upper()],
+                chunk_size=AUTO_PROCESS_CHUNK_SIZE,
+                dry_run=True,
+                max_duplicates=max_duplicates,
+                workers=kwargs['workers'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write('%d new applications' % report['num_applications'])
+        self.stdout.write('\nBy check:')
+        for name, check_stats in report['by_check'].items():
+            self.stdout.write('  %-20s %8d flagged %10.3fs' % (
+                name, check_stats['num_flagged'], check_stats['seconds']))
+        self.stdout.write('\nBy status:')
+        for status, count in sorted(report['by_status'].items()):
+            self.stdout.write('  %-20s %8d' % (status, count))
@@ -1,4 +1,4 @@
-j#!/usr/bin/env python
+#!/usr/bin/env python
 # generate_voucher_codes.py
 # See LICENSE for details.
 
@@ -9,7 +9,7 @@ import logging
 
 from django.core.management.base import BaseCommand
 
-from app_ccf.common import generate_voucher_codes
+from staff.utils import generate_voucher_codes
 
 # Logging.
 LOGGER = logging.getLogger(__name__)
@@ -3,20 +3,33 @@
 # See LICENSE for details.
 
 """
-Run:  ./manage.py import_voucher_codes <filename>
+Run:  ./manage.py import_voucher_codes <filename> --affiliate <affiliate> \
+        --campaign <campaign> [--channel <channel>] [--amount <amount>]
 
 Args:
     filename: A file with a list of codes to be imported, each on a new line.
         Codes must be between 1 and 20 characters and can only contain
-        characters in [A-Z0-9].
+        characters in [A-Za-z0-9].
+
+The codes are added to a new VoucherCodeBatch. Invalid lines and codes that
+already exist are skipped and counted. Nothing is added if no code can be.
 """
+import getpass
 import logging
 from datetime import datetime, timedelta, timezone
 
 from django.core.exceptions import ValidationError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Max
+from django.db.models.functions import Length
 
-from app_ccf.models import VoucherCode
+from app_ccf.models import VoucherCodeBatch
+from staff.utils import (
+    get_batch_alphabet,
+    import_voucher_codes,
+    summarize_voucher_codes,
+)
 
 # Logging.
 LOGGER = logging.getLogger(__name__)
@@ -32,13 +45,15 @@ class Command(BaseCommand):
                             help=('A file with a list of codes to be imported, '
                                   'each on a new line. Codes must be between 1 '
                                   'and 20 characters and can contain '
-                                  'characters in [A-Z0-9].'))
+                                  'characters in [A-Za-z0-9].'))
         parser.add_argument('--amount', type=int, default=400,
                             help=('The dollar amount to be paid.'))
         parser.add_argument('--affiliate', type=str, required=True,
                             help='The associated affiliate.')
         parser.add_argument('--campaign', type=str, required=True,
                             help='The associated campaign.')
+        parser.add_argument('--channel', type=str, default='',
+                            help='The associated channel.')
         expiration_group = parser.add_mutually_exclusive_group()
         expiration_group.add_argument('--exp-on-date', type=str,
                                       help=('The expiration date, format '
@@ -59,6 +74,7 @@ class Command(BaseCommand):
         amount = kwargs['amount']
         affiliate = kwargs['affiliate']
         campaign = kwargs['campaign']
+        channel = kwargs['channel']
         if kwargs['exp_on_date']:
             expiration_date = datetime.strptime(
                 kwargs['exp_on_date'],
@@ -70,38 +86,43 @@ class Command(BaseCommand):
                 timezone.utc) + timedelta(days=exp_days_from_now)
 
         LOGGER.info('Uploading codes with amount [%d], '
-                    'affiliate ["%s"], campaign ["%s"], expiration [%s]...' % (
-                        amount, affiliate, campaign,
+                    'affiliate ["%s"], campaign ["%s"], channel ["%s"], '
+                    'expiration [%s]...' % (
+                        amount, affiliate, campaign, channel,
                         expiration_date)
                     )
-        num_valid_codes = 0
-        num_invalid_codes = 0
-        with open(filename, 'r') as f:
-            voucher_codes_to_write = []
-            for line in f:
-                voucher_code_str = line.strip()
-                voucher_code = VoucherCode(
-                    code=voucher_code_str,
-                    amount=amount,
-                    expiration_date=expiration_date,
-                    affiliate=affiliate,
-                    campaign=campaign,
-                    is_active=True,
-                )
-                try:
-                    voucher_code.full_clean()  # Validate code format
-                except ValidationError as e:
-                    LOGGER.error('Error importing code \'%s\': %s' % (
-                        voucher_code_str, str(e)))
-                    num_invalid_codes += 1
-                else:
-                    voucher_codes_to_write.append(voucher_code)
-                    LOGGER.info('Imported code \'%s\'.' % voucher_code_str)
-                    num_valid_codes += 1
-
-        LOGGER.info('Writing %d codes to database (%d invalid)...' %
-                    (num_valid_codes, num_invalid_codes))
-        VoucherCode.objects.bulk_create(voucher_codes_to_write)
-
-        LOGGER.info('Done.')
-        LOGGER.debug('Current codes: %s' % VoucherCode.objects.filter())
+        summary = summarize_voucher_codes(filename)
+        if not summary.num_codes:
+            raise CommandError('No valid codes in %s.' % filename)
+        with transaction.atomic():
+            batch = VoucherCodeBatch(
+                user=getpass.getuser()[:20],
+                num_codes=summary.num_codes,
+                code_length=summary.code_length,
+                alphabet=summary.alphabet,
+                base_amount=amount,
+                expiration_date=expiration_date,
+                affiliate=affiliate,
+                campaign=campaign,
+                channel=channel,
+            )
+            # The channel is optional here, and created is set on save.
+            try:
+                batch.full_clean(exclude=['created', 'channel'])
+            except ValidationError as e:
+                raise CommandError(str(e))
+            batch.save()
+            counts = import_voucher_codes(filename, batch)
+            if not counts.num_imported:
+                # Rolls the batch back with the transaction.
+                raise CommandError('All the codes in %s already exist.' %
+                                   filename)
+            if counts.num_duplicates:
+                # The skipped codes were counted in the summary.
+                batch.num_codes = counts.num_imported
+                batch.code_length = batch.vouchercode_set.aggregate(
+                    length=Max(Length('code')))['length']
+                batch.alphabet = get_batch_alphabet(batch)
+                batch.save()
+        LOGGER.info('Added %d codes to batch %d.' % (
+            counts.num_imported, batch.pk))
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# link_voucher_codes.py
+# See LICENSE for details.
+
+"""
+Run:  ./manage.py link_voucher_codes [--verify]
+
+Links the applications submitted before VoucherCode.application existed to
+the VoucherCode matching their vouchercode_str. Applications are linked in
+batches, oldest first, each batch in its own transaction, so the command may
+be interrupted and run again. When two applications used the same code, the
+first one submitted gets it.
+
+With --verify, nothing is linked. The command fails if any application is
+still waiting to be linked, and otherwise CONFIG['legacy_vouchercode_fallback']
+may be turned off.
+"""
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from app_ccf.models import Application, VoucherCode
+
+# Logging.
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+BATCH_SIZE = 2000
+
+
+def get_unlinked_applications():
+    """Returns the applications whose code exists but isn't linked to them.
+
+    These are the applications that only the legacy fallback of
+    VoucherCode.verify_code keeps from having their code redeemed again.
+    """
+    return Application.objects.filter(
+        vouchercode__isnull=True,
+        vouchercode_str__in=VoucherCode.objects.filter(
+            application__isnull=True).values('code'))
+
+
+def link_voucher_codes():
+    """Links unlinked applications to their VoucherCode, a batch at a time.
+
+    Returns:
+        A 3-tuple of the number of applications linked, the number whose code
+        doesn't exist, and the number whose code was used by another
+        application.
+    """
+    queryset = Application.objects.filter(
+        vouchercode__isnull=True).order_by(
+            'submitted_date', 'application_id').only(
+                'application_id', 'submitted_date', 'vouchercode_str')
+    num_linked = num_missing = num_conflicts = 0
+    checkpoint = None
+    while True:
+        batch = queryset
+        if checkpoint is not None:
+            submitted_date, application_id = checkpoint
+            batch = batch.filter(
+                Q(submitted_date__gt=submitted_date) |
+                Q(submitted_date=submitted_date,
+                  application_id__gt=application_id))
+        batch = list(batch[:BATCH_SIZE])
+        if not batch:
+            return num_linked, num_missing, num_conflicts
+
+        codes = VoucherCode.objects.filter(
+            code__in={application.vouchercode_str for application in batch}
+        ).only('code', 'application_id').in_bulk()
+        linked = []
+        for application in batch:
+            code = codes.get(application.vouchercode_str)
+            if code is None:
+                num_missing += 1
+            elif code.application_id is not None:
+                LOGGER.warning('Code %s of application %s is already used by '
+                               'application %s.' % (
+                                   code.code, application.application_id,
+                                   code.application_id))
+                num_conflicts += 1
+            else:
+                code.application_id = application.application_id
+                linked.append(code)
+        with transaction.atomic():
+            VoucherCode.objects.bulk_update(linked, ['application'])
+        num_linked += len(linked)
+        checkpoint = (batch[-1].submitted_date, batch[-1].application_id)
+        LOGGER.info('Linked %d applications...' % num_linked)
+
+
+class Command(BaseCommand):
+
+    help = 'Links legacy applications to their voucher codes.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true',
+                            help=('Only check that every application is '
+                                  'linked.'))
+
+    def handle(self, *args, **kwargs):
+        if kwargs['verify']:
+            num_unlinked = get_unlinked_applications().count()
+            if num_unlinked:
+                raise CommandError(
+                    '%d applications are not linked to their code yet.' %
+                    num_unlinked)
+            self.stdout.write('Every application is linked to its code. The '
+                              'legacy_vouchercode_fallback may be turned off.')
+            return
+
+        num_linked, num_missing, num_conflicts = link_voucher_codes()
+        LOGGER.info('Done, linked %d applications. %d have no code, and %d '
+                    'used a code already used.' % (
+                        num_linked, num_missing, num_conflicts))
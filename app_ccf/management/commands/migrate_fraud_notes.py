@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# migrate_fraud_notes.py
+# See LICENSE for details.
+
+"""
+Run:  ./manage.py migrate_fraud_notes
+
+Moves the fraud check reasons that auto-processing used to append to
+Application.note, e.g. "duplicate address; duplicate first/last/phone", into
+FraudFlags. Whatever else staff wrote in the note is kept. Applications are
+updated in batches, each in its own transaction, so the command may be
+interrupted and run again.
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from app_ccf.models import Application, FraudFlag
+
+# Logging.
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+BATCH_SIZE = 2000
+
+# The separator the fraud checks appended reasons to notes with.
+NOTE_SEPARATOR = '; '
+
+
+def split_note(note):
+    """Returns the FraudFlag reasons in a note, and the rest of the note."""
+    reasons_by_label = {label: reason
+                        for reason, label in FraudFlag.Reason.choices}
+    reasons = []
+    rest = []
+    for part in note.split(NOTE_SEPARATOR):
+        if part in reasons_by_label:
+            reasons.append(reasons_by_label[part])
+        else:
+            rest.append(part)
+    return reasons, NOTE_SEPARATOR.join(rest)
+
+
+def migrate_notes():
+    """Moves the reasons in notes into FraudFlags, a batch at a time.
+
+    Returns:
+        The number of applications updated.
+    """
+    has_reason = Q()
+    for _, label in FraudFlag.Reason.choices:
+        has_reason |= Q(note__contains=label)
+    queryset = Application.objects.filter(has_reason).order_by('pk').only(
+        'pk', 'note')
+    num_updated = 0
+    last_pk = None
+    while True:
+        batch = queryset
+        if last_pk is not None:
+            batch = batch.filter(pk__gt=last_pk)
+        batch = list(batch[:BATCH_SIZE])
+        if not batch:
+            return num_updated
+
+        flags = []
+        changed = []
+        for application in batch:
+            reasons, note = split_note(application.note)
+            if not reasons:
+                continue
+            flags.extend(FraudFlag(application=application, reason=reason)
+                         for reason in reasons)
+            application.note = note
+            changed.append(application)
+        with transaction.atomic():
+            FraudFlag.bulk_record(flags)
+            Application.objects.bulk_update(changed, ['note'])
+        num_updated += len(changed)
+        last_pk = batch[-1].pk
+        LOGGER.info('Migrated the notes of %d applications...' % num_updated)
+
+
+class Command(BaseCommand):
+
+    help = 'Moves fraud check reasons from application notes into flags.'
+
+    def handle(self, *args, **kwargs):
+        num_updated = migrate_notes()
+        LOGGER.info('Done, migrated the notes of %d applications.' %
+                    num_updated)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+# rebuild_dedup_index.py
+# See LICENSE for details.
+
+"""
+Run:  ./manage.py rebuild_dedup_index
+
+Recounts the dedup check test values of all applications. Migrating runs
+this once for existing applications. After that it is only needed when
+applications were loaded in bulk (e.g. with bulk_create) or when a dedup
+check changes how it computes its test value, since saving an application
+keeps the counts up to date.
+"""
+import logging
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app_ccf.fraud_checks import rebuild_dedup_index
+
+# Logging.
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+BATCH_SIZE = 2000
+
+
+class Command(BaseCommand):
+
+    help = 'Recounts the dedup keys of all applications.'
+
+    @transaction.atomic
+    def handle(self, *args, **kwargs):
+        LOGGER.info('Counting dedup keys...')
+        rebuild_dedup_index(batch_size=BATCH_SIZE)
+        LOGGER.info('Done.')
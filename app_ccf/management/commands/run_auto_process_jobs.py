@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# run_auto_process_jobs.py
+# See LICENSE for details.
+
+"""
+Run:  ./manage.py run_auto_process_jobs [--once] [--poll-interval <seconds>]
+
+Worker for the auto-processing jobs queued from the staff portal payments
+page. Keep one running alongside the web server, as the `worker` process of
+the Procfile does on Elastic Beanstalk, or run it with --once from cron.
+Several workers may run at the same time; each job is only claimed by one of
+them.
+"""
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from app_ccf.common import run_auto_process_job
+from app_ccf.models import AutoProcessJob
+
+# Logging.
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.INFO)
+
+
+class Command(BaseCommand):
+
+    help = 'Runs the queued auto-processing jobs.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help=('Exit once there are no more queued jobs '
+                                  'instead of waiting for new ones.'))
+        parser.add_argument('--poll-interval', type=int, default=10,
+                            help=('The number of seconds to wait between '
+                                  'checks for new jobs.'))
+
+    def handle(self, *args, **kwargs):
+        LOGGER.info('Waiting for auto-processing jobs...')
+        while True:
+            job = AutoProcessJob.claim_next()
+            if job is not None and run_auto_process_job(job):
+                continue
+            # No job, or the job was queued again until auto-processing
+            # running elsewhere is done.
+            if kwargs['once']:
+                break
+            time.sleep(kwargs['poll_interval'])
+        LOGGER.info('Done.')
@@ -10,10 +10,10 @@ Update the status of a list of application IDs from a file. For example:
 
 
 """
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 
 from app_ccf.models import Application
-from app_ccf.common import update_application_statuses
+from app_ccf.common import AlreadyRunningError, update_application_statuses
 
 
 class Command(BaseCommand):
@@ -37,4 +37,7 @@ class Command(BaseCommand):
         with open(filename, 'r') as f:
             application_ids = [line.strip() for line in f]
 
-        update_application_statuses(application_ids, status)
+        try:
+            update_application_statuses(application_ids, status)
+        except AlreadyRunningError:
+            raise CommandError('Another status update is already running.')
@@ -0,0 +1,26 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_ccf', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DedupKeyCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('check_name', models.CharField(max_length=50)),
+                ('key', models.TextField()),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='dedupkeycount',
+            constraint=models.UniqueConstraint(fields=('check_name', 'key'), name='unique dedup key'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_ccf', '0002_dedupkeycount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AutoProcessJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user', models.CharField(blank=True, max_length=20)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('started', models.DateTimeField(null=True)),
+                ('finished', models.DateTimeField(null=True)),
+                ('heartbeat', models.DateTimeField(null=True)),
+                ('num_total', models.IntegerField(default=0)),
+                ('num_processed', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+            ],
+        ),
+    ]
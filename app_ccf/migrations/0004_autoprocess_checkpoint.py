@@ -0,0 +1,27 @@
+# Generated by Django 3.0.14 on 2026-10-18 12:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_ccf', '0003_autoprocessjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autoprocessjob',
+            name='checkpoint_application_id',
+            field=models.UUIDField(null=True),
+        ),
+        migrations.AddField(
+            model_name='autoprocessjob',
+            name='checkpoint_submitted_date',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddIndex(
+            model_name='application',
+            index=models.Index(fields=['status', 'submitted_date'], name='app_ccf_app_status_081012_idx'),
+        ),
+    ]
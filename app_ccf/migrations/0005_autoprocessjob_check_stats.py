@@ -0,0 +1,19 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:02
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_ccf', '0004_autoprocess_checkpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='autoprocessjob',
+            name='check_stats',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_ccf', '0005_autoprocessjob_check_stats'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vouchercodeattempt',
+            name='code',
+            field=models.CharField(db_index=True, max_length=20),
+        ),
+    ]
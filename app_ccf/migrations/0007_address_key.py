@@ -0,0 +1,23 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_ccf', '0006_vouchercodeattempt_code_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='address_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='preapprovedaddress',
+            name='address_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+    ]
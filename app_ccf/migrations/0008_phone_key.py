@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_ccf', '0007_address_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='application',
+            name='phone_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=20),
+        ),
+    ]
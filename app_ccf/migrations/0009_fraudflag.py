@@ -0,0 +1,27 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_ccf', '0008_phone_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FraudFlag',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.PositiveSmallIntegerField(choices=[(1, 'duplicate address'), (2, 'duplicate first/last/phone'), (3, 'possible fraud ring'), (4, 'code guessing from submitting IP'), (5, 'similar name and address')], db_index=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('application', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fraud_flags', to='app_ccf.Application')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='fraudflag',
+            constraint=models.UniqueConstraint(fields=('application', 'reason'), name='unique_fraud_flag_reason'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:20
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_ccf', '0009_fraudflag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DuplicateCluster',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.PositiveSmallIntegerField(choices=[(1, 'duplicate address'), (2, 'duplicate first/last/phone'), (3, 'possible fraud ring'), (4, 'code guessing from submitting IP'), (5, 'similar name and address')])),
+                ('key', models.CharField(max_length=255)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('is_reviewed', models.BooleanField(default=False)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='duplicatecluster',
+            index=models.Index(fields=['is_reviewed', 'created'], name='app_ccf_dup_is_revi_c57ee3_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='duplicatecluster',
+            constraint=models.UniqueConstraint(fields=('reason', 'key'), name='unique_duplicate_cluster_key'),
+        ),
+        migrations.AddField(
+            model_name='application',
+            name='duplicate_cluster',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='members', to='app_ccf.DuplicateCluster'),
+        ),
+    ]
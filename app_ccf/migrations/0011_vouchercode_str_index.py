@@ -0,0 +1,18 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app_ccf', '0010_duplicatecluster'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='application',
+            name='vouchercode_str',
+            field=models.CharField(db_index=True, max_length=200),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.0.14 on 2026-10-18 13:24
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # Built concurrently so that codes can still be redeemed meanwhile.
+    atomic = False
+
+    dependencies = [
+        ('app_ccf', '0011_vouchercode_str_index'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='vouchercode',
+            index=models.Index(condition=models.Q(('application__isnull', True), ('is_active', True)), fields=['code'], name='vouchercode_redeemable_idx'),
+        ),
+    ]
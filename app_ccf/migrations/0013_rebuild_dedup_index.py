@@ -0,0 +1,31 @@
+from django.db import migrations, transaction
+
+
+def backfill_keys(apps, schema_editor):
+    # Imported here, since the keys are computed with the current code.
+    from app_ccf.management.commands.backfill_keys import backfill
+    for model_name in ('Application', 'PreapprovedAddress'):
+        backfill(apps.get_model('app_ccf', model_name), recompute_all=True)
+
+
+def rebuild_dedup_index(apps, schema_editor):
+    from app_ccf.fraud_checks import rebuild_dedup_index
+    with transaction.atomic():
+        rebuild_dedup_index(
+            application_model=apps.get_model('app_ccf', 'Application'),
+            count_model=apps.get_model('app_ccf', 'DedupKeyCount'))
+
+
+class Migration(migrations.Migration):
+
+    # The keys are backfilled a batch at a time, each in its own transaction.
+    atomic = False
+
+    dependencies = [
+        ('app_ccf', '0012_vouchercode_redeemable_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_keys, migrations.RunPython.noop),
+        migrations.RunPython(rebuild_dedup_index, migrations.RunPython.noop),
+    ]
@@ -4,14 +4,29 @@ from django.conf import settings
 from django.utils.translation import ugettext_lazy as _
 from django.core.files.storage import FileSystemStorage
 from django.core.validators import EmailValidator, MinValueValidator, RegexValidator
-from django.contrib.postgres.fields import ArrayField
-from django.db import transaction
+from django.contrib.postgres.fields import ArrayField, JSONField
+from django.db import connection, transaction
+from psycopg2.extras import execute_values
 
-from datetime import datetime, timezone
+import collections
+from datetime import datetime, timedelta, timezone
 import uuid
 
-from shared.utils import no_special_chars_validator, street_address_validator
+from shared.utils import (
+    PHONE_KEY_MAX_LENGTH,
+    TTLCache,
+    get_address_key,
+    get_building_key,
+    get_phone_key,
+    no_special_chars_validator,
+    street_address_validator,
+)
 from shared.common import TypeOfWork
+from app_ccf.config import CONFIG
+
+
+# The number of rows written per statement by bulk operations.
+BULK_BATCH_SIZE = 1000
 
 
 def get_datetime_now_utc():
@@ -66,7 +81,25 @@ class Application(models.Model):
     @transaction.atomic
     def bulk_update_status(cls, applications, new_status):
         """Bulk updates the status of a list of Applications."""
+        for app in applications:
+            app.status = new_status
+        cls.bulk_save_statuses(applications)
+
+    @classmethod
+    @transaction.atomic
+    def bulk_save_statuses(cls, applications):
+        """Bulk saves the statuses of a list of Applications.
+
+        Applications are grouped by their new status so that each group is
+        written with a single UPDATE, followed by batched inserts of the
+        StatusUpdate history.
+
+        Args:
+            applications: The Applications to save, with their new statuses
+                already set.
+        """
         datetime_now_utc = datetime.now(timezone.utc)
+        ids_by_status = collections.defaultdict(list)
         status_updates = []
 
         for app in applications:
@@ -76,21 +109,23 @@ class Application(models.Model):
                     app.application_id)
 
             # We need to duplicate the save() logic a little bit here because
-            # bulk_update doesn't call save().
-            if app._last_status != new_status:
-                app.status = new_status
+            # bulk updates don't call save().
+            if app._last_status != app.status:
                 app.status_last_modified = datetime_now_utc
+                ids_by_status[app.status].append(app.application_id)
                 status_updates.append(
-                    StatusUpdate(status=new_status, date=datetime_now_utc,
+                    StatusUpdate(status=app.status, date=datetime_now_utc,
                                  application=app)
                 )
 
-        cls.objects.bulk_update(
-            applications, ['status', 'status_last_modified'], batch_size=30)
-        StatusUpdate.objects.bulk_create(status_updates, batch_size=30)
+        for status, application_ids in ids_by_status.items():
+            cls.objects.filter(pk__in=application_ids).update(
+                status=status, status_last_modified=datetime_now_utc)
+        StatusUpdate.objects.bulk_create(
+            status_updates, batch_size=BULK_BATCH_SIZE)
 
         for app in applications:
-            app._last_status = new_status
+            app._last_status = app.status
 
     @transaction.atomic
     def save(self, *args, **kwargs):
@@ -102,6 +137,8 @@ class Application(models.Model):
             self.status_last_modified = datetime_now_utc
             StatusUpdate(status=self.status, date=datetime_now_utc,
                          application=self).save()
+        self.address_key = get_address_key(self.addr1, self.zip_code)
+        self.phone_key = get_phone_key(self.phone_number)
         self.full_clean()
         super().save(*args, **kwargs)
 
@@ -119,7 +156,9 @@ class Application(models.Model):
         default=TypeOfWork.HOUSE_CLEANING,
         blank=True,
     )
-    vouchercode_str = models.CharField(max_length=200)
+    # Indexed for the legacy fallback of VoucherCode.verify_code, until every
+    # application is linked to its VoucherCode. See link_voucher_codes.
+    vouchercode_str = models.CharField(max_length=200, db_index=True)
     first_name = models.CharField(max_length=200)
     last_name = models.CharField(max_length=200)
     payment_confirmed_reminder_sent = models.BooleanField(default=False)
@@ -159,6 +198,9 @@ class Application(models.Model):
     # https://stackoverflow.com/questions/14894899/what-is-the-minimum-length-of-a-valid-international-phone-number
     phone_number = models.CharField(max_length=50, validators=[
                                     RegexValidator("^[+][0-9]{8,}$", _('phone_number_incorrect_format'))])
+    # The phone_number in E.164 form, set on save. See get_phone_key.
+    phone_key = models.CharField(max_length=PHONE_KEY_MAX_LENGTH, blank=True,
+                                 db_index=True, editable=False)
     email = models.EmailField(blank=True, validators=[EmailValidator()])
     addr1 = models.CharField(max_length=200, validators=[
                              street_address_validator()])
@@ -168,6 +210,9 @@ class Application(models.Model):
                             no_special_chars_validator()])
     state = models.CharField(max_length=100)
     zip_code = models.CharField(max_length=5)
+    # The normalized addr1 and zip_code, set on save. See get_address_key.
+    address_key = models.CharField(max_length=255, blank=True, db_index=True,
+                                   editable=False)
     # True if the user provided a verified USPS address.
     usps_verified = models.BooleanField(default=False)
     # True if the user selected a standardized version of the address.
@@ -183,6 +228,17 @@ class Application(models.Model):
     )
     status_last_modified = models.DateTimeField(null=True)
     note = models.CharField(max_length=200, blank=True)
+    # The applications sharing this one's address, if a dedup check flagged
+    # any of them. See DuplicateCluster.
+    duplicate_cluster = models.ForeignKey(
+        'DuplicateCluster', on_delete=models.SET_NULL, null=True, blank=True,
+        editable=False, related_name='members')
+
+    class Meta:
+        indexes = [
+            # Lets auto-processing stream the SUBMITTED applications in order.
+            models.Index(fields=['status', 'submitted_date']),
+        ]
 
 
 class StatusUpdate(models.Model):
@@ -195,6 +251,117 @@ class StatusUpdate(models.Model):
     date = models.DateTimeField(auto_now_add=True)
 
 
+class FraudFlag(models.Model):
+    """
+    Records that a fraud check flagged an application, and why.
+
+    Written in bulk by auto-processing, at most once per application and
+    reason. Indexed by reason, so that staff can list e.g. every application
+    flagged for a duplicate address.
+
+    Fields:
+      application: The flagged application.
+      reason: The Reason of the fraud check that flagged it.
+      created: The date the application was flagged.
+    """
+    class Reason(models.IntegerChoices):
+        DUPLICATE_ADDRESS = 1, 'duplicate address'
+        DUPLICATE_NAME_PHONE = 2, 'duplicate first/last/phone'
+        FRAUD_RING = 3, 'possible fraud ring'
+        CODE_GUESSING = 4, 'code guessing from submitting IP'
+        SIMILAR_NAME_ADDRESS = 5, 'similar name and address'
+
+    application = models.ForeignKey(
+        Application, on_delete=models.CASCADE, related_name='fraud_flags')
+    reason = models.PositiveSmallIntegerField(
+        choices=Reason.choices, db_index=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['application', 'reason'],
+                                    name='unique_fraud_flag_reason'),
+        ]
+
+    @classmethod
+    def bulk_record(cls, flags):
+        """Saves new FraudFlags, skipping the ones already recorded."""
+        cls.objects.bulk_create(
+            flags, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+
+
+class DuplicateCluster(models.Model):
+    """
+    A group of applications sharing the test value of a dedup check, at least
+    one of which the check flagged, for staff to review together.
+
+    Saved by auto-processing as the check flags applications. Every
+    application sharing the value, flagged or not, is linked to the cluster
+    through Application.duplicate_cluster.
+
+    Fields:
+      reason: The FraudFlag.Reason of the dedup check.
+      key: The test value the members share, e.g. their address key.
+      created: The date the first member was flagged.
+      is_reviewed: Whether staff reviewed the cluster since a member was last
+        flagged.
+    """
+    reason = models.PositiveSmallIntegerField(choices=FraudFlag.Reason.choices)
+    key = models.CharField(max_length=255)
+    created = models.DateTimeField(auto_now_add=True)
+    is_reviewed = models.BooleanField(default=False)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['reason', 'key'],
+                                    name='unique_duplicate_cluster_key'),
+        ]
+        indexes = [
+            # Lets staff page through the clusters left to review.
+            models.Index(fields=['is_reviewed', 'created']),
+        ]
+
+    @classmethod
+    @transaction.atomic
+    def bulk_assign(cls, reason, key_field, keys):
+        """Links the applications sharing each key to the key's cluster.
+
+        Clusters are created as needed, and those with new members are marked
+        for review again. The applications are linked by one UPDATE joining
+        the clusters, with the keys passed as a single array, so the
+        statement doesn't grow with the number of keys.
+
+        Args:
+            reason: The FraudFlag.Reason of the dedup check.
+            key_field: The indexed Application field holding the test value
+                of the dedup check.
+            keys: The test values of the flagged applications.
+        """
+        keys = set(keys)
+        if not keys:
+            return
+        cls.objects.bulk_create(
+            [cls(reason=reason, key=key) for key in keys],
+            batch_size=BULK_BATCH_SIZE, ignore_conflicts=True)
+        cls.objects.filter(reason=reason, key__in=keys).update(
+            is_reviewed=False)
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'UPDATE {application} '
+                'SET {cluster_column} = cluster.id '
+                'FROM {cluster} AS cluster '
+                'WHERE cluster.reason = %s AND cluster.key = ANY(%s) '
+                'AND {application}.{key_column} = cluster.key'.format(
+                    application=quote_name(Application._meta.db_table),
+                    cluster=quote_name(cls._meta.db_table),
+                    cluster_column=quote_name(Application._meta.get_field(
+                        'duplicate_cluster').column),
+                    key_column=quote_name(
+                        Application._meta.get_field(key_field).column)),
+                [reason, sorted(keys)])
+
+
 class VoucherCodeBatch(models.Model):
     """
     Captures a batch of generated codes created together with common properties.
@@ -239,6 +406,42 @@ class VoucherCodeBatch(models.Model):
         super().save(*args, **kwargs)
 
 
+class VoucherCodeQuerySet(models.QuerySet):
+
+    def redeemable(self):
+        """Returns the active codes that weren't redeemed yet.
+
+        The filter matches the condition of VoucherCode's partial index, so
+        lookups by code are served from that index, which only grows with the
+        codes still out there rather than with every code ever issued.
+        Expiration is left to the caller, as it depends on the batch.
+        """
+        return self.filter(REDEEMABLE_CODE_CONDITION)
+
+
+# The codes that can still be redeemed, if they haven't expired.
+REDEEMABLE_CODE_CONDITION = models.Q(is_active=True, application__isnull=True)
+
+# The statuses VoucherCode.verify_code remembers. Only codes that can't be
+# redeemed are cached, so a stale entry never lets a code be redeemed.
+CACHED_VERIFICATION_STATUSES = {
+    VoucherCodeCheckStatus.CODE_NOT_FOUND,
+    VoucherCodeCheckStatus.CODE_INVALIDATED,
+    VoucherCodeCheckStatus.CODE_EXPIRED,
+}
+
+# Maps codes to their status in CACHED_VERIFICATION_STATUSES.
+VERIFICATION_CACHE = TTLCache(
+    max_size=CONFIG['verification_cache_size'],
+    ttl_seconds=CONFIG['verification_cache_seconds'])
+
+# Maps batch ids to the expiration date of the batch, so that cached
+# verifications don't join VoucherCodeBatch.
+BATCH_EXPIRATION_CACHE = TTLCache(
+    max_size=CONFIG['verification_cache_size'],
+    ttl_seconds=CONFIG['verification_cache_seconds'])
+
+
 class VoucherCode(models.Model):
     """
     Stores a voucher code with its associated metadata.
@@ -277,6 +480,15 @@ class VoucherCode(models.Model):
     application = models.OneToOneField(
         Application, null=True, blank=True, on_delete=models.CASCADE)
 
+    objects = VoucherCodeQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Serves verify_code through VoucherCodeQuerySet.redeemable().
+            models.Index(fields=['code'], name='vouchercode_redeemable_idx',
+                         condition=REDEEMABLE_CODE_CONDITION),
+        ]
+
     @property
     def affiliate(self):
         return self.batch.affiliate
@@ -297,33 +509,142 @@ class VoucherCode(models.Model):
     def amount(self):
         return self.batch.base_amount + self.added_amount
 
+    @classmethod
+    def insert_new(cls, codes, batch):
+        """Inserts the given codes into batch, skipping codes that exist.
+
+        Codes are written BULK_BATCH_SIZE per INSERT ... ON CONFLICT DO
+        NOTHING statement, so taken codes are skipped by the primary key
+        index instead of being looked up first.
+
+        Returns:
+            A list of the codes inserted.
+        """
+        if not codes:
+            return []
+        with connection.cursor() as cursor:
+            rows = execute_values(
+                cursor,
+                'INSERT INTO {table} (code, batch_id, added_amount, is_active) '
+                'VALUES %s ON CONFLICT (code) DO NOTHING RETURNING code'.format(
+                    table=cls._meta.db_table),
+                [(code, batch.pk, 0, True) for code in codes],
+                page_size=BULK_BATCH_SIZE, fetch=True)
+        return [code for code, in rows]
+
     @property
     def code_formatted(self):
         return '%s-%s-%s' % (self.code[:3], self.code[3:6], self.code[6:])
 
     @classmethod
-    def verify_code(cls, code):
+    def verify_code(cls, code, use_cache=True):
         """Verifies if the given code string is valid to redeem.
 
+        The code is fetched in a single query. Codes that can still be
+        redeemed are found in the partial index of redeemable codes, and only
+        codes outside it are looked up by primary key, within the same query.
+        Without use_cache, the query also joins the batch for its expiration
+        date.
+
+        Until link_voucher_codes has linked every legacy application to its
+        VoucherCode, CONFIG['legacy_vouchercode_fallback'] must stay on, so
+        that codes redeemed by unlinked applications are also found through
+        Application.vouchercode_str.
+
+        Codes found not to be redeemable are remembered in VERIFICATION_CACHE
+        for a while, so that guessed and retried codes don't reach the
+        database. Codes that can be redeemed are always looked up, but the
+        expiration dates of their batches are remembered in
+        BATCH_EXPIRATION_CACHE, and only queried once per batch.
+
+        Args:
+            code: The code string.
+            use_cache: Whether the status may be read from VERIFICATION_CACHE,
+                and the expiration date from BATCH_EXPIRATION_CACHE.
+                Redemption doesn't use them, so it always checks the
+                database.
+
         Returns:
             A VoucherCodeCheckStatus enum.
         """
-        try:
-            matched_code = cls.objects.get(code=code)
-        except VoucherCode.DoesNotExist:
+        if use_cache:
+            status = VERIFICATION_CACHE.get(code)
+            if status is not None:
+                return status
+        status = cls._get_verification_status(code, use_cache)
+        if status in CACHED_VERIFICATION_STATUSES:
+            VERIFICATION_CACHE.set(code, status)
+        return status
+
+    @classmethod
+    def forget_verifications(cls, codes=None):
+        """Removes the given codes, or every code, from VERIFICATION_CACHE.
+
+        Called whenever codes are imported, invalidated or redeemed. Other
+        processes only see the change once their entries expire. Forgetting
+        every code also forgets the batch expiration dates.
+        """
+        if codes is None:
+            VERIFICATION_CACHE.clear()
+            BATCH_EXPIRATION_CACHE.clear()
+        else:
+            VERIFICATION_CACHE.delete_many(codes)
+
+    @classmethod
+    def _get_verification_status(cls, code, use_cache):
+        """Returns the VoucherCodeCheckStatus of a code in the database."""
+        matched_code = cls._get_verification_values(code, use_cache)
+        if matched_code is None:
             return VoucherCodeCheckStatus.CODE_NOT_FOUND
 
-        if matched_code.application:
+        if matched_code['application_id'] is not None:
             return VoucherCodeCheckStatus.CODE_ALREADY_USED
-        # TODO (wups): Remove this case once data migration is done.
-        elif Application.objects.filter(vouchercode_str=code).exists():
+        elif matched_code.get('legacy_application_exists'):
             return VoucherCodeCheckStatus.CODE_ALREADY_USED
-        elif datetime.now(timezone.utc) >= matched_code.expiration_date:
+        elif datetime.now(timezone.utc) >= cls._get_expiration_date(
+                matched_code):
             return VoucherCodeCheckStatus.CODE_EXPIRED
-        elif not matched_code.is_active:
+        elif not matched_code['is_active']:
             return VoucherCodeCheckStatus.CODE_INVALIDATED
         return VoucherCodeCheckStatus.SUCCESS
 
+    @classmethod
+    def _get_verification_values(cls, code, use_cache):
+        """Returns the values verify_code needs of a code, if it exists.
+
+        The redeemable codes and then all codes are searched in one UNION ALL
+        query, which stops at the first row found. A code in the partial
+        index of redeemable codes is found there without the primary key
+        lookup running. The batch is only joined without use_cache.
+        """
+        fields = ['application_id', 'batch_id', 'is_active']
+        if not use_cache:
+            fields.append('batch__expiration_date')
+        annotations = {}
+        if CONFIG['legacy_vouchercode_fallback']:
+            annotations['legacy_application_exists'] = models.Exists(
+                Application.objects.filter(
+                    vouchercode_str=models.OuterRef('code')))
+            fields.append('legacy_application_exists')
+        redeemable_codes, matched_codes = [
+            queryset.filter(code=code).annotate(**annotations).values(*fields)
+            for queryset in (cls.objects.redeemable(), cls.objects.all())]
+        return next(iter(
+            redeemable_codes.union(matched_codes, all=True)[:1]), None)
+
+    @classmethod
+    def _get_expiration_date(cls, matched_code):
+        """Returns the expiration date of the batch of a matched code."""
+        if 'batch__expiration_date' in matched_code:
+            return matched_code['batch__expiration_date']
+        batch_id = matched_code['batch_id']
+        expiration_date = BATCH_EXPIRATION_CACHE.get(batch_id)
+        if expiration_date is None:
+            expiration_date = VoucherCodeBatch.objects.values_list(
+                'expiration_date', flat=True).get(pk=batch_id)
+            BATCH_EXPIRATION_CACHE.set(batch_id, expiration_date)
+        return expiration_date
+
 
 class VoucherCodeAttempt(models.Model):
 
@@ -334,7 +655,7 @@ class VoucherCodeAttempt(models.Model):
     ip_address = models.GenericIPAddressField()
     action = models.IntegerField(choices=Action.choices)
     time = models.DateTimeField(auto_now_add=True)
-    code = models.CharField(max_length=20)
+    code = models.CharField(max_length=20, db_index=True)
     status = models.IntegerField(choices=VoucherCodeCheckStatus.choices)
 
 
@@ -343,11 +664,15 @@ class PreapprovedAddress(models.Model):
     An address that has been preapproved as an affiliate or staff center.
 
     An application will skip the duplicate address fraud check if its address
-    matches a preapproved address. Only the addr1 and zip_code fields are compared,
-    but the city and state fields are included for clarity in the staff portal.
+    is in the building of a preapproved address. Only the addr1 and zip_code
+    fields are compared, normalized as address_key without any unit, but the
+    city and state fields are included for clarity in the staff portal.
     """
     addr1 = models.CharField(max_length=200)
     zip_code = models.CharField(max_length=5)
+    # The normalized addr1 and zip_code, set on save. See get_building_key.
+    address_key = models.CharField(max_length=255, blank=True, db_index=True,
+                                   editable=False)
 
     city = models.CharField(max_length=100)
     state = models.CharField(max_length=100)
@@ -358,3 +683,217 @@ class PreapprovedAddress(models.Model):
             models.UniqueConstraint(
                 fields=['addr1', 'zip_code'], name='unique address')
         ]
+
+    def save(self, *args, **kwargs):
+        self.address_key = get_building_key(self.addr1, self.zip_code)
+        super().save(*args, **kwargs)
+
+
+class DedupKeyCount(models.Model):
+    """
+    The number of Applications sharing a test value for a dedup check.
+
+    Kept up to date by the Application signal receivers in app_ccf.signals so
+    that dedup checks only need to look up the test values of new
+    applications instead of scanning the whole Application table. Run
+    ./manage.py rebuild_dedup_index after loading applications in bulk or
+    after changing how a check computes its test value.
+
+    Fields:
+      check_name: The name of the dedup check the key belongs to.
+      key: A test value returned by the check's get_test_value().
+      count: The number of applications with this test value.
+    """
+    check_name = models.CharField(max_length=50)
+    key = models.TextField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['check_name', 'key'], name='unique dedup key')
+        ]
+
+    @classmethod
+    def add_counts(cls, deltas):
+        """Adds to the counts of the given keys in a single statement.
+
+        Args:
+            deltas: A dict mapping (check_name, key) pairs to the number to
+                add to the count of that key. Negative numbers decrement it.
+        """
+        # Sorted so that concurrent upserts lock rows in the same order.
+        rows = sorted((check_name, key, delta)
+                      for (check_name, key), delta in deltas.items() if delta)
+        if not rows:
+            return
+        with connection.cursor() as cursor:
+            execute_values(
+                cursor,
+                'INSERT INTO {table} (check_name, key, count) VALUES %s '
+                'ON CONFLICT (check_name, key) DO UPDATE '
+                'SET count = {table}.count + EXCLUDED.count'.format(
+                    table=cls._meta.db_table),
+                rows, page_size=1000)
+
+    @classmethod
+    def get_counts(cls, check_name, keys):
+        """Returns a dict mapping each of the given keys to its count."""
+        counts = dict(cls.objects.filter(
+            check_name=check_name, key__in=keys).values_list('key', 'count'))
+        return {key: counts.get(key, 0) for key in keys}
+
+    @classmethod
+    def is_built(cls):
+        """Returns whether the counts were built for existing applications.
+
+        Saving applications keeps the counts up to date, so they are only
+        missing while there are applications but no count at all, e.g. ones
+        loaded in bulk before ./manage.py rebuild_dedup_index was run.
+        """
+        return cls.objects.exists() or not Application.objects.exists()
+
+
+class AutoProcessJob(models.Model):
+    """
+    A queued run of the auto-processing fraud checks on SUBMITTED applications.
+
+    Jobs are created from the staff portal and run outside of the web request
+    by ./manage.py run_auto_process_jobs. The worker processes applications
+    in chunks and updates the progress fields after each one, and refreshes
+    the heartbeat every HEARTBEAT_INTERVAL while it runs. A RUNNING job whose
+    heartbeat stops is claimed again by the next worker and resumes after its
+    last checkpoint.
+
+    Fields:
+      user: The username of the staff portal user who requested the job.
+      created: The date the job was requested.
+      status: The JobStatus of the job.
+      started: The date a worker first started the job.
+      finished: The date the job finished or failed.
+      heartbeat: The last date the worker running the job reported progress.
+      num_total: The number of applications to process, set once started.
+      num_processed: The number of applications processed so far.
+      checkpoint_submitted_date: The submitted_date of the last application
+        processed. Applications are processed in (submitted_date,
+        application_id) order.
+      checkpoint_application_id: The application_id of the last application
+        processed.
+      error: The error that made the job fail, if any.
+      check_stats: The seconds spent in each fraud check and the number of
+        applications it flagged so far, keyed by check name.
+    """
+
+    class JobStatus(models.TextChoices):
+        QUEUED = 'queued'
+        RUNNING = 'running'
+        DONE = 'done'
+        FAILED = 'failed'
+
+    # A RUNNING job without a heartbeat for this long is assumed to belong to
+    # a worker that died, and may be claimed by another worker.
+    STALE_AFTER = timedelta(minutes=5)
+
+    # How often the worker running a job refreshes its heartbeat.
+    HEARTBEAT_INTERVAL = timedelta(minutes=1)
+
+    user = models.CharField(max_length=20, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(
+        max_length=20,
+        choices=JobStatus.choices,
+        default=JobStatus.QUEUED,
+    )
+    started = models.DateTimeField(null=True)
+    finished = models.DateTimeField(null=True)
+    heartbeat = models.DateTimeField(null=True)
+    num_total = models.IntegerField(default=0)
+    num_processed = models.IntegerField(default=0)
+    checkpoint_submitted_date = models.DateTimeField(null=True)
+    checkpoint_application_id = models.UUIDField(null=True)
+    error = models.TextField(blank=True)
+    check_stats = JSONField(default=dict, blank=True)
+
+    @classmethod
+    @transaction.atomic
+    def enqueue(cls, user=''):
+        """Returns the active job, queueing a new one if there is none."""
+        job = cls.objects.select_for_update().filter(
+            status__in=[cls.JobStatus.QUEUED, cls.JobStatus.RUNNING]
+        ).order_by('created').first()
+        if job is None:
+            job = cls.objects.create(user=user)
+        return job
+
+    @classmethod
+    @transaction.atomic
+    def claim_next(cls):
+        """Marks the next job to run as RUNNING and returns it, if any.
+
+        Picks the oldest QUEUED job, or a RUNNING job whose worker stopped
+        sending heartbeats. Jobs locked by another worker are skipped.
+        """
+        datetime_now_utc = datetime.now(timezone.utc)
+        job = cls.objects.select_for_update(skip_locked=True).filter(
+            models.Q(status=cls.JobStatus.QUEUED) |
+            models.Q(status=cls.JobStatus.RUNNING,
+                     heartbeat__lt=datetime_now_utc - cls.STALE_AFTER)
+        ).order_by('created').first()
+        if job is None:
+            return None
+        job.status = cls.JobStatus.RUNNING
+        job.started = job.started or datetime_now_utc
+        job.heartbeat = datetime_now_utc
+        job.save()
+        return job
+
+    def get_checkpoint(self):
+        """Returns the (submitted_date, application_id) processed last, if any.
+        """
+        if self.checkpoint_application_id is None:
+            return None
+        return (self.checkpoint_submitted_date, self.checkpoint_application_id)
+
+    def save_checkpoint(self, num_processed, submitted_date, application_id,
+                        check_stats=None):
+        """Records the progress of a RUNNING job and refreshes its heartbeat.
+
+        Args:
+            num_processed: The number of applications processed so far.
+            submitted_date: The submitted_date of the last application
+                processed.
+            application_id: The application_id of the last application
+                processed.
+            check_stats: The fraud check stats so far, if any.
+        """
+        self.num_processed = num_processed
+        if check_stats is not None:
+            self.check_stats = check_stats
+        self.checkpoint_submitted_date = submitted_date
+        self.checkpoint_application_id = application_id
+        self.heartbeat = datetime.now(timezone.utc)
+        self.save(update_fields=[
+            'num_processed', 'checkpoint_submitted_date',
+            'checkpoint_application_id', 'heartbeat', 'check_stats'])
+
+    def beat(self):
+        """Refreshes the heartbeat of a RUNNING job."""
+        type(self).objects.filter(pk=self.pk).update(
+            heartbeat=datetime.now(timezone.utc))
+
+    def release(self):
+        """Puts a claimed job back in the queue, to be claimed again later."""
+        self.status = self.JobStatus.QUEUED
+        self.save(update_fields=['status'])
+
+    def finish(self, error=''):
+        """Marks the job as DONE, or FAILED if an error is given."""
+        self.status = (self.JobStatus.FAILED if error
+                       else self.JobStatus.DONE)
+        self.error = error
+        self.finished = datetime.now(timezone.utc)
+        self.save(update_fields=['status', 'error', 'finished'])
+
+    @property
+    def is_active(self):
+        return self.status in (self.JobStatus.QUEUED, self.JobStatus.RUNNING)
@@ -0,0 +1,37 @@
+""" Signals generated by app_ccf app. """
+import collections
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from app_ccf.fraud_checks import get_dedup_keys
+from app_ccf.models import Application, DedupKeyCount
+
+
+@receiver(pre_save, sender=Application)
+def load_previous_dedup_keys(sender, instance, raw=False, **kwargs):
+    # New applications don't have any keys counted yet, so only edits of an
+    # existing application need to look up what was stored before.
+    previous = None
+    if not raw and not instance._state.adding:
+        previous = Application.objects.filter(pk=instance.pk).first()
+    instance._previous_dedup_keys = (
+        get_dedup_keys(previous) if previous else set())
+
+
+@receiver(post_save, sender=Application)
+def update_dedup_key_counts(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous_keys = getattr(instance, '_previous_dedup_keys', set())
+    current_keys = get_dedup_keys(instance)
+    deltas = collections.Counter(current_keys - previous_keys)
+    deltas.subtract(previous_keys - current_keys)
+    DedupKeyCount.add_counts(deltas)
+    instance._previous_dedup_keys = current_keys
+
+
+@receiver(post_delete, sender=Application)
+def remove_dedup_key_counts(sender, instance, **kwargs):
+    DedupKeyCount.add_counts(
+        {key: -1 for key in get_dedup_keys(instance)})
@@ -1,14 +1,37 @@
 import datetime
+import io
+import threading
+
+from django.core.management import call_command
+from django.db import connection
 
 from app_ccf.common import (
+    AUTO_PROCESS_LOCK_ID,
+    UPDATE_STATUSES_LOCK_ID,
+    AlreadyRunningError,
+    DedupMethod,
     auto_update_application_statuses,
+    is_voucher_code_valid,
+    run_auto_process_job,
+    score_application,
+    submit_application,
     update_application_statuses
 )
 from app_ccf.config import CONFIG
-from app_ccf.models import Application, VoucherCode, VoucherCodeBatch, PreapprovedAddress
+from app_ccf.fraud_checks import AddressDedupCheck, NamePhoneDedupCheck
+from app_ccf.models import (
+    Application,
+    AutoProcessJob,
+    FraudFlag,
+    StatusUpdate,
+    VoucherCode,
+    VoucherCodeBatch,
+    PreapprovedAddress
+)
 from shared.test_utils import DEFAULT_CCF_APP_FIELDS
 
 from parameterized import parameterized
+import mock
 
 from . import base_test
 
@@ -84,13 +107,19 @@ class AutoUpdateAppStatusTests(base_test.CcfBaseTest):
         self.assertEqual(
             app3.status,
             Application.ApplicationStatus.NEEDS_REVIEW)
-        self.assertEqual(app3.note, 'duplicate address')
+        self.assertEqual(
+            [FraudFlag.Reason.DUPLICATE_ADDRESS],
+            list(app3.fraud_flags.values_list('reason', flat=True)))
 
         app4.refresh_from_db()
         self.assertEqual(
             app4.status,
             Application.ApplicationStatus.NEEDS_REVIEW)
-        self.assertEqual(app4.note, 'duplicate address')
+        self.assertEqual(
+            [FraudFlag.Reason.DUPLICATE_ADDRESS],
+            list(app4.fraud_flags.values_list('reason', flat=True)))
+        self.assertEqual(app3.duplicate_cluster, app4.duplicate_cluster)
+        self.assertEqual(4, app4.duplicate_cluster.members.count())
 
     def test_auto_update_application_statuses_fourDupAddressesPreapproved_marksNewDupsForReview(
             self):
@@ -230,13 +259,17 @@ class AutoUpdateAppStatusTests(base_test.CcfBaseTest):
         self.assertEqual(
             app1.status,
             Application.ApplicationStatus.REJECTED)
-        self.assertEqual(app1.note, 'duplicate first/last/phone')
+        self.assertEqual(
+            [FraudFlag.Reason.DUPLICATE_NAME_PHONE],
+            list(app1.fraud_flags.values_list('reason', flat=True)))
 
         app2.refresh_from_db()
         self.assertEqual(
             app2.status,
             Application.ApplicationStatus.REJECTED)
-        self.assertEqual(app2.note, 'duplicate first/last/phone')
+        self.assertEqual(
+            [FraudFlag.Reason.DUPLICATE_NAME_PHONE],
+            list(app2.fraud_flags.values_list('reason', flat=True)))
 
         self.assertEqual(
             1,
@@ -245,6 +278,417 @@ class AutoUpdateAppStatusTests(base_test.CcfBaseTest):
             {'+12222222222'},
             self.trigger_text_messages_mock.call_args_list[0][0][0])
 
+    @parameterized.expand([
+        (DedupMethod.INDEX, ),
+        (DedupMethod.SQL, ),
+        (DedupMethod.SCAN, ),
+    ])
+    def test_auto_update_application_statuses_dedupMethods_flagSameApps(
+            self, dedup_method):
+        apps = [
+            Application.objects.create(
+                **self.OTHER_REQUIRED_FIELDS,
+                **self.ADDRESS_FIELDS,
+                first_name=name,
+                last_name=name,
+                phone_number=phone_number,
+                status=Application.ApplicationStatus.SUBMITTED)
+            for name, phone_number in [
+                ('A', '+12222222222'),
+                ('a', '+12222222222'),
+                ('B', '+13333333333'),
+                ('C', '+14444444444'),
+            ]
+        ]
+
+        auto_update_application_statuses(dedup_method=dedup_method)
+
+        for app in apps:
+            app.refresh_from_db()
+        self.assertEqual(
+            [Application.ApplicationStatus.REJECTED,
+             Application.ApplicationStatus.REJECTED,
+             Application.ApplicationStatus.NEEDS_REVIEW,
+             Application.ApplicationStatus.NEEDS_REVIEW],
+            [app.status for app in apps])
+        self.assertEqual(
+            {FraudFlag.Reason.DUPLICATE_ADDRESS,
+             FraudFlag.Reason.DUPLICATE_NAME_PHONE},
+            set(apps[0].fraud_flags.values_list('reason', flat=True)))
+        self.assertEqual('', apps[0].note)
+
+    def test_auto_update_application_statuses_sqlMethod_countsUnindexedApps(
+            self):
+        # bulk_create skips save(), so these aren't counted in DedupKeyCount.
+        Application.objects.bulk_create([
+            Application(
+                **self.OTHER_REQUIRED_FIELDS,
+                **self.ADDRESS_FIELDS,
+                first_name=name,
+                last_name=name,
+                phone_number='+12222222222',
+                status=Application.ApplicationStatus.APPROVED)
+            for name in ['A', 'B', 'C']
+        ])
+        # Rows loaded in bulk only need their keys backfilled.
+        call_command('backfill_keys')
+        app = Application.objects.create(
+            **self.OTHER_REQUIRED_FIELDS,
+            **self.ADDRESS_FIELDS,
+            first_name='D',
+            last_name='D',
+            phone_number='+15555555555',
+            status=Application.ApplicationStatus.SUBMITTED)
+
+        auto_update_application_statuses(dedup_method=DedupMethod.SQL)
+
+        app.refresh_from_db()
+        self.assertEqual(
+            Application.ApplicationStatus.NEEDS_REVIEW, app.status)
+
+    def test_auto_update_application_statuses_inChunks_countsAcrossChunks(
+            self):
+        apps = [
+            Application.objects.create(
+                **self.OTHER_REQUIRED_FIELDS,
+                **self.ADDRESS_FIELDS,
+                first_name=name,
+                last_name=name,
+                phone_number=phone_number,
+                status=Application.ApplicationStatus.SUBMITTED)
+            for name, phone_number in [
+                ('A', '+12222222222'),
+                ('B', '+13333333333'),
+                ('C', '+14444444444'),
+                ('D', '+15555555555'),
+            ]
+        ]
+
+        num_processed = auto_update_application_statuses(chunk_size=3)
+
+        self.assertEqual(4, num_processed)
+        for app in apps:
+            app.refresh_from_db()
+            self.assertEqual(
+                Application.ApplicationStatus.NEEDS_REVIEW, app.status)
+
+    def _create_submitted_same_address(self, num_apps):
+        return [
+            Application.objects.create(
+                **self.OTHER_REQUIRED_FIELDS,
+                **self.ADDRESS_FIELDS,
+                first_name=name,
+                last_name=name,
+                phone_number='+1222222222%d' % i,
+                status=Application.ApplicationStatus.SUBMITTED)
+            for i, name in enumerate('ABCDE'[:num_apps])
+        ]
+
+    def test_auto_update_application_statuses_dryRun_reportsWithoutSaving(
+            self):
+        apps = self._create_submitted_same_address(4)
+        self.trigger_text_messages_mock.reset_mock()
+
+        report = auto_update_application_statuses(
+            chunk_size=3, dry_run=True)
+
+        self.assertEqual(4, report['num_applications'])
+        self.assertEqual(
+            {Application.ApplicationStatus.NEEDS_REVIEW: 4},
+            report['by_status'])
+        self.assertEqual(4, report['by_check']['address']['num_flagged'])
+        self.assertEqual(0, report['by_check']['name_phone']['num_flagged'])
+        for app in apps:
+            app.refresh_from_db()
+            self.assertEqual(
+                Application.ApplicationStatus.SUBMITTED, app.status)
+        self.assertFalse(FraudFlag.objects.exists())
+        self.trigger_text_messages_mock.assert_not_called()
+
+    def test_auto_update_application_statuses_dryRunMaxDuplicates_overrides(
+            self):
+        self._create_submitted_same_address(4)
+
+        report = auto_update_application_statuses(
+            dry_run=True, max_duplicates={'address': 4})
+
+        self.assertEqual(
+            {Application.ApplicationStatus.APPROVED: 4},
+            report['by_status'])
+
+    def test_auto_update_application_statuses_unknownMaxDuplicates_raises(
+            self):
+        with self.assertRaises(ValueError):
+            auto_update_application_statuses(
+                dry_run=True, max_duplicates={'unknown': 4})
+
+    def test_fraud_check_report_printsCounts(self):
+        apps = self._create_submitted_same_address(4)
+        out = io.StringIO()
+
+        call_command('fraud_check_report', max_duplicates=['address=4'],
+                     stdout=out)
+
+        self.assertIn('4 new applications', out.getvalue())
+        self.assertRegex(out.getvalue(), r'approved\s+4')
+        apps[0].refresh_from_db()
+        self.assertEqual(
+            Application.ApplicationStatus.SUBMITTED, apps[0].status)
+
+    def test_benchmark_fraud_checks_sameResults(self):
+        apps = self._create_submitted_same_address(4)
+        out = io.StringIO()
+
+        call_command('benchmark_fraud_checks', workers=2, stdout=out)
+
+        self.assertIn('Both runs flagged the same applications.',
+                      out.getvalue())
+        apps[0].refresh_from_db()
+        self.assertEqual(
+            Application.ApplicationStatus.SUBMITTED, apps[0].status)
+
+
+# The registered checks that can run as applications are submitted.
+INLINE_CHECKS = [AddressDedupCheck, NamePhoneDedupCheck]
+
+
+class SubmitApplicationTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.fields = DEFAULT_CCF_APP_FIELDS.copy()
+        del self.fields['submitted_date']
+        today = datetime.datetime.now(datetime.timezone.utc)
+        self.batch = VoucherCodeBatch.objects.create(
+            num_codes=10,
+            code_length=9,
+            base_amount=400,
+            created=today,
+            expiration_date=today + datetime.timedelta(days=1))
+
+    def _submit(self, code, **fields):
+        VoucherCode.objects.create(code=code, added_amount=0, batch=self.batch)
+        application = Application(
+            **dict(self.fields, vouchercode_str=code, **fields))
+        success, error = submit_application(application, '127.0.0.1')
+        self.assertTrue(success, error)
+        application.refresh_from_db()
+        return application
+
+    def test_submit_application_boundedQueries(self):
+        VoucherCode.objects.create(
+            code='aaaaaaaaa', added_amount=0, batch=self.batch)
+        application = Application(
+            **dict(self.fields, vouchercode_str='aaaaaaaaa'))
+
+        # Verifying the code in one query, recording the attempt, redeeming
+        # the code (2), saving the application with its status history,
+        # primary key check and dedup counts (4), within two savepoints (4).
+        with self.assertNumQueries(12):
+            success, error = submit_application(application, '127.0.0.1')
+
+        self.assertTrue(success, error)
+
+    def test_submit_application_cachedNotFound_checksDatabase(self):
+        self.assertFalse(is_voucher_code_valid('aaaaaaaaa', '127.0.0.1'))
+
+        application = self._submit('aaaaaaaaa')
+
+        self.assertEqual('aaaaaaaaa', application.vouchercode.code)
+
+    def test_submit_application_notScoring_leavesSubmitted(self):
+        application = self._submit('aaaaaaaaa')
+
+        self.assertEqual(
+            Application.ApplicationStatus.SUBMITTED, application.status)
+
+    @mock.patch.dict(CONFIG, {'score_on_submission': True})
+    @mock.patch('app_ccf.fraud_checks.FRAUD_CHECKS', INLINE_CHECKS)
+    def test_submit_application_scoring_approves(self):
+        application = self._submit('aaaaaaaaa')
+
+        self.assertEqual(
+            Application.ApplicationStatus.APPROVED, application.status)
+        self.assertEqual(
+            [Application.ApplicationStatus.SUBMITTED,
+             Application.ApplicationStatus.APPROVED],
+            list(StatusUpdate.objects.filter(
+                application=application).order_by('date').values_list(
+                    'status', flat=True)))
+
+    @mock.patch.dict(CONFIG, {'score_on_submission': True})
+    @mock.patch('app_ccf.fraud_checks.FRAUD_CHECKS', INLINE_CHECKS)
+    def test_submit_application_scoringDuplicates_flags(self):
+        applications = [
+            self._submit('aaaaaaaa%d' % i, first_name='Name%d' % i)
+            for i in range(4)
+        ]
+        rejected = self._submit('bbbbbbbbb', first_name='Name0')
+
+        self.assertEqual(
+            [Application.ApplicationStatus.APPROVED] * 3 +
+            [Application.ApplicationStatus.NEEDS_REVIEW],
+            [application.status for application in applications])
+        self.assertEqual(
+            Application.ApplicationStatus.REJECTED, rejected.status)
+        self.assertEqual(
+            {FraudFlag.Reason.DUPLICATE_ADDRESS,
+             FraudFlag.Reason.DUPLICATE_NAME_PHONE},
+            set(rejected.fraud_flags.values_list('reason', flat=True)))
+
+    @mock.patch('app_ccf.fraud_checks.FRAUD_CHECKS', INLINE_CHECKS)
+    def test_score_application_boundedQueries(self):
+        application = Application.objects.create(**self.fields)
+
+        # Whether the dedup index is built, a count lookup per dedup check,
+        # then the status update and its history within a savepoint.
+        with self.assertNumQueries(7):
+            score_application(application)
+
+        self.assertEqual(
+            Application.ApplicationStatus.APPROVED, application.status)
+
+    def test_score_application_defaultChecks_approves(self):
+        application = Application.objects.create(**self.fields)
+
+        score_application(application)
+
+        application.refresh_from_db()
+        self.assertEqual(
+            Application.ApplicationStatus.APPROVED, application.status)
+
+    @mock.patch.dict(CONFIG, {'optional_fraud_checks': ['fraud_ring']})
+    def test_score_application_checkNotInline_leavesPassingSubmitted(self):
+        # FraudRingCheck needs the shared scan, so only runs in batches.
+        application = Application.objects.create(**self.fields)
+
+        score_application(application)
+
+        application.refresh_from_db()
+        self.assertEqual(
+            Application.ApplicationStatus.SUBMITTED, application.status)
+
+    @mock.patch('app_ccf.fraud_checks.FRAUD_CHECKS', INLINE_CHECKS)
+    def test_score_application_flaggedByInlineCheck_setsStatus(self):
+        for first_name in 'ABCD':
+            application = Application.objects.create(
+                **dict(self.fields, first_name=first_name))
+
+        score_application(application)
+
+        application.refresh_from_db()
+        self.assertEqual(
+            Application.ApplicationStatus.NEEDS_REVIEW, application.status)
+
+
+class AutoProcessJobTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.fields = DEFAULT_CCF_APP_FIELDS.copy()
+
+    def test_enqueue_activeJob_returnsActiveJob(self):
+        job = AutoProcessJob.enqueue(user='staff')
+
+        self.assertEqual(job, AutoProcessJob.enqueue(user='other_staff'))
+        self.assertEqual(1, AutoProcessJob.objects.count())
+
+    def test_enqueue_finishedJob_queuesNewJob(self):
+        job = AutoProcessJob.enqueue(user='staff')
+        job.finish()
+
+        self.assertNotEqual(job, AutoProcessJob.enqueue(user='staff'))
+
+    def test_claim_next_queuedJob_marksRunning(self):
+        job = AutoProcessJob.enqueue()
+
+        claimed_job = AutoProcessJob.claim_next()
+
+        self.assertEqual(job, claimed_job)
+        self.assertEqual(
+            AutoProcessJob.JobStatus.RUNNING, claimed_job.status)
+        self.assertIsNone(AutoProcessJob.claim_next())
+
+    def test_claim_next_staleRunningJob_reclaims(self):
+        AutoProcessJob.enqueue()
+        job = AutoProcessJob.claim_next()
+        job.heartbeat -= AutoProcessJob.STALE_AFTER * 2
+        job.save()
+
+        self.assertEqual(job, AutoProcessJob.claim_next())
+
+    def test_auto_update_application_statuses_withJob_resumesAfterCheckpoint(
+            self):
+        for i, first_name in enumerate(['Alice', 'Bob', 'Carol']):
+            Application.objects.create(**dict(
+                self.fields, first_name=first_name,
+                phone_number='+1555555555%d' % i))
+        apps = list(Application.objects.order_by(
+            'submitted_date', 'application_id'))
+        AutoProcessJob.enqueue()
+        job = AutoProcessJob.claim_next()
+        job.save_checkpoint(1, apps[0].submitted_date, apps[0].application_id)
+
+        num_processed = auto_update_application_statuses(chunk_size=1, job=job)
+
+        self.assertEqual(3, num_processed)
+        job.refresh_from_db()
+        self.assertEqual(3, job.num_processed)
+        self.assertEqual(
+            (apps[2].submitted_date, apps[2].application_id),
+            job.get_checkpoint())
+        for app in apps:
+            app.refresh_from_db()
+        self.assertEqual(
+            [Application.ApplicationStatus.SUBMITTED,
+             Application.ApplicationStatus.APPROVED,
+             Application.ApplicationStatus.APPROVED],
+            [app.status for app in apps])
+
+    def test_run_auto_process_jobs_processesSubmittedApplications(self):
+        app = Application.objects.create(**self.fields)
+        job = AutoProcessJob.enqueue()
+
+        call_command('run_auto_process_jobs', once=True)
+
+        job.refresh_from_db()
+        self.assertEqual(AutoProcessJob.JobStatus.DONE, job.status)
+        self.assertEqual(1, job.num_total)
+        self.assertEqual(1, job.num_processed)
+        self.assertEqual(
+            {'address', 'name_phone', 'velocity'}, set(job.check_stats))
+        self.assertEqual(0, job.check_stats['address']['num_flagged'])
+        app.refresh_from_db()
+        self.assertEqual(Application.ApplicationStatus.APPROVED, app.status)
+
+    @mock.patch('app_ccf.common.auto_update_application_statuses',
+                side_effect=AlreadyRunningError)
+    def test_run_auto_process_job_alreadyRunning_requeuesJob(self, _):
+        AutoProcessJob.enqueue()
+        job = AutoProcessJob.claim_next()
+
+        self.assertFalse(run_auto_process_job(job))
+
+        job.refresh_from_db()
+        self.assertEqual(AutoProcessJob.JobStatus.QUEUED, job.status)
+        self.assertEqual(job, AutoProcessJob.claim_next())
+
+    @mock.patch.object(AutoProcessJob, 'HEARTBEAT_INTERVAL',
+                       datetime.timedelta(milliseconds=10))
+    @mock.patch.object(AutoProcessJob, 'beat')
+    def test_run_auto_process_job_longRun_refreshesHeartbeat(self, beat):
+        AutoProcessJob.enqueue()
+        job = AutoProcessJob.claim_next()
+
+        with mock.patch('app_ccf.common.auto_update_application_statuses',
+                        side_effect=lambda **kwargs: threading.Event().wait(
+                            0.2)):
+            self.assertTrue(run_auto_process_job(job))
+
+        self.assertTrue(beat.called)
+        job.refresh_from_db()
+        self.assertEqual(AutoProcessJob.JobStatus.DONE, job.status)
+
 
 class UpdateAppStatusTests(base_test.CcfBaseTest):
 
@@ -324,4 +768,45 @@ class UpdateAppStatusTests(base_test.CcfBaseTest):
             1,
             self.trigger_text_messages_mock.call_count)
         self.assertEqual(
-            {'+15555555555', '+16666666666'}, self.trigger_text_messages_mock.call_args[0][0])
\ No newline at end of file
+            {'+15555555555', '+16666666666'}, self.trigger_text_messages_mock.call_args[0][0])
+
+
+class AdvisoryLockTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        # Advisory locks are reentrant within a session, so another session
+        # has to hold the lock.
+        self.other_connection = connection.get_new_connection(
+            connection.get_connection_params())
+        self.addCleanup(self.other_connection.close)
+
+    def hold_lock(self, lock_id):
+        with self.other_connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_lock(%s)', [lock_id])
+
+    def test_auto_update_application_statuses_alreadyRunning_raises(self):
+        app = Application.objects.create(**DEFAULT_CCF_APP_FIELDS)
+        self.hold_lock(AUTO_PROCESS_LOCK_ID)
+
+        with self.assertRaises(AlreadyRunningError):
+            auto_update_application_statuses()
+
+        app.refresh_from_db()
+        self.assertEqual(Application.ApplicationStatus.SUBMITTED, app.status)
+
+    def test_update_application_statuses_alreadyRunning_raises(self):
+        app = Application.objects.create(**DEFAULT_CCF_APP_FIELDS)
+        self.hold_lock(UPDATE_STATUSES_LOCK_ID)
+
+        with self.assertRaises(AlreadyRunningError):
+            update_application_statuses(
+                [app.application_id], Application.ApplicationStatus.APPROVED)
+
+    def test_auto_update_application_statuses_releasesLock(self):
+        auto_update_application_statuses()
+
+        with self.other_connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT pg_try_advisory_lock(%s)', [AUTO_PROCESS_LOCK_ID])
+            self.assertTrue(cursor.fetchone()[0])
@@ -0,0 +1,406 @@
+from app_ccf.fraud_checks import (
+    AddressDedupCheck,
+    BaseFraudCheck,
+    DedupMethod,
+    FraudCheckRunner,
+    FraudRingCheck,
+    FuzzyDedupCheck,
+    NamePhoneDedupCheck,
+    UnionFind,
+    VelocityCheck,
+    bounded_edit_distance,
+    get_fraud_checks,
+    rebuild_dedup_index,
+    soundex,
+)
+from app_ccf import velocity
+from app_ccf.config import CONFIG
+from app_ccf.models import (
+    Application,
+    FraudFlag,
+    PreapprovedAddress,
+    VoucherCodeAttempt,
+    VoucherCodeCheckStatus,
+)
+from shared.test_utils import DEFAULT_CCF_APP_FIELDS
+
+from parameterized import parameterized
+import mock
+
+from . import base_test
+
+# The opt-in checks, enabled by tests running every registered check.
+OPTIONAL_CHECKS = ['fraud_ring', 'fuzzy']
+
+
+class FailingObserveCheck(FuzzyDedupCheck):
+    """A partitioned check whose workers fail while scanning."""
+
+    def observe(self, rows):
+        raise ValueError('observe failed')
+
+
+class AddressDedupCheckTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        PreapprovedAddress.objects.create(
+            addr1='45 BROADWAY',
+            city='NY',
+            state='NY',
+            zip_code='10006',
+            note='Test Preapproved Address')
+        self.fields = DEFAULT_CCF_APP_FIELDS.copy()
+
+    def test_is_preapproved(self):
+        dedup_check = AddressDedupCheck()
+
+        self.assertTrue(dedup_check.is_preapproved(Application(
+            **dict(self.fields, addr1='45 BROADWAY', zip_code='10006'))))
+        self.assertTrue(dedup_check.is_preapproved(Application(
+            **dict(self.fields, addr1='45 Broadway Apt 2',
+                   zip_code='10006'))))
+        self.assertFalse(dedup_check.is_preapproved(Application(
+            **dict(self.fields, addr1='45 BROADWAY', zip_code='10007'))))
+        self.assertFalse(dedup_check.is_preapproved(Application(
+            **dict(self.fields, addr1='46 BROADWAY', zip_code='10006'))))
+
+    def test_is_preapproved_manyApplications_loadsAddressesOnce(self):
+        dedup_check = AddressDedupCheck()
+        applications = [Application(**self.fields) for _ in range(10)]
+
+        with self.assertNumQueries(1):
+            for application in applications:
+                dedup_check.is_preapproved(application)
+
+
+class FraudCheckRunnerTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.fields = DEFAULT_CCF_APP_FIELDS.copy()
+
+    def test_get_fraud_checks_returnsRegisteredChecks(self):
+        self.assertEqual(
+            ['address', 'name_phone', 'velocity'],
+            [check.name for check in get_fraud_checks()])
+
+    @mock.patch.dict(CONFIG, {'optional_fraud_checks': OPTIONAL_CHECKS})
+    def test_get_fraud_checks_optionalChecks_returnsOptInChecks(self):
+        self.assertEqual(
+            ['address', 'name_phone', 'fraud_ring', 'velocity', 'fuzzy'],
+            [check.name for check in get_fraud_checks()])
+
+    def test_get_fraud_checks_indexNotBuilt_fallsBackToSql(self):
+        Application.objects.bulk_create([Application(**self.fields)])
+
+        checks = get_fraud_checks(DedupMethod.INDEX)
+
+        self.assertEqual(
+            {DedupMethod.SQL},
+            {check.get_dedup_method() for check in checks
+             if check.name in ('address', 'name_phone')})
+
+    @mock.patch.dict(CONFIG, {'optional_fraud_checks': OPTIONAL_CHECKS})
+    def test_run_scanningChecks_scansOnce(self):
+        Application.objects.bulk_create(
+            [Application(**self.fields) for _ in range(4)])
+        new_apps = [Application(**dict(self.fields, addr1='1 NEW ST'))]
+        runner = FraudCheckRunner(get_fraud_checks(DedupMethod.SCAN))
+
+        # One scan shared by all checks for both batches, plus the fraud ring
+        # check's preapproved addresses and submission IPs, and the velocity
+        # check's submission IPs for each batch.
+        with self.assertNumQueries(5):
+            runner.run(new_apps)
+            runner.run(new_apps)
+
+        self.assertEqual(2, runner.stats['name_phone']['num_flagged'])
+        self.assertEqual(0, runner.stats['address']['num_flagged'])
+
+    @parameterized.expand([
+        (DedupMethod.INDEX, ),
+        (DedupMethod.SQL, ),
+        (DedupMethod.SCAN, ),
+    ])
+    def test_run_noPhoneNumbers_flagsNothing(self, dedup_method):
+        # bulk_create skips the validation requiring a phone number.
+        apps = Application.objects.bulk_create(
+            [Application(**dict(self.fields, phone_number=''))
+             for _ in range(3)])
+        rebuild_dedup_index()
+        check = NamePhoneDedupCheck()
+        check.dedup_method = dedup_method
+
+        results = FraudCheckRunner([check]).run(apps)
+
+        self.assertEqual({}, results['name_phone'])
+
+    @mock.patch.dict(CONFIG, {'optional_fraud_checks': OPTIONAL_CHECKS})
+    def test_run_flaggedApps_setsStatusAndFlags(self):
+        Application.objects.bulk_create(
+            [Application(**self.fields) for _ in range(4)])
+        new_app = Application(**self.fields)
+        runner = FraudCheckRunner(get_fraud_checks(DedupMethod.SCAN))
+
+        results = runner.run([new_app])
+
+        self.assertEqual(
+            Application.ApplicationStatus.REJECTED, new_app.status)
+        self.assertEqual(
+            {'address', 'name_phone', 'fraud_ring', 'velocity', 'fuzzy'},
+            set(results))
+        self.assertIn(new_app.application_id, results['address'])
+        self.assertEqual(
+            [FraudFlag.Reason.DUPLICATE_ADDRESS,
+             FraudFlag.Reason.DUPLICATE_NAME_PHONE,
+             FraudFlag.Reason.SIMILAR_NAME_ADDRESS],
+            [flag.reason for flag in runner.get_fraud_flags(results)])
+        self.assertEqual('', new_app.note)
+
+    def test_run_rejectedThenFlagged_staysRejected(self):
+        class ReviewCheck(BaseFraudCheck):
+            name = 'review'
+
+            def get_flagged(self, new_apps):
+                return {app.application_id: None for app in new_apps}
+
+        new_app = Application(
+            **dict(self.fields, status=Application.ApplicationStatus.REJECTED))
+        check = ReviewCheck(FraudFlag.Reason.FRAUD_RING)
+        runner = FraudCheckRunner([check])
+
+        with self.assertNumQueries(0):
+            results = runner.run([new_app])
+
+        self.assertEqual(
+            Application.ApplicationStatus.REJECTED, new_app.status)
+        self.assertEqual(
+            [(new_app.application_id, FraudFlag.Reason.FRAUD_RING)],
+            [(flag.application_id, flag.reason)
+             for flag in runner.get_fraud_flags(results)])
+        self.assertEqual(1, runner.stats['review']['num_flagged'])
+
+
+class UnionFindTests(base_test.CcfBaseTest):
+
+    def test_union_chainedSets_mergesAll(self):
+        clusters = UnionFind()
+        elements = [clusters.add() for _ in range(5)]
+
+        clusters.union(elements[0], elements[1])
+        clusters.union(elements[2], elements[1])
+        clusters.union(elements[3], elements[2])
+
+        self.assertEqual(4, clusters.size(elements[0]))
+        self.assertEqual(clusters.find(elements[0]),
+                         clusters.find(elements[3]))
+        self.assertEqual(1, clusters.size(elements[4]))
+        self.assertNotEqual(clusters.find(elements[0]),
+                            clusters.find(elements[4]))
+
+
+class FraudRingCheckTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.fields = DEFAULT_CCF_APP_FIELDS.copy()
+        # A ring where each application only shares one detail with the next.
+        self.ring = Application.objects.bulk_create([
+            Application(**dict(self.fields, vouchercode_str='code0',
+                               addr1='1 A ST', phone_number='+12222222220')),
+            Application(**dict(self.fields, vouchercode_str='code1',
+                               addr1='1 a st', phone_number='+12222222221')),
+            Application(**dict(self.fields, vouchercode_str='code2',
+                               addr1='2 B ST', phone_number='+12222222221')),
+            Application(**dict(self.fields, vouchercode_str='code3',
+                               addr1='3 C ST', phone_number='+12222222223')),
+        ])
+        self.other = Application.objects.create(
+            **dict(self.fields, vouchercode_str='code4', addr1='4 D ST',
+                   phone_number='+12222222224'))
+        for code, ip_address in [('code2', '10.0.0.1'),
+                                 ('code3', '10.0.0.1'),
+                                 ('code4', '10.0.0.2')]:
+            VoucherCodeAttempt.objects.create(
+                code=code, ip_address=ip_address,
+                action=VoucherCodeAttempt.Action.APPLICATION_REVIEW,
+                status=VoucherCodeCheckStatus.SUCCESS)
+
+    def _run(self, check):
+        runner = FraudCheckRunner([check])
+        return runner.run(self.ring + [self.other])[check.name]
+
+    def test_get_flagged_largeCluster_flagsMembers(self):
+        flagged = self._run(FraudRingCheck(max_cluster_size=3))
+
+        self.assertEqual(
+            {app.application_id for app in self.ring}, set(flagged))
+        self.assertEqual(1, len(set(flagged.values())))
+
+    def test_get_flagged_smallCluster_flagsNothing(self):
+        self.assertEqual({}, self._run(FraudRingCheck(max_cluster_size=4)))
+
+    def test_get_flagged_preapprovedAddress_doesNotLink(self):
+        PreapprovedAddress.objects.create(
+            addr1='1 A ST', city='NY', state='NY', zip_code='10011')
+
+        flagged = self._run(FraudRingCheck(max_cluster_size=2))
+
+        self.assertEqual(
+            {app.application_id for app in self.ring[1:]}, set(flagged))
+
+    def test_get_flagged_preapprovedAddressSharedIp_doesNotLink(self):
+        PreapprovedAddress.objects.create(
+            addr1='9 Shelter St', city='NY', state='NY', zip_code='10011')
+        residents = Application.objects.bulk_create([
+            Application(**dict(self.fields, vouchercode_str='code%d' % i,
+                               addr1='9 Shelter St',
+                               phone_number='+1333333333%d' % i))
+            for i in range(5, 8)])
+        for resident in residents:
+            VoucherCodeAttempt.objects.create(
+                code=resident.vouchercode_str, ip_address='10.0.0.9',
+                action=VoucherCodeAttempt.Action.APPLICATION_REVIEW,
+                status=VoucherCodeCheckStatus.SUCCESS)
+        check = FraudRingCheck(max_cluster_size=1)
+
+        self.assertEqual(
+            {}, FraudCheckRunner([check]).run(residents)[check.name])
+
+
+class VelocityCheckTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.app = Application(
+            **dict(DEFAULT_CCF_APP_FIELDS, vouchercode_str='aaabbbccc'))
+        VoucherCodeAttempt.objects.create(
+            code='aaabbbccc', ip_address='10.0.0.1',
+            action=VoucherCodeAttempt.Action.APPLICATION_REVIEW,
+            status=VoucherCodeCheckStatus.SUCCESS)
+
+    def _record_attempts(self, num_attempts, status):
+        for i in range(num_attempts):
+            velocity.record_attempt('code%d' % i, '10.0.0.1', status)
+
+    def test_get_flagged_guessingIp_flags(self):
+        self._record_attempts(3, VoucherCodeCheckStatus.SUCCESS)
+        self._record_attempts(7, VoucherCodeCheckStatus.CODE_NOT_FOUND)
+
+        self.assertEqual(
+            {self.app.application_id: '10.0.0.1'},
+            VelocityCheck().get_flagged([self.app]))
+
+    def test_get_flagged_mostlyValidCodes_flagsNothing(self):
+        self._record_attempts(7, VoucherCodeCheckStatus.SUCCESS)
+        self._record_attempts(3, VoucherCodeCheckStatus.CODE_NOT_FOUND)
+
+        self.assertEqual({}, VelocityCheck().get_flagged([self.app]))
+
+    def test_get_flagged_fewAttempts_flagsNothing(self):
+        self._record_attempts(5, VoucherCodeCheckStatus.CODE_NOT_FOUND)
+
+        self.assertEqual({}, VelocityCheck().get_flagged([self.app]))
+
+
+class FuzzyDedupCheckTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.fields = DEFAULT_CCF_APP_FIELDS.copy()
+        self.original = Application.objects.create(**dict(
+            self.fields, first_name='John', last_name='Smith',
+            addr1='123 Main Street', zip_code='10011'))
+
+    def _run(self, check, new_apps):
+        runner = FraudCheckRunner([check])
+        return runner.run(new_apps)[check.name]
+
+    def test_soundex(self):
+        self.assertEqual('R163', soundex('Robert'))
+        self.assertEqual('R163', soundex('Rupert'))
+        self.assertEqual('A261', soundex('Ashcraft'))
+        self.assertEqual('T522', soundex('Tymczak'))
+        self.assertEqual('J500', soundex('Jon'))
+        self.assertEqual('', soundex('-'))
+
+    def test_bounded_edit_distance(self):
+        self.assertEqual(0, bounded_edit_distance('main', 'main', 2))
+        self.assertEqual(1, bounded_edit_distance('jon', 'john', 2))
+        self.assertEqual(2, bounded_edit_distance('main', 'mian', 2))
+        self.assertEqual(3, bounded_edit_distance('kitten', 'sitting', 3))
+        self.assertEqual(3, bounded_edit_distance('kitten', 'sitting', 2))
+        self.assertEqual(2, bounded_edit_distance('a', 'abcdef', 1))
+
+    def test_get_flagged_typos_flags(self):
+        new_app = Application(**dict(
+            self.fields, first_name='Jon', last_name='Smith',
+            addr1='123 Mian St Apt 4', zip_code='10011'))
+
+        self.assertEqual(
+            {new_app.application_id: self.original.application_id},
+            self._run(FuzzyDedupCheck(), [new_app]))
+
+    def test_get_flagged_otherHouse_flagsNothing(self):
+        new_app = Application(**dict(
+            self.fields, first_name='John', last_name='Smith',
+            addr1='125 Main Street', zip_code='10011'))
+
+        self.assertEqual({}, self._run(FuzzyDedupCheck(), [new_app]))
+
+    def test_get_flagged_otherName_flagsNothing(self):
+        new_app = Application(**dict(
+            self.fields, first_name='Mary', last_name='Smith',
+            addr1='123 Main Street', zip_code='10011'))
+
+        self.assertEqual({}, self._run(FuzzyDedupCheck(), [new_app]))
+
+    def test_get_flagged_largeBlock_comparesNeighbors(self):
+        Application.objects.bulk_create([
+            Application(**dict(
+                self.fields, first_name='Person%d' % i, last_name='Smith',
+                addr1='123 Main Street', zip_code='10011'))
+            for i in range(10)])
+        new_app = Application(**dict(
+            self.fields, first_name='Jon', last_name='Smith',
+            addr1='123 Main Street', zip_code='10011'))
+
+        self.assertEqual(
+            {new_app.application_id: self.original.application_id},
+            self._run(FuzzyDedupCheck(max_block_size=2), [new_app]))
+
+    def test_run_workers_matchesSerial(self):
+        names_and_addresses = [('Jon', '123 Main St'),
+                               ('John', '123 Mian St'),
+                               ('Mary', '123 Main St'),
+                               ('John', '9 Other Ave')]
+        # The same applicants in other zip codes, so in other partitions.
+        Application.objects.bulk_create(
+            Application(**dict(
+                self.fields, first_name=first_name, last_name='Smith',
+                addr1=addr1, zip_code=zip_code))
+            for first_name, addr1 in names_and_addresses
+            for zip_code in ['20011', '30011', '40011'])
+        new_apps = [
+            Application(**dict(
+                self.fields, first_name=first_name, last_name='Smith',
+                addr1=addr1, zip_code='10011'))
+            for first_name, addr1 in names_and_addresses]
+
+        serial = FraudCheckRunner([FuzzyDedupCheck()]).run(new_apps)
+        with FraudCheckRunner([FuzzyDedupCheck()], workers=2) as runner:
+            parallel = runner.run(new_apps)
+
+        self.assertEqual(
+            {app.application_id for app in new_apps[:2]},
+            set(serial['fuzzy']))
+        self.assertEqual(serial, parallel)
+        self.assertEqual(2, runner.stats['fuzzy']['num_flagged'])
+
+    def test_run_workers_observeError_raises(self):
+        Application.objects.create(**self.fields)
+
+        with FraudCheckRunner([FailingObserveCheck()], workers=2) as runner:
+            with self.assertRaisesRegex(ValueError, 'observe failed'):
+                runner.run([Application(**self.fields)])
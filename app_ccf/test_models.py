@@ -1,10 +1,31 @@
 import datetime
+import io
+import tempfile
 import textwrap
 import uuid
 
-from app_ccf.models import Application, StatusUpdate
+from django.core.management import call_command
+from django.core.management.base import CommandError
+
+from app_ccf.config import CONFIG
+from app_ccf.models import (
+    Application,
+    DedupKeyCount,
+    DuplicateCluster,
+    FraudFlag,
+    PreapprovedAddress,
+    StatusUpdate,
+)
 from app_ccf.models import VoucherCode, VoucherCodeBatch, VoucherCodeCheckStatus
 from shared.test_utils import DEFAULT_CCF_APP_FIELDS
+from shared.utils import TTLCache
+from staff.utils import (
+    import_voucher_codes,
+    invalidate_voucher_codes_with_code_list,
+)
+
+from parameterized import parameterized
+import mock
 
 from . import base_test
 
@@ -69,6 +90,30 @@ class ApplicationTests(base_test.CcfBaseTest):
             Application.ApplicationStatus.NEEDS_REVIEW, apps[50].status)
         self.assertEqual(100, len(StatusUpdate.objects.all()))
 
+    def test_bulk_save_statuses(self):
+        StatusUpdate.objects.all().delete()
+        apps = [
+            Application(**self.fields) for _ in range(4)
+        ]
+        Application.objects.bulk_create(apps)
+        apps[0].status = Application.ApplicationStatus.APPROVED
+        apps[1].status = Application.ApplicationStatus.APPROVED
+        apps[2].status = Application.ApplicationStatus.REJECTED
+
+        Application.bulk_save_statuses(apps)
+
+        for app in apps:
+            app.refresh_from_db()
+        self.assertEqual(
+            [Application.ApplicationStatus.APPROVED,
+             Application.ApplicationStatus.APPROVED,
+             Application.ApplicationStatus.REJECTED,
+             Application.ApplicationStatus.SUBMITTED],
+            [app.status for app in apps])
+        self.assertIsNotNone(apps[0].status_last_modified)
+        self.assertIsNone(apps[3].status_last_modified)
+        self.assertEqual(3, len(StatusUpdate.objects.all()))
+
     def test_get_full_address(self):
         self.application.addr1 = '111 E 11th St'
         self.application.addr2 = 'APT 1'
@@ -94,6 +139,268 @@ class ApplicationTests(base_test.CcfBaseTest):
                          self.application.get_full_address())
 
 
+class AddressKeyTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.fields = DEFAULT_CCF_APP_FIELDS.copy()
+
+    @parameterized.expand([
+        ('123 Some St', ),
+        ('123 SOME STREET', ),
+        ('123 some st.', ),
+        ('123 Sóme St', ),
+    ])
+    def test_save_addressVariants_setsSameKey(self, addr1):
+        application = Application.objects.create(
+            **dict(self.fields, addr1=addr1))
+
+        self.assertEqual('123 some st 10011', application.address_key)
+
+    @parameterized.expand([
+        ('123 Some St, Apt 4B', ),
+        ('123 Some Street #4B', ),
+        ('123 Some St Unit 4B', ),
+        ('123 some st. apt. #4b', ),
+    ])
+    def test_save_unitVariants_setsSameKey(self, addr1):
+        application = Application.objects.create(
+            **dict(self.fields, addr1=addr1))
+
+        self.assertEqual('123 some st unit 4b 10011', application.address_key)
+
+    def test_save_differentUnits_setsDifferentKeys(self):
+        keys = {
+            Application.objects.create(
+                **dict(self.fields, addr1=addr1)).address_key
+            for addr1 in ['123 Main St Apt 4', '123 Main St Apt 5',
+                          '123 Main St']
+        }
+
+        self.assertEqual(3, len(keys))
+
+    def test_save_preapprovedAddressWithUnit_setsBuildingKey(self):
+        address = PreapprovedAddress.objects.create(
+            addr1='45 Broadway, Suite 200', city='NY', state='NY',
+            zip_code='10006')
+
+        self.assertEqual('45 broadway 10006', address.address_key)
+
+    def test_save_directionalAndSuffix_abbreviates(self):
+        application = Application.objects.create(
+            **dict(self.fields, addr1='#12 West Park Avenue North'))
+
+        self.assertEqual('12 w park ave n 10011', application.address_key)
+
+    def test_save_preapprovedAddress_setsKey(self):
+        address = PreapprovedAddress.objects.create(
+            addr1='45 Broadway Street', city='NY', state='NY',
+            zip_code='10006')
+
+        self.assertEqual('45 broadway st 10006', address.address_key)
+
+    @parameterized.expand([
+        ('+12125551234', ),
+        ('(212) 555-1234', ),
+        ('+1 212 555 1234', ),
+    ])
+    def test_save_phoneVariants_setsSameKey(self, phone_number):
+        application = Application(**self.fields)
+        application.phone_number = phone_number
+        # Skip full_clean(), which only accepts cleaned phone numbers.
+        with mock.patch.object(Application, 'full_clean'):
+            application.save()
+
+        self.assertEqual('+12125551234', application.phone_key)
+
+    def test_backfill_keys_noPhoneNumber_setsEmptyKey(self):
+        Application.objects.bulk_create(
+            [Application(**dict(self.fields, phone_number=''))])
+
+        call_command('backfill_keys')
+
+        self.assertEqual(
+            [''], list(Application.objects.values_list('phone_key', flat=True)))
+
+    def test_save_longUnparsablePhoneNumber_truncatesKey(self):
+        application = Application(**self.fields)
+        application.phone_number = '+1' + '2' * 40
+
+        application.save()
+
+        application.refresh_from_db()
+        self.assertEqual('+1' + '2' * 18, application.phone_key)
+
+    def test_backfill_keys_bulkCreatedRows_setsKeys(self):
+        Application.objects.bulk_create(
+            [Application(**self.fields) for _ in range(3)])
+        PreapprovedAddress.objects.bulk_create([PreapprovedAddress(
+            addr1='45 Broadway', city='NY', state='NY', zip_code='10006')])
+
+        call_command('backfill_keys')
+
+        self.assertEqual(
+            {('123 some st 10011', '+15555555555')},
+            set(Application.objects.values_list('address_key', 'phone_key')))
+        self.assertEqual(
+            ['45 broadway 10006'],
+            list(PreapprovedAddress.objects.values_list(
+                'address_key', flat=True)))
+
+
+class FraudFlagTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        self.application = Application.objects.create(**DEFAULT_CCF_APP_FIELDS)
+
+    def test_bulk_record_existingFlag_skips(self):
+        FraudFlag.bulk_record([FraudFlag(
+            application=self.application,
+            reason=FraudFlag.Reason.DUPLICATE_ADDRESS)])
+
+        FraudFlag.bulk_record([
+            FraudFlag(application=self.application, reason=reason)
+            for reason in [FraudFlag.Reason.DUPLICATE_ADDRESS,
+                           FraudFlag.Reason.FRAUD_RING]])
+
+        self.assertEqual(
+            [FraudFlag.Reason.DUPLICATE_ADDRESS, FraudFlag.Reason.FRAUD_RING],
+            list(self.application.fraud_flags.order_by('reason').values_list(
+                'reason', flat=True)))
+
+    def test_migrate_fraud_notes_keepsStaffNotes(self):
+        other = Application.objects.create(**DEFAULT_CCF_APP_FIELDS)
+        Application.objects.filter(pk=self.application.pk).update(
+            note='duplicate address; called, ok; possible fraud ring')
+        Application.objects.filter(pk=other.pk).update(note='called, ok')
+
+        call_command('migrate_fraud_notes')
+        call_command('migrate_fraud_notes')
+
+        self.application.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual('called, ok', self.application.note)
+        self.assertEqual('called, ok', other.note)
+        self.assertEqual(
+            [FraudFlag.Reason.DUPLICATE_ADDRESS, FraudFlag.Reason.FRAUD_RING],
+            list(self.application.fraud_flags.order_by('reason').values_list(
+                'reason', flat=True)))
+        self.assertFalse(other.fraud_flags.exists())
+
+
+class DuplicateClusterTests(base_test.CcfBaseTest):
+
+    ADDRESS_KEY = '123 some st 10011'
+
+    def setUp(self):
+        super().setUp()
+        self.applications = [
+            Application.objects.create(**DEFAULT_CCF_APP_FIELDS)
+            for _ in range(3)]
+        self.other = Application.objects.create(
+            **dict(DEFAULT_CCF_APP_FIELDS, addr1='1 Other St'))
+
+    def test_bulk_assign_linksAllSharingKey(self):
+        # The inserts and two updates, within a savepoint.
+        with self.assertNumQueries(5):
+            DuplicateCluster.bulk_assign(
+                FraudFlag.Reason.DUPLICATE_ADDRESS, 'address_key',
+                [self.ADDRESS_KEY, self.ADDRESS_KEY])
+
+        cluster = DuplicateCluster.objects.get()
+        self.assertEqual(self.ADDRESS_KEY, cluster.key)
+        self.assertEqual(
+            {app.application_id for app in self.applications},
+            set(cluster.members.values_list('application_id', flat=True)))
+        self.other.refresh_from_db()
+        self.assertIsNone(self.other.duplicate_cluster)
+
+    def test_bulk_assign_reviewedCluster_reopens(self):
+        DuplicateCluster.bulk_assign(
+            FraudFlag.Reason.DUPLICATE_ADDRESS, 'address_key',
+            [self.ADDRESS_KEY])
+        DuplicateCluster.objects.update(is_reviewed=True)
+        new_member = Application.objects.create(**DEFAULT_CCF_APP_FIELDS)
+
+        DuplicateCluster.bulk_assign(
+            FraudFlag.Reason.DUPLICATE_ADDRESS, 'address_key',
+            [self.ADDRESS_KEY])
+
+        cluster = DuplicateCluster.objects.get()
+        self.assertFalse(cluster.is_reviewed)
+        self.assertEqual(4, cluster.members.count())
+        new_member.refresh_from_db()
+        self.assertEqual(cluster, new_member.duplicate_cluster)
+
+
+class DedupKeyCountTests(base_test.CcfBaseTest):
+
+    ADDRESS_KEY = '123 some st 10011'
+    NAME_PHONE_KEY = 'michaeljackson+15555555555'
+
+    def setUp(self):
+        super().setUp()
+        self.fields = DEFAULT_CCF_APP_FIELDS.copy()
+
+    def get_count(self, check_name, key):
+        return DedupKeyCount.get_counts(check_name, [key])[key]
+
+    def test_save_newApplications_incrementsCounts(self):
+        Application.objects.create(**self.fields)
+        Application.objects.create(**self.fields)
+
+        self.assertEqual(2, self.get_count('address', self.ADDRESS_KEY))
+        self.assertEqual(2, self.get_count('name_phone', self.NAME_PHONE_KEY))
+
+    def test_save_changedAddress_movesCount(self):
+        application = Application.objects.create(**self.fields)
+
+        application.addr1 = '456 Other St'
+        application.save()
+
+        self.assertEqual(0, self.get_count('address', self.ADDRESS_KEY))
+        self.assertEqual(
+            1, self.get_count('address', '456 other st 10011'))
+        self.assertEqual(1, self.get_count('name_phone', self.NAME_PHONE_KEY))
+
+    def test_save_unchangedApplication_keepsCounts(self):
+        application = Application.objects.create(**self.fields)
+
+        application.status = Application.ApplicationStatus.APPROVED
+        application.save()
+
+        self.assertEqual(1, self.get_count('address', self.ADDRESS_KEY))
+
+    def test_delete_decrementsCounts(self):
+        application = Application.objects.create(**self.fields)
+
+        application.delete()
+
+        self.assertEqual(0, self.get_count('address', self.ADDRESS_KEY))
+        self.assertEqual(0, self.get_count('name_phone', self.NAME_PHONE_KEY))
+
+    def test_rebuild_dedup_index_bulkCreatedApplications_countsAll(self):
+        Application.objects.bulk_create(
+            [Application(**self.fields) for _ in range(3)])
+        self.assertEqual(0, self.get_count('address', self.ADDRESS_KEY))
+
+        call_command('rebuild_dedup_index')
+
+        self.assertEqual(3, self.get_count('address', self.ADDRESS_KEY))
+        self.assertEqual(3, self.get_count('name_phone', self.NAME_PHONE_KEY))
+
+    def test_is_built_bulkCreatedApplications_returnsFalse(self):
+        self.assertTrue(DedupKeyCount.is_built())
+        Application.objects.bulk_create([Application(**self.fields)])
+
+        self.assertFalse(DedupKeyCount.is_built())
+
+        call_command('rebuild_dedup_index')
+
+        self.assertTrue(DedupKeyCount.is_built())
+
+
 class VoucherCodeTests(base_test.CcfBaseTest):
 
     VALID_CODE = "VALID1234"
@@ -166,3 +473,162 @@ class VoucherCodeTests(base_test.CcfBaseTest):
         self.assertEqual(
             VoucherCode.verify_code(self.EXPIRED_CODE),
             VoucherCodeCheckStatus.CODE_EXPIRED)
+
+    def test_verify_code_legacyApplication_codeAlreadyUsed(self):
+        Application.objects.create(
+            **dict(DEFAULT_CCF_APP_FIELDS, vouchercode_str=self.VALID_CODE))
+
+        self.assertEqual(
+            VoucherCode.verify_code(self.VALID_CODE),
+            VoucherCodeCheckStatus.CODE_ALREADY_USED)
+
+    @mock.patch.dict(CONFIG, {'legacy_vouchercode_fallback': False})
+    def test_verify_code_fallbackOff_ignoresLegacyApplication(self):
+        Application.objects.create(
+            **dict(DEFAULT_CCF_APP_FIELDS, vouchercode_str=self.VALID_CODE))
+
+        self.assertEqual(
+            VoucherCode.verify_code(self.VALID_CODE),
+            VoucherCodeCheckStatus.SUCCESS)
+
+    def test_link_voucher_codes_linksOldestApplication(self):
+        first, second = [
+            Application.objects.create(**dict(
+                DEFAULT_CCF_APP_FIELDS, vouchercode_str=self.VALID_CODE,
+                submitted_date=DEFAULT_CCF_APP_FIELDS['submitted_date'] +
+                datetime.timedelta(minutes=minutes)))
+            for minutes in [0, 1]]
+        Application.objects.create(
+            **dict(DEFAULT_CCF_APP_FIELDS, vouchercode_str='NOSUCHCODE'))
+        with self.assertRaises(CommandError):
+            call_command('link_voucher_codes', verify=True)
+
+        call_command('link_voucher_codes')
+        call_command('link_voucher_codes')
+
+        self.assertEqual(
+            first.application_id,
+            VoucherCode.objects.get(code=self.VALID_CODE).application_id)
+        second.refresh_from_db()
+        with self.assertRaises(VoucherCode.DoesNotExist):
+            second.vouchercode
+        call_command('link_voucher_codes', verify=True, stdout=io.StringIO())
+
+    @parameterized.expand([
+        (VALID_CODE, ),
+        (USED_CODE, ),
+        (EXPIRED_CODE, ),
+        (INVALIDATED_CODE, ),
+        ('FAKECODE', ),
+    ])
+    def test_verify_code_cachedBatch_oneQuery(self, code):
+        VoucherCode.verify_code(code)
+        VoucherCode.forget_verifications([code])
+
+        with self.assertNumQueries(1):
+            VoucherCode.verify_code(code)
+
+    @parameterized.expand([
+        (VALID_CODE, ),
+        (USED_CODE, ),
+        (EXPIRED_CODE, ),
+        (INVALIDATED_CODE, ),
+        ('FAKECODE', ),
+    ])
+    def test_verify_code_noCache_oneQuery(self, code):
+        VoucherCode.verify_code(code)
+
+        with self.assertNumQueries(1):
+            VoucherCode.verify_code(code, use_cache=False)
+
+    def test_verify_code_sameBatch_loadsBatchOnce(self):
+        batch = VoucherCode.objects.get(code=self.VALID_CODE).batch
+        VoucherCode.objects.create(
+            code='VALID5678', added_amount=0, batch=batch)
+
+        with self.assertNumQueries(2):
+            VoucherCode.verify_code(self.VALID_CODE)
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                VoucherCodeCheckStatus.SUCCESS,
+                VoucherCode.verify_code('VALID5678'))
+
+    @parameterized.expand([
+        (EXPIRED_CODE, ),
+        (INVALIDATED_CODE, ),
+        ('FAKECODE', ),
+    ])
+    def test_verify_code_notRedeemable_cachesStatus(self, code):
+        status = VoucherCode.verify_code(code)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(status, VoucherCode.verify_code(code))
+        with self.assertNumQueries(1):
+            VoucherCode.verify_code(code, use_cache=False)
+
+    @parameterized.expand([
+        (VALID_CODE, ),
+        (USED_CODE, ),
+    ])
+    def test_verify_code_redeemableOrUsed_notCached(self, code):
+        VoucherCode.verify_code(code)
+
+        with self.assertNumQueries(1):
+            VoucherCode.verify_code(code)
+
+    def test_verify_code_importedCode_forgetsNotFound(self):
+        VoucherCode.verify_code('NEWCODE12')
+        batch = VoucherCode.objects.get(code=self.VALID_CODE).batch
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('NEWCODE12\n')
+            f.flush()
+            import_voucher_codes(f.name, batch)
+
+        self.assertEqual(
+            VoucherCodeCheckStatus.SUCCESS,
+            VoucherCode.verify_code('NEWCODE12'))
+
+    def test_verify_code_invalidatedCode_forgetsStatus(self):
+        VoucherCode.verify_code(self.EXPIRED_CODE)
+
+        invalidate_voucher_codes_with_code_list([self.EXPIRED_CODE])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                VoucherCodeCheckStatus.CODE_EXPIRED,
+                VoucherCode.verify_code(self.EXPIRED_CODE))
+
+    def test_redeemable(self):
+        self.assertEqual(
+            {self.VALID_CODE, self.EXPIRED_CODE},
+            set(VoucherCode.objects.redeemable().values_list(
+                'code', flat=True)))
+
+
+class TTLCacheTests(base_test.CcfBaseTest):
+
+    def test_get_missingKey_returnsDefault(self):
+        self.assertEqual('default', TTLCache(2, 60).get('a', 'default'))
+
+    def test_set_full_evictsLeastRecentlyUsed(self):
+        ttl_cache = TTLCache(2, 60)
+        ttl_cache.set('a', 1)
+        ttl_cache.set('b', 2)
+        ttl_cache.get('a')
+        ttl_cache.set('c', 3)
+
+        self.assertEqual(1, ttl_cache.get('a'))
+        self.assertIsNone(ttl_cache.get('b'))
+        self.assertEqual(3, ttl_cache.get('c'))
+
+    @mock.patch('shared.utils.time.monotonic')
+    def test_get_expired_returnsDefault(self, monotonic):
+        ttl_cache = TTLCache(2, 60)
+        monotonic.return_value = 1000
+        ttl_cache.set('a', 1)
+
+        monotonic.return_value = 1059
+        self.assertEqual(1, ttl_cache.get('a'))
+        monotonic.return_value = 1060
+        self.assertIsNone(ttl_cache.get('a'))
+        self.assertEqual(0, len(ttl_cache))
@@ -0,0 +1,81 @@
+from django.test import override_settings
+
+from app_ccf import checks, velocity
+from app_ccf.models import VoucherCodeCheckStatus
+
+from . import base_test
+
+import mock
+
+
+class VelocityTests(base_test.CcfBaseTest):
+
+    def test_get_counts_countsAttemptsAndNotFound(self):
+        velocity.record_attempt(
+            'aaabbbccc', '10.0.0.1', VoucherCodeCheckStatus.SUCCESS)
+        velocity.record_attempt(
+            'xxxyyyzzz', '10.0.0.1', VoucherCodeCheckStatus.CODE_NOT_FOUND)
+
+        counts = velocity.get_counts('ip', '10.0.0.1')
+
+        self.assertEqual(velocity.Counts(2, 1), counts['1m'])
+        self.assertEqual(velocity.Counts(2, 1), counts['24h'])
+        self.assertEqual(
+            velocity.Counts(1, 1),
+            velocity.get_counts('code', 'xxxyyyzzz')['1h'])
+        self.assertEqual(
+            velocity.Counts(0, 0), velocity.get_counts('ip', '10.0.0.2')['1m'])
+
+    def test_get_counts_windowSlides(self):
+        with mock.patch('time.time', return_value=1000000.0):
+            velocity.record_attempt(
+                'aaabbbccc', '10.0.0.1', VoucherCodeCheckStatus.SUCCESS)
+
+        with mock.patch('time.time', return_value=1000000.0 + 120):
+            counts = velocity.get_counts('ip', '10.0.0.1')
+
+        self.assertEqual(velocity.Counts(0, 0), counts['1m'])
+        self.assertEqual(velocity.Counts(1, 0), counts['1h'])
+
+    def test_record_attempt_existingBuckets_incrementsEachOnce(self):
+        velocity.record_attempt(
+            'aaabbbccc', '10.0.0.1', VoucherCodeCheckStatus.SUCCESS)
+        cache = velocity.cache
+
+        with mock.patch.object(cache, 'incr', wraps=cache.incr) as incr, \
+                mock.patch.object(cache, 'add', wraps=cache.add) as add:
+            velocity.record_attempt(
+                'aaabbbccc', '10.0.0.1', VoucherCodeCheckStatus.CODE_NOT_FOUND)
+
+        # One bucket per window, for the IP and for the code.
+        self.assertEqual(2 * len(velocity.WINDOWS), incr.call_count)
+        add.assert_not_called()
+        self.assertEqual(
+            velocity.Counts(2, 1), velocity.get_counts('ip', '10.0.0.1')['1m'])
+
+    def test_is_ip_throttled(self):
+        for i in range(velocity.IP_ATTEMPT_LIMITS['1m'] - 1):
+            velocity.record_attempt(
+                'code%d' % i, '10.0.0.1', VoucherCodeCheckStatus.SUCCESS)
+        self.assertFalse(velocity.is_ip_throttled('10.0.0.1'))
+
+        velocity.record_attempt(
+            'code', '10.0.0.1', VoucherCodeCheckStatus.SUCCESS)
+        self.assertTrue(velocity.is_ip_throttled('10.0.0.1'))
+
+
+class SharedCacheCheckTests(base_test.CcfBaseTest):
+
+    @override_settings(DEBUG=False, TESTING=False)
+    def test_check_shared_cache_localMemory_warns(self):
+        warnings = checks.check_shared_cache(None)
+
+        self.assertEqual(
+            ['app_ccf.W001'], [warning.id for warning in warnings])
+
+    @override_settings(DEBUG=False, TESTING=False, CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+    }})
+    def test_check_shared_cache_memcached_passes(self):
+        self.assertEqual([], checks.check_shared_cache(None))
@@ -1,7 +1,14 @@
 from django.db import models
 from django.contrib.sessions.backends.db import SessionStore
 from parameterized import parameterized, parameterized_class
-from app_ccf.models import VoucherCode, VoucherCodeBatch, Application
+from app_ccf import velocity
+from app_ccf.models import (
+    Application,
+    VoucherCode,
+    VoucherCodeAttempt,
+    VoucherCodeBatch,
+    VoucherCodeCheckStatus,
+)
 from .common import ApplicationSession
 from shared.test_utils import DEFAULT_CCF_APP_FIELDS
 
@@ -148,6 +155,34 @@ class VoucherCodeViewTests(BaseViewTestCaseMixin, base_test.CcfBaseTest):
         self.assertFalse(form.is_valid())
         self.assertEqual(response.status_code, 200)
 
+    def test_post_boundedQueries(self):
+        full_path = '/' + self.language + self.path
+
+        # Verifying the code and loading its batch, which is then cached,
+        # recording the attempt, and saving the new session within a
+        # savepoint (4).
+        with self.assertNumQueries(7):
+            response = self.client.post(
+                full_path, {'voucher_input': 'aaa-bbb-ccc'})
+
+        self.assertRedirects(
+            response, '/' + self.language + '/profile')
+
+    def test_post_tooManyAttempts_throttles(self):
+        for i in range(velocity.IP_ATTEMPT_LIMITS['1m']):
+            velocity.record_attempt(
+                'code%d' % i, '127.0.0.1',
+                VoucherCodeCheckStatus.CODE_NOT_FOUND)
+        num_attempts = VoucherCodeAttempt.objects.count()
+
+        full_path = '/' + self.language + self.path
+        response = self.client.post(
+            full_path, {'voucher_input': 'aaa-bbb-ccc'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.context['form'].is_valid())
+        self.assertEqual(num_attempts, VoucherCodeAttempt.objects.count())
+
 
 @parameterized_class(LANGUAGES)
 class DisclosureViewTests(BaseViewTestCaseMixin, base_test.CcfBaseTest):
@@ -0,0 +1,107 @@
+"""
+Sliding-window counters of voucher code attempts, per IP and per code.
+
+Attempts are counted in the Django cache rather than read back from
+VoucherCodeAttempt, so checking them costs one cache round trip instead of
+COUNT(*) queries on the attempts table. Each window is split into a few
+buckets, and the counts of a window are the sum of its most recent buckets,
+which slides the window a bucket at a time. Each bucket expires once it
+leaves its window, so memory is bounded by the number of recently active IPs
+and codes.
+
+Both counts of a bucket are packed into one integer, so recording an attempt
+costs a single incr() per kind and window, i.e. 6 cache round trips.
+
+The counts must be shared by the web processes recording attempts and the
+auto-processing worker running VelocityCheck, so deployments configure
+memcached as the cache. The app_ccf.W001 system check warns if they don't.
+"""
+import collections
+import hashlib
+import time
+
+from django.core.cache import cache
+
+from .models import VoucherCodeCheckStatus
+
+# The windows counted, as (name, seconds, number of buckets).
+WINDOWS = (
+    ('1m', 60, 4),
+    ('1h', 60 * 60, 6),
+    ('24h', 24 * 60 * 60, 6),
+)
+
+# The most attempts an IP may make in each window before it is throttled.
+IP_ATTEMPT_LIMITS = {
+    '1m': 20,
+    '1h': 200,
+    '24h': 1000,
+}
+
+Counts = collections.namedtuple('Counts', ['attempts', 'not_found'])
+
+# A bucket's value is attempts + not_found * NOT_FOUND_UNIT. Memcached
+# counters are 64-bit, so each count has 32 bits.
+NOT_FOUND_UNIT = 1 << 32
+
+
+def _get_bucket_keys(kind, value, now):
+    """Returns the cache keys of the current buckets of each window."""
+    # Hashed since codes are user input, and cache backends restrict keys.
+    subject = hashlib.sha1(str(value).encode()).hexdigest()
+    keys = {}
+    for name, seconds, num_buckets in WINDOWS:
+        bucket_seconds = seconds // num_buckets
+        current = int(now) // bucket_seconds
+        keys[name] = ['velocity:%s:%s:%s:%d' % (kind, subject, name, bucket)
+                      for bucket in range(current - num_buckets + 1,
+                                          current + 1)]
+    return keys
+
+
+def record_attempt(code, ip_address, status):
+    """Counts a voucher code attempt in every window of its IP and code."""
+    now = time.time()
+    delta = 1
+    if status == VoucherCodeCheckStatus.CODE_NOT_FOUND:
+        delta += NOT_FOUND_UNIT
+    for kind, value in (('ip', ip_address), ('code', code)):
+        bucket_keys = _get_bucket_keys(kind, value, now)
+        for name, seconds, num_buckets in WINDOWS:
+            key = bucket_keys[name][-1]
+            # The bucket usually exists, so it is only added if incr() fails,
+            # and kept until it has slid out of the window.
+            try:
+                cache.incr(key, delta)
+            except ValueError:
+                if not cache.add(key, delta, timeout=seconds + 60):
+                    # Added by a concurrent attempt meanwhile.
+                    cache.incr(key, delta)
+
+
+def get_counts(kind, value, windows=None):
+    """Returns the Counts of an IP ('ip') or code ('code') in each window.
+
+    Args:
+        kind: 'ip' or 'code'.
+        value: The IP address or code.
+        windows: The names of the windows to count, or None for all of them.
+    """
+    bucket_keys = _get_bucket_keys(kind, value, time.time())
+    if windows is not None:
+        bucket_keys = {name: bucket_keys[name] for name in windows}
+    values = cache.get_many([bucket_key for name in bucket_keys
+                             for bucket_key in bucket_keys[name]])
+    counts = {}
+    for name in bucket_keys:
+        total = sum(values.get(bucket_key, 0)
+                    for bucket_key in bucket_keys[name])
+        counts[name] = Counts(total % NOT_FOUND_UNIT, total // NOT_FOUND_UNIT)
+    return counts
+
+
+def is_ip_throttled(ip_address):
+    """Returns whether an IP made more attempts than IP_ATTEMPT_LIMITS."""
+    counts = get_counts('ip', ip_address)
+    return any(counts[name].attempts >= limit
+               for name, limit in IP_ATTEMPT_LIMITS.items())
@@ -12,7 +12,7 @@ from django.views.generic import TemplateView
 from django.views.generic.base import TemplateResponseMixin, View
 from django.utils.translation import get_language
 
-from . import notification, utils
+from . import notification, utils, velocity
 from .common import ApplicationSession, is_voucher_code_valid, submit_application, ApplicationSubmissionError
 from .config import CONFIG
 from .forms import (ReviewForm, DisclosureForm, WelcomeForm, HouseholdForm, HouseholdFormExpanded,
@@ -196,6 +196,11 @@ class VoucherCodeView(ApplicationView):
         setattr(self.application_session.model,
                 'vouchercode_str', cleaned_code)
 
+        if velocity.is_ip_throttled(self.ip_address):
+            LOGGER.warning('#VoucherCodeThrottled: %s', self.ip_address)
+            form.add_error(None, _('voucher_code_throttled'))
+            return super().form_invalid(form)
+
         if is_voucher_code_valid(cleaned_code, ip_address=self.ip_address):
             return super().form_valid(form)
 
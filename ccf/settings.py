@@ -146,6 +146,24 @@ else:  # local deployment
     }
 
 
+# The cache must be shared by every process, since app_ccf.velocity counts
+# voucher code attempts in it. Set MEMCACHED_LOCATION, e.g. to the host:port
+# of an ElastiCache node, in deployments. Without it, each process throttles
+# on its own and app_ccf.checks warns.
+if os.environ.get('MEMCACHED_LOCATION'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': os.environ['MEMCACHED_LOCATION'],
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+    }
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
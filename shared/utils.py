@@ -1,7 +1,11 @@
 # Shared Utils
 from django import forms
 import logging
+import phonenumbers
+import threading
+import time
 import unidecode
+from collections import OrderedDict
 from contextlib import contextmanager
 from django.core.validators import RegexValidator
 from django.utils import translation
@@ -63,6 +67,146 @@ def validate_phone_number(value):
         raise forms.ValidationError(_("needs_phone_number_format"))
 
 
+# USPS standard abbreviations (Publication 28, appendices B and C) of the
+# street suffixes and directionals most common in addresses.
+ADDRESS_ABBREVIATIONS = {
+    'alley': 'aly', 'avenue': 'ave', 'av': 'ave', 'aven': 'ave',
+    'boulevard': 'blvd', 'boul': 'blvd', 'circle': 'cir', 'court': 'ct',
+    'crescent': 'cres', 'drive': 'dr', 'expressway': 'expy',
+    'freeway': 'fwy', 'heights': 'hts', 'highway': 'hwy', 'hiway': 'hwy',
+    'lane': 'ln', 'parkway': 'pkwy', 'place': 'pl', 'plaza': 'plz',
+    'road': 'rd', 'square': 'sq', 'street': 'st', 'str': 'st',
+    'strt': 'st', 'terrace': 'ter', 'trail': 'trl', 'turnpike': 'tpke',
+    'north': 'n', 'south': 's', 'east': 'e', 'west': 'w',
+    'northeast': 'ne', 'northwest': 'nw', 'southeast': 'se',
+    'southwest': 'sw',
+}
+
+# Secondary unit designators, which start the unit part of an address line.
+ADDRESS_UNIT_DESIGNATORS = {
+    'apartment', 'apt', 'building', 'bldg', 'floor', 'fl', 'room', 'rm',
+    'suite', 'ste', 'unit', '#',
+}
+
+ADDRESS_TOKEN_PATTERN = re.compile(r'#|[a-z0-9]+')
+
+
+def normalize_street_address(addr1, include_unit=True):
+    """Returns the canonical form of a street address line.
+
+    Accents are transliterated, case is folded, punctuation is dropped, and
+    street suffixes and directionals are abbreviated as USPS does, e.g.
+    "123 Main Street" and "123 MAIN ST" both become "123 main st". The unit
+    is written with a single designator, so "123 Main St, Apt. 4" and
+    "123 Main St #4" both become "123 main st unit 4".
+
+    Args:
+        addr1: The street address line.
+        include_unit: Whether to keep the unit, rather than only the
+            building.
+    """
+    tokens = ADDRESS_TOKEN_PATTERN.findall(
+        unidecode.unidecode(addr1).casefold())
+    street = []
+    unit = []
+    for token in tokens:
+        # Keep the house number even if it is written like a unit (#12).
+        if (token in ADDRESS_UNIT_DESIGNATORS and street) or unit:
+            if not include_unit:
+                break
+            unit.append(token)
+        elif token != '#':
+            street.append(ADDRESS_ABBREVIATIONS.get(token, token))
+    unit = [token for token in unit if token not in ADDRESS_UNIT_DESIGNATORS]
+    if unit:
+        street += ['unit'] + unit
+    return ' '.join(street)
+
+
+def get_address_key(addr1, zip_code):
+    """Returns the key under which equivalent addresses are compared."""
+    return '%s %s' % (normalize_street_address(addr1), zip_code.strip())
+
+
+def get_building_key(addr1, zip_code):
+    """Returns the address key of the building of an address, without unit."""
+    return '%s %s' % (normalize_street_address(addr1, include_unit=False),
+                      zip_code.strip())
+
+
+# The longest phone key returned by get_phone_key.
+PHONE_KEY_MAX_LENGTH = 20
+
+
+def get_phone_key(phone_number, region='US'):
+    """Returns a phone number in E.164 form, e.g. +12125551234.
+
+    Numbers without a country code are read as being in region. Numbers that
+    can't be parsed are reduced to their digits, so they still only match
+    themselves, and cut to PHONE_KEY_MAX_LENGTH. Numbers without any digit
+    have an empty key.
+    """
+    try:
+        parsed = phonenumbers.parse(phone_number, region)
+    except phonenumbers.NumberParseException:
+        digits = re.sub(r'[^0-9]', '', phone_number)
+        key = '+' + digits if digits else ''
+    else:
+        key = phonenumbers.format_number(
+            parsed, phonenumbers.PhoneNumberFormat.E164)
+    return key[:PHONE_KEY_MAX_LENGTH]
+
+
+class TTLCache:
+    """A bounded, process-local LRU cache whose entries expire.
+
+    Unlike the Django cache, lookups cost no round trip, but each process
+    has its own entries: a change made in one process is only seen by the
+    others once their entries expire, so only cache values that may be
+    briefly stale. Once max_size entries are cached, the least recently used
+    one is evicted.
+    """
+
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        # Maps keys to (expiry time, value), least recently used first.
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Returns the value cached for key, or default if there is none."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete_many(self, keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
 @contextmanager
 def activate_language(language):
     """A context manager for temporarily activating a language in the env."""
@@ -0,0 +1,150 @@
+from datetime import datetime, timezone, timedelta
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+import mock
+
+from app_ccf.models import VoucherCode, VoucherCodeBatch
+
+from .utils import (
+    create_voucher_codes,
+    generate_random_codes,
+    generate_voucher_codes,
+    import_voucher_codes,
+    summarize_voucher_codes,
+)
+from app_ccf import base_test
+
+
+class GenerateVoucherCodesTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        now = datetime.now(timezone.utc)
+        self.batch = VoucherCodeBatch.objects.create(
+            num_codes=2,
+            code_length=2,
+            alphabet='abc',
+            base_amount=400,
+            created=now,
+            expiration_date=now + timedelta(days=1))
+        for code in ['aa', 'ab']:
+            VoucherCode.objects.create(
+                code=code, added_amount=0, batch=self.batch)
+
+    def test_generate_random_codes(self):
+        codes = generate_random_codes(num_codes=1000, code_length=9,
+                                      alphabet='abc')
+
+        self.assertEqual(1000, len(codes))
+        self.assertEqual({9}, {len(code) for code in codes})
+        self.assertEqual(set('abc'), set(''.join(codes)))
+
+    def test_generate_voucher_codes_skipsExistingCodes(self):
+        codes = generate_voucher_codes(num_codes=2, code_length=2,
+                                       alphabet='abc')
+
+        self.assertEqual(2, len(set(codes)))
+        self.assertFalse(set(codes) & {'aa', 'ab'})
+
+    @mock.patch('staff.utils.COLLISION_CHECK_CHUNK_SIZE', 3)
+    def test_generate_voucher_codes_oneQueryPerChunk(self):
+        with self.assertNumQueries(3):
+            codes = generate_voucher_codes(
+                num_codes=7, code_length=9,
+                alphabet='abcdefghijkmnopqrstuvwxyz')
+
+        self.assertEqual(7, len(set(codes)))
+
+    @mock.patch('staff.utils.generate_random_codes')
+    def test_create_voucher_codes_regeneratesCollidedCodes(
+            self, generate_random_codes):
+        generate_random_codes.side_effect = [['aa', 'ba', 'ba'], ['bb']]
+
+        self.assertEqual(2, create_voucher_codes(self.batch))
+
+        self.assertEqual(
+            {'ba', 'bb'},
+            set(self.batch.vouchercode_set.exclude(
+                code__in=['aa', 'ab']).values_list('code', flat=True)))
+        generate_random_codes.assert_called_with(1, 2, 'abc')
+
+    def test_generate_voucher_codes_command_writesCodes(self):
+        with tempfile.NamedTemporaryFile('r', suffix='.txt') as f:
+            call_command('generate_voucher_codes', f.name, 5, length=4)
+
+            codes = f.read().split()
+
+        self.assertEqual(5, len(set(codes)))
+        self.assertEqual({4}, {len(code) for code in codes})
+        self.assertNotIn('l', ''.join(codes))
+
+
+class ImportVoucherCodesTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        now = datetime.now(timezone.utc)
+        self.batch = VoucherCodeBatch.objects.create(
+            num_codes=1,
+            code_length=9,
+            base_amount=400,
+            created=now,
+            expiration_date=now + timedelta(days=1))
+        VoucherCode.objects.create(
+            code='existing1', added_amount=0, batch=self.batch)
+        self.file = tempfile.NamedTemporaryFile('w', suffix='.csv')
+        self.file.write('\n'.join([
+            'aaaaaaaaa', 'not-valid', 'existing1', '', 'bbbbbbbbb',
+            'aaaaaaaaa', 'CCCCCCCCC', 'x' * 21]) + '\n')
+        self.file.flush()
+
+    def tearDown(self):
+        self.file.close()
+        super().tearDown()
+
+    @mock.patch('staff.utils.CODE_IMPORT_CHUNK_SIZE', 2)
+    def test_import_voucher_codes_skipsInvalidAndExistingCodes(self):
+        counts = import_voucher_codes(self.file.name, self.batch)
+
+        self.assertEqual((3, 2, 2), counts)
+        self.assertEqual(
+            {'aaaaaaaaa', 'bbbbbbbbb', 'CCCCCCCCC', 'existing1'},
+            set(self.batch.vouchercode_set.values_list('code', flat=True)))
+
+    def test_import_voucher_codes_command_createsBatch(self):
+        call_command('import_voucher_codes', self.file.name,
+                     affiliate='aff', campaign='cam', amount=200)
+
+        batch = VoucherCodeBatch.objects.get(affiliate='aff')
+        self.assertEqual(3, batch.num_codes)
+        self.assertEqual(9, batch.code_length)
+        self.assertEqual('Cab', batch.alphabet)
+        self.assertEqual(200, batch.base_amount)
+        self.assertEqual(3, batch.vouchercode_set.count())
+
+    def test_import_voucher_codes_command_noNewCodes_addsNoBatch(self):
+        for lines in (['not-valid', ''], ['existing1']):
+            with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+                f.write('\n'.join(lines) + '\n')
+                f.flush()
+
+                with self.assertRaises(CommandError):
+                    call_command('import_voucher_codes', f.name,
+                                 affiliate='aff', campaign='cam')
+
+        self.assertFalse(VoucherCodeBatch.objects.filter(affiliate='aff'))
+
+    def test_import_voucher_codes_command_pastExpiration_addsNoBatch(self):
+        with self.assertRaises(CommandError):
+            call_command('import_voucher_codes', self.file.name,
+                         affiliate='aff', campaign='cam',
+                         exp_on_date='01-01-2000')
+
+        self.assertFalse(VoucherCodeBatch.objects.filter(affiliate='aff'))
+        self.assertFalse(VoucherCode.objects.filter(code='aaaaaaaaa'))
+
+    def test_summarize_voucher_codes(self):
+        self.assertEqual((5, 9, '1Cabeginstx'),
+                         summarize_voucher_codes(self.file.name))
@@ -0,0 +1,133 @@
+import csv
+import datetime
+import os
+import tempfile
+
+from app_ccf import base_test
+from app_ccf.models import (
+    Application,
+    DuplicateCluster,
+    FraudFlag,
+    VoucherCode,
+    VoucherCodeBatch,
+)
+from shared.test_utils import DEFAULT_CCF_APP_FIELDS
+
+from .views import (
+    ApplicationFilter,
+    DownloadReportView,
+    DuplicateClusterListView,
+)
+
+
+class DuplicateClusterListViewTests(base_test.CcfBaseTest):
+
+    def _create_cluster(self, addr1, num_members):
+        for _ in range(num_members):
+            Application.objects.create(
+                **dict(DEFAULT_CCF_APP_FIELDS, addr1=addr1))
+        key = Application.objects.filter(addr1=addr1).values_list(
+            'address_key', flat=True)[0]
+        DuplicateCluster.bulk_assign(
+            FraudFlag.Reason.DUPLICATE_ADDRESS, 'address_key', [key])
+
+    def test_get_queryset_manyClusters_constantQueries(self):
+        for i in range(5):
+            self._create_cluster('%d Main St' % (i + 1), 3)
+        DuplicateCluster.objects.filter(key__startswith='5 ').update(
+            is_reviewed=True)
+
+        # The clusters, their members, and the members' flags.
+        with self.assertNumQueries(3):
+            clusters = list(DuplicateClusterListView().get_queryset())
+            members = [[app.fraud_flags.all() for app in cluster.members.all()]
+                       for cluster in clusters]
+
+        self.assertEqual(
+            ['1 main st 10011', '2 main st 10011', '3 main st 10011',
+             '4 main st 10011'],
+            [cluster.key for cluster in clusters])
+        self.assertEqual([3] * 4, [len(cluster) for cluster in members])
+
+
+class ApplicationFilterTests(base_test.CcfBaseTest):
+
+    def setUp(self):
+        super().setUp()
+        for addr1 in ['123 Main Street', '45 Main St Apt 2', '9 Other Rd']:
+            Application.objects.create(
+                **dict(DEFAULT_CCF_APP_FIELDS, addr1=addr1))
+
+    def _filter_address(self, value):
+        return sorted(ApplicationFilter(
+            {'address': value}, queryset=Application.objects.all()
+        ).qs.values_list('addr1', flat=True))
+
+    def test_filter_address_streetName_findsAllHouses(self):
+        self.assertEqual(
+            ['123 Main Street', '45 Main St Apt 2'],
+            self._filter_address('main street'))
+
+    def test_filter_address_fullAddress_findsNormalizedMatch(self):
+        self.assertEqual(
+            ['45 Main St Apt 2'], self._filter_address('45 MAIN ST #2'))
+
+
+class DownloadReportViewTests(base_test.CcfBaseTest):
+
+    def test_write_payments_csv_manyApplications_oneQuery(self):
+        today = datetime.datetime.now(datetime.timezone.utc)
+        batch = VoucherCodeBatch.objects.create(
+            num_codes=3, code_length=9, base_amount=400, created=today,
+            expiration_date=today + datetime.timedelta(days=1))
+        for i in range(3):
+            code = 'aaaaaaaa%d' % i
+            VoucherCode.objects.create(
+                code=code, added_amount=i, batch=batch,
+                application=Application.objects.create(**dict(
+                    DEFAULT_CCF_APP_FIELDS, vouchercode_str=code,
+                    status=Application.ApplicationStatus.APPROVED)))
+        filename = os.path.join(tempfile.mkdtemp(), 'payments.csv')
+
+        with self.assertNumQueries(1):
+            DownloadReportView().write_payments_csv(
+                filename, Application.ApplicationStatus.APPROVED)
+
+        with open(filename, newline='', encoding='utf-8') as csv_file:
+            self.assertEqual(
+                ['400.00', '401.00', '402.00'],
+                sorted(row['loadAmount'] for row in csv.DictReader(csv_file)))
+
+    def test_write_payments_csv_legacyApplication_looksUpCode(self):
+        today = datetime.datetime.now(datetime.timezone.utc)
+        batch = VoucherCodeBatch.objects.create(
+            num_codes=1, code_length=9, base_amount=400, created=today,
+            expiration_date=today + datetime.timedelta(days=1))
+        VoucherCode.objects.create(
+            code='aaaaaaaaa', added_amount=50, batch=batch)
+        Application.objects.create(**dict(
+            DEFAULT_CCF_APP_FIELDS, vouchercode_str='aaaaaaaaa',
+            status=Application.ApplicationStatus.APPROVED))
+        filename = os.path.join(tempfile.mkdtemp(), 'payments.csv')
+
+        with self.assertNumQueries(2):
+            missing_application_ids = DownloadReportView().write_payments_csv(
+                filename, Application.ApplicationStatus.APPROVED)
+
+        self.assertEqual([], missing_application_ids)
+        with open(filename, newline='', encoding='utf-8') as csv_file:
+            self.assertEqual(
+                ['450.00'],
+                [row['loadAmount'] for row in csv.DictReader(csv_file)])
+
+    def test_write_payments_csv_missingCode_writesNothing(self):
+        application = Application.objects.create(**dict(
+            DEFAULT_CCF_APP_FIELDS, vouchercode_str='nosuchcod',
+            status=Application.ApplicationStatus.APPROVED))
+        filename = os.path.join(tempfile.mkdtemp(), 'payments.csv')
+
+        missing_application_ids = DownloadReportView().write_payments_csv(
+            filename, Application.ApplicationStatus.APPROVED)
+
+        self.assertEqual([application.application_id], missing_application_ids)
+        self.assertFalse(os.path.exists(filename))
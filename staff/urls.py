@@ -11,6 +11,10 @@ application_patterns = [
          name='application-detail'),
     path('<uuid:pk>/update', views.ApplicationUpdateView.as_view(),
          name='application-update'),
+    path('clusters/', views.DuplicateClusterListView.as_view(),
+         name='duplicate-clusters'),
+    path('clusters/<int:pk>/review', views.DuplicateClusterReviewView.as_view(),
+         name='duplicate-cluster-review'),
 ]
 
 payments_patterns = [
@@ -19,6 +23,10 @@ payments_patterns = [
          name='mark-as-paid'),
     path('auto_process_applications/',
          views.AutoProcessApplicationsView.as_view(), name='auto-process-applications'),
+    path('auto_process_applications/status/',
+         views.AutoProcessJobStatusView.as_view(), name='auto-process-status'),
+    path('fraud_check_report/',
+         views.FraudCheckReportView.as_view(), name='fraud-check-report'),
     path('<str:status>/', views.DownloadReportView.as_view(), name='download-report'),
 ]
 
@@ -1,68 +1,220 @@
+import collections
 from datetime import datetime, timedelta, timezone
+import io
 import logging
-import random
+import re
+import secrets
 
-from django.core.exceptions import ValidationError
+from django.db import connection, transaction
 
 from app_ccf.models import VoucherCode
 
 
 LOGGER = logging.getLogger(__name__)
 
+# The most generated codes checked against the database in one query.
+COLLISION_CHECK_CHUNK_SIZE = 2000
 
-def import_voucher_codes(filename, batch):
-    LOGGER.info('Uploading codes...')
-    num_valid_codes = 0
-    num_invalid_codes = 0
+# The most codes generated and inserted at a time by create_voucher_codes.
+CODE_INSERT_CHUNK_SIZE = 50000
+
+# The most codes import_voucher_codes copies into the database at a time.
+CODE_IMPORT_CHUNK_SIZE = 50000
+
+# The codes import_voucher_codes accepts: up to 20 letters and digits.
+CODE_PATTERN = re.compile(r'[A-Za-z0-9]{1,20}')
+
+ImportCounts = collections.namedtuple(
+    'ImportCounts', ['num_imported', 'num_invalid', 'num_duplicates'])
+
+CodeFileSummary = collections.namedtuple(
+    'CodeFileSummary', ['num_codes', 'code_length', 'alphabet'])
+
+
+def summarize_voucher_codes(filename):
+    """Reads the valid codes in a file the way import_voucher_codes does.
+
+    This lets a batch be created with its final values before the codes are
+    imported into it. Codes that already exist, or appear twice in the file,
+    are still counted, since that is only known once they are imported.
+
+    Returns:
+        A CodeFileSummary, with an empty alphabet if no code is valid.
+    """
+    num_codes = code_length = 0
+    chars = set()
+    for code, is_valid in _read_codes(filename):
+        if is_valid:
+            num_codes += 1
+            code_length = max(code_length, len(code))
+            chars.update(code)
+    return CodeFileSummary(num_codes, code_length, ''.join(sorted(chars)))
+
+
+def _read_codes(filename):
+    """Yields the non-blank lines of a code file and whether they're valid."""
     with open(filename, 'r') as f:
-        voucher_codes_to_write = []
         for line in f:
-            voucher_code_str = line.strip()
-            voucher_code = VoucherCode(
-                code=voucher_code_str,
-                added_amount=0,
-                batch=batch,
-                is_active=True,
-            )
-            try:
-                pass
-                # voucher_code.full_clean()  # Validate code format
-            except ValidationError as e:
-                LOGGER.error('Error importing code \'%s\': %s' % (
-                    voucher_code_str, str(e)))
-                num_invalid_codes += 1
-            else:
-                voucher_codes_to_write.append(voucher_code)
-                LOGGER.info('Imported code \'%s\'.' % voucher_code_str)
-                num_valid_codes += 1
-
-    LOGGER.info('Writing %d codes to database (%d invalid)...' %
-                (num_valid_codes, num_invalid_codes))
-    VoucherCode.objects.bulk_create(voucher_codes_to_write)
+            code = line.strip()
+            if code:
+                yield code, bool(CODE_PATTERN.fullmatch(code))
+
+
+def import_voucher_codes(filename, batch):
+    """Imports the codes in a file, one per line, into a saved batch.
+
+    The file is streamed CODE_IMPORT_CHUNK_SIZE codes at a time. Each chunk
+    is sent with COPY into a temporary table and moved from there into
+    VoucherCode with INSERT ... SELECT ... ON CONFLICT DO NOTHING, so memory
+    use doesn't grow with the file. Lines that aren't valid codes and codes
+    that already exist are skipped and counted. The whole file is imported
+    in one transaction.
+
+    Returns:
+        An ImportCounts.
+    """
+    LOGGER.info('Importing codes from %s...' % filename)
+    num_imported = num_invalid = num_duplicates = 0
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute('CREATE TEMPORARY TABLE voucher_code_import '
+                       '(code varchar(20))')
+        codes = []
+        for code, is_valid in _read_codes(filename):
+            if not is_valid:
+                num_invalid += 1
+                continue
+            codes.append(code)
+            if len(codes) == CODE_IMPORT_CHUNK_SIZE:
+                num_inserted = _copy_voucher_codes(cursor, codes, batch)
+                num_imported += num_inserted
+                num_duplicates += len(codes) - num_inserted
+                codes = []
+                LOGGER.info('Imported %d codes...' % num_imported)
+        num_inserted = _copy_voucher_codes(cursor, codes, batch)
+        num_imported += num_inserted
+        num_duplicates += len(codes) - num_inserted
+        cursor.execute('DROP TABLE voucher_code_import')
+    # The new codes may have been cached as not found.
+    VoucherCode.forget_verifications()
+
+    LOGGER.info('Done, imported %d codes. %d lines were invalid, and %d '
+                'codes already existed.' % (
+                    num_imported, num_invalid, num_duplicates))
+    return ImportCounts(num_imported, num_invalid, num_duplicates)
 
-    LOGGER.info('Done.')
-    LOGGER.debug('Current codes: %s' % VoucherCode.objects.filter())
+
+def _copy_voucher_codes(cursor, codes, batch):
+    """Adds codes to batch through the import table of import_voucher_codes.
+
+    Returns:
+        The number of codes inserted, i.e. that didn't exist yet.
+    """
+    if not codes:
+        return 0
+    # Valid codes have no character COPY would have to escape.
+    cursor.copy_expert('COPY voucher_code_import (code) FROM STDIN',
+                       io.StringIO(''.join(code + '\n' for code in codes)))
+    cursor.execute(
+        'INSERT INTO {table} (code, batch_id, added_amount, is_active) '
+        'SELECT code, %s, 0, true FROM voucher_code_import '
+        'ON CONFLICT (code) DO NOTHING'.format(
+            table=VoucherCode._meta.db_table),
+        [batch.pk])
+    num_inserted = cursor.rowcount
+    cursor.execute('TRUNCATE voucher_code_import')
+    return num_inserted
+
+
+def get_batch_alphabet(batch):
+    """Returns the sorted distinct characters of the codes in a batch."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT string_agg(DISTINCT chars.char COLLATE \"C\", '' "
+            "ORDER BY chars.char COLLATE \"C\") "
+            "FROM {table}, regexp_split_to_table(code, '') AS chars(char) "
+            "WHERE batch_id = %s".format(table=VoucherCode._meta.db_table),
+            [batch.pk])
+        return cursor.fetchone()[0] or ''
+
+
+def generate_random_codes(num_codes, code_length, alphabet):
+    """Returns a list of num_codes random codes, possibly with duplicates.
+
+    The characters come from secrets, drawn as bytes in bulk and mapped onto
+    the alphabet with bytes.translate, so there is no Python loop per
+    character. Bytes past the largest multiple of the alphabet size are
+    dropped, so every character of the alphabet is equally likely.
+
+    Args:
+        num_codes: The number of codes to generate.
+        code_length: The number of characters in each code.
+        alphabet: A string of up to 256 ASCII characters to choose from.
+    """
+    alphabet_bytes = alphabet.encode('ascii')
+    num_accepted = 256 - 256 % len(alphabet_bytes)
+    table = (alphabet_bytes * (256 // len(alphabet_bytes) + 1))[:256]
+    rejected = bytes(range(num_accepted, 256))
+
+    num_chars = num_codes * code_length
+    chars = bytearray()
+    while len(chars) < num_chars:
+        # Enough bytes on average for the characters still missing.
+        num_bytes = (num_chars - len(chars)) * 256 // num_accepted + 1
+        chars += secrets.token_bytes(num_bytes).translate(table, rejected)
+    chars = chars[:num_chars].decode('ascii')
+    return [chars[i:i + code_length]
+            for i in range(0, num_chars, code_length)]
 
 
 def generate_voucher_codes(num_codes, code_length, alphabet):
     """Returns a list of new unique codes not already in the database.
 
+    Candidates are generated a chunk at a time and checked against the
+    VoucherCode primary key index with one code__in query per chunk, and the
+    ones already taken are generated again. Memory only grows with
+    num_codes, not with the number of codes issued so far. Use
+    create_voucher_codes to add codes to a batch instead.
+
     Args:
         num_codes: The number of codes to generate.
         code_length: The number of characters in each code.
         alphabet: A string to choose characters from for each code.
     """
-    # Highly unlikely to happen, but we pull up the existing code set to check
-    # against in case we generate a duplicate
-    code_set = set(VoucherCode.objects.filter().values_list('code', flat=True))
-    new_codes = []
+    new_codes = set()
     while len(new_codes) < num_codes:
-        new_code = ''.join([random.choice(alphabet)
-                            for j in range(code_length)])
-        if new_code not in code_set:
-            new_codes.append(new_code)
-            code_set.add(new_code)
-    return new_codes
+        candidates = set(generate_random_codes(
+            min(num_codes - len(new_codes), COLLISION_CHECK_CHUNK_SIZE),
+            code_length, alphabet))
+        candidates -= new_codes
+        # Highly unlikely to match, but codes must never be issued twice.
+        candidates.difference_update(VoucherCode.objects.filter(
+            code__in=candidates).values_list('code', flat=True))
+        new_codes.update(candidates)
+    return list(new_codes)
+
+
+def create_voucher_codes(batch):
+    """Adds batch.num_codes new random codes to a saved VoucherCodeBatch.
+
+    Codes are generated and inserted CODE_INSERT_CHUNK_SIZE at a time, in one
+    transaction. Codes that are already taken are skipped by the insert, and
+    only that many codes are generated again.
+
+    Returns:
+        The number of codes created.
+    """
+    num_created = 0
+    with transaction.atomic():
+        while num_created < batch.num_codes:
+            codes = generate_random_codes(
+                min(batch.num_codes - num_created, CODE_INSERT_CHUNK_SIZE),
+                batch.code_length, batch.alphabet)
+            num_created += len(VoucherCode.insert_new(codes, batch))
+            LOGGER.info('Created %d of %d codes...' % (
+                num_created, batch.num_codes))
+    # The new codes may have been cached as not found.
+    VoucherCode.forget_verifications()
+    return num_created
 
 
 def invalidate_voucher_codes_with_campaign(affiliate, campaign):
@@ -73,6 +225,7 @@ def invalidate_voucher_codes_with_campaign(affiliate, campaign):
                 'and campaign \'%s\'. Invalidating...' %
                 (len(voucher_codes), affiliate, campaign))
     voucher_codes.update(is_active=False)
+    VoucherCode.forget_verifications()
     LOGGER.info('Done.')
 
 
@@ -82,4 +235,5 @@ def invalidate_voucher_codes_with_code_list(codes):
     LOGGER.info('Found %d out of %d provided codes. Invalidating...' %
                 (len(voucher_codes), len(codes)))
     voucher_codes.update(is_active=False)
+    VoucherCode.forget_verifications(codes)
     LOGGER.info('Done.')
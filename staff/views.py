@@ -18,6 +18,7 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.views import PasswordChangeView
 from django.core.files import File
 from django.db import transaction
+from django.db.models import Prefetch, Q
 from django.db.models.functions import Lower
 from django.forms.models import model_to_dict
 from django.template.defaultfilters import slugify
@@ -26,6 +27,7 @@ from django.http import (
     FileResponse,
     HttpResponse,
     HttpResponseRedirect,
+    JsonResponse,
 )
 from django.shortcuts import (
     get_object_or_404,
@@ -51,8 +53,13 @@ from django_filters.widgets import RangeWidget
 from app_ccf import common
 from app_ccf import text_messages
 from app_ccf.config import CONFIG
+from app_ccf.fraud_checks import BaseDedupCheck, get_fraud_checks
+from shared.utils import get_phone_key, normalize_street_address
 from app_ccf.models import (
     Application,
+    AutoProcessJob,
+    DuplicateCluster,
+    FraudFlag,
     VoucherCode,
     VoucherCodeBatch,
     PreapprovedAddress
@@ -67,8 +74,7 @@ from .mixins import (
 )
 from .models import AdminAction
 from .utils import (
-    generate_voucher_codes,
-    import_voucher_codes,
+    create_voucher_codes,
     invalidate_voucher_codes_with_campaign,
     invalidate_voucher_codes_with_code_list
 )
@@ -76,6 +82,14 @@ from .utils import (
 
 logger = logging.getLogger(__name__)
 
+STATUS_UPDATE_ALREADY_RUNNING_MESSAGE = (
+    'Another status update is already running. Please try again once it is '
+    'done.')
+
+MISSING_VOUCHER_CODE_MESSAGE = (
+    'No payments were written, since the voucher codes of these applications '
+    'could not be found: %s')
+
 
 def ccf_bad_request_view(request, exception=None):
     messages.error(request, 'Bad request.')
@@ -116,20 +130,39 @@ def staff_logout_view(request):
 
 # TODO(stanfield): Consider moving to new filters.py file.
 class ApplicationFilter(FilterSet):
+    address = CharFilter(label='Address', method='filter_address')
+    phone = CharFilter(label='Phone number', method='filter_phone')
+    # Joins the indexed FraudFlag reasons rather than searching notes. Each
+    # reason is flagged at most once per application, so rows aren't
+    # repeated.
+    fraud_reason = ChoiceFilter(label='Fraud flag',
+                                field_name='fraud_flags__reason',
+                                choices=FraudFlag.Reason.choices)
 
     class Meta:
         model = Application
         fields = {'status': ['exact'],
                   'first_name': ['unaccent__icontains'],
                   'last_name': ['unaccent__icontains'],
-                  'phone_number': ['icontains'],
                   'vouchercode_str': ['icontains'],
-                  'addr1': ['icontains'],
                   'addr2': ['icontains'],
                   'city': ['iexact'],
                   'state': ['iexact'],
                   }
 
+    def filter_address(self, queryset, name, value):
+        # Matched anywhere in the normalized address key, so "123 Main Street"
+        # finds "123 MAIN ST" and "Main St" finds every house on the street,
+        # or anywhere in addr1 as typed.
+        return queryset.filter(
+            Q(address_key__contains=normalize_street_address(value)) |
+            Q(addr1__icontains=value))
+
+    def filter_phone(self, queryset, name, value):
+        # An exact match on the indexed E.164 phone key, so any formatting
+        # of the number finds it.
+        return queryset.filter(phone_key=get_phone_key(value))
+
 
 class IndexView(StaffRequiredMixin, TemplateView):
     template_name = 'staff/index.html'
@@ -157,10 +190,51 @@ class PaginatedFilterViewMixin(View):
 class AutoProcessApplicationsView(StaffRequiredMixin, TemplateView):
 
     def post(self, request, *args, **kwargs):
-        common.auto_update_application_statuses()
+        # The checks run in the run_auto_process_jobs worker since they take
+        # longer than the proxy timeout once the backlog is large.
+        AutoProcessJob.enqueue(user=request.user.username)
         return HttpResponseRedirect(reverse('staff:payments'))
 
 
+class AutoProcessJobStatusView(StaffRequiredMixin, View):
+
+    def get(self, request, *args, **kwargs):
+        job = AutoProcessJob.objects.order_by('-created').values(
+            'id', 'status', 'num_processed', 'num_total', 'error').first()
+        return JsonResponse({'job': job})
+
+
+class FraudCheckReportView(SuperUserRequiredMixin, TemplateView):
+    """Shows what auto-processing would do, without changing anything."""
+    template_name = "staff/applications/fraud_check_report.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        thresholds = []
+        max_duplicates = {}
+        for check in get_fraud_checks():
+            if not isinstance(check, BaseDedupCheck):
+                continue
+            value = self.request.GET.get(check.name, '')
+            if value.isdigit():
+                max_duplicates[check.name] = int(value)
+            thresholds.append(
+                (check.name, max_duplicates.get(check.name,
+                                                check.get_max_duplicates())))
+        context['thresholds'] = thresholds
+
+        if 'run' in self.request.GET:
+            report = common.auto_update_application_statuses(
+                chunk_size=common.AUTO_PROCESS_CHUNK_SIZE,
+                dry_run=True,
+                max_duplicates=max_duplicates)
+            report['by_status'] = [
+                (Application.ApplicationStatus(status).label, count)
+                for status, count in sorted(report['by_status'].items())]
+            context['report'] = report
+        return context
+
+
 class ApplicationListView(StaffRequiredMixin, PaginatedFilterViewMixin, ListView):
     model = Application
     template_name = "staff/applications/application_list.html"
@@ -172,7 +246,7 @@ class ApplicationListView(StaffRequiredMixin, PaginatedFilterViewMixin, ListView
             self.request.GET,
             queryset=self.model.objects.all().order_by(self.ordering)
         ).qs
-        return queryset
+        return queryset.prefetch_related('fraud_flags')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -181,6 +255,28 @@ class ApplicationListView(StaffRequiredMixin, PaginatedFilterViewMixin, ListView
         return context
 
 
+class DuplicateClusterListView(StaffRequiredMixin, ListView):
+    """Lists the duplicate clusters left to review, oldest first."""
+    template_name = "staff/applications/duplicate_clusters.html"
+    paginate_by = 20
+
+    def get_queryset(self):
+        # Members and their flags are prefetched for the whole page, so the
+        # page takes the same few queries whatever the number of clusters.
+        return DuplicateCluster.objects.filter(
+            is_reviewed=False).order_by('created', 'id').prefetch_related(
+                Prefetch('members', queryset=Application.objects.order_by(
+                    'submitted_date').prefetch_related('fraud_flags')))
+
+
+class DuplicateClusterReviewView(StaffRequiredMixin, View):
+
+    def post(self, request, *args, **kwargs):
+        DuplicateCluster.objects.filter(pk=self.kwargs['pk']).update(
+            is_reviewed=True)
+        return HttpResponseRedirect(reverse('staff:duplicate-clusters'))
+
+
 class ApplicationDetailView(StaffRequiredMixin, DetailView):
     model = Application
     template_name = "staff/applications/application_details.html"
@@ -280,6 +376,8 @@ class PaymentsView(SuperUserRequiredMixin, TemplateView):
         context['num_submitted'] = len(Application.objects.filter(
             status=Application.ApplicationStatus.SUBMITTED
         ))
+        context['auto_process_job'] = AutoProcessJob.objects.order_by(
+            '-created').first()
         return context
 
 
@@ -289,9 +387,12 @@ class MarkAsPaidView(SuperUserAccessedView):
         application_ids = ast.literal_eval(
             request.POST.get('application_ids'))
         send_text_messages = request.POST.get('send_text_messages')
-        common.update_application_statuses(
-            application_ids, Application.ApplicationStatus.PAYMENT_CONFIRMED,
-            bool(send_text_messages))
+        try:
+            common.update_application_statuses(
+                application_ids, Application.ApplicationStatus.PAYMENT_CONFIRMED,
+                bool(send_text_messages))
+        except common.AlreadyRunningError:
+            messages.error(request, STATUS_UPDATE_ALREADY_RUNNING_MESSAGE)
         return HttpResponseRedirect(reverse('staff:payments'))
 
 
@@ -302,7 +403,14 @@ class DownloadReportView(SuperUserRequiredMixin, APIView):
         application_ids = ast.literal_eval(
             request.POST.get('application_ids'))
         filename = 'tmp.csv'
-        self.write_payments_csv(filename, requested_status)
+        missing_application_ids = self.write_payments_csv(
+            filename, requested_status)
+        if missing_application_ids:
+            return HttpResponse(
+                MISSING_VOUCHER_CODE_MESSAGE % ', '.join(
+                    str(application_id)
+                    for application_id in missing_application_ids),
+                status=409)
         # When a download is requested for APPROVED applications, we update
         # their status to SENT_FOR_PAYMENT. This is a bit of a hack while we
         # still need CSVs to be uploaded for payment manually.
@@ -310,25 +418,51 @@ class DownloadReportView(SuperUserRequiredMixin, APIView):
         # https://docs.google.com/document/d/1SbAEaOq-sxkPz1MYm01odUG7ktQEsVS8QklHHtHEEAI/
         if requested_status == Application.ApplicationStatus.APPROVED:
             applications = Application.objects.filter(pk__in=application_ids)
-            common.update_application_statuses(
-                applications, Application.ApplicationStatus.SENT_FOR_PAYMENT)
+            try:
+                common.update_application_statuses(
+                    applications, Application.ApplicationStatus.SENT_FOR_PAYMENT)
+            except common.AlreadyRunningError:
+                return HttpResponse(
+                    STATUS_UPDATE_ALREADY_RUNNING_MESSAGE, status=409)
         return FileResponse(open(filename, 'rb'))
 
     def write_payments_csv(self, filename, status):
-        applications = Application.objects.filter(
-            status=status).order_by('-submitted_date')
-        # Need to pre-load voucher codes because calling
-        # VoucherCode.objects.get(code=application.voucher_code) on every
-        # application is extremely slow
-        # TODO (wups): remove this once the VoucherCode/Application model
-        # relationship is fixed
-        voucher_code_amount_map = {
-            voucher_code.code: voucher_code.amount
-            for voucher_code in VoucherCode.objects.filter(
-                code__in=applications.values_list('vouchercode_str', flat=True))}
+        """Writes the payments of the applications with a status to a CSV.
+
+        Returns:
+            The ids of the applications whose voucher code could not be found,
+            in which case nothing is written rather than paying a guessed
+            amount.
+        """
+        # Joins each application's code and batch for its amount.
+        applications = list(Application.objects.filter(
+            status=status).order_by('-submitted_date').select_related(
+                'vouchercode__batch'))
+        # Until ./manage.py link_voucher_codes has linked every legacy
+        # application to its code, their codes are looked up by
+        # vouchercode_str, in one more query.
+        legacy_amounts = {}
+        if CONFIG['legacy_vouchercode_fallback']:
+            legacy_codes = [application.vouchercode_str
+                            for application in applications
+                            if not hasattr(application, 'vouchercode')]
+            if legacy_codes:
+                legacy_amounts = {
+                    voucher_code.code: voucher_code.amount
+                    for voucher_code in VoucherCode.objects.filter(
+                        code__in=legacy_codes).select_related('batch')}
         rows = []
+        missing_application_ids = []
         for application in applications:
-            load_amount = voucher_code_amount_map[application.vouchercode_str]
+            if hasattr(application, 'vouchercode'):
+                load_amount = application.vouchercode.amount
+            elif application.vouchercode_str in legacy_amounts:
+                load_amount = legacy_amounts[application.vouchercode_str]
+            else:
+                logger.error('Application %s has no voucher code.' %
+                             application.application_id)
+                missing_application_ids.append(application.application_id)
+                continue
             card_design_id = CONFIG['usio_card_design_id_%s' %
                                     application.language]
             data = OrderedDict([
@@ -362,11 +496,14 @@ class DownloadReportView(SuperUserRequiredMixin, APIView):
             for key, value in data.items():
                 data[key] = unidecode.unidecode(value)
             rows.append(data)
+        if missing_application_ids:
+            return missing_application_ids
         fieldnames = rows[0].keys()
         with open(filename, 'w', newline='', encoding='utf-8') as csv_file:
             writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
             writer.writeheader()
             writer.writerows(rows)
+        return []
 
 
 class VoucherCodeGenerateView(SuperUserRequiredMixin, CreateView, ListView, ContextMixin):
@@ -413,18 +550,9 @@ class VoucherCodeGenerateView(SuperUserRequiredMixin, CreateView, ListView, Cont
         model.user = self.request.user.username
 
         # Need to save before creating codes so the batch can be attached
-        model.save()
-
-        # Create codes and write to a temp file
-        codes = generate_voucher_codes(
-            model.num_codes, model.code_length, model.alphabet)
-        filename = 'tmp.csv'
-        with open(filename, 'w') as f:
-            for code in codes:
-                f.write('%s\n' % code)
-
-        # Add codes to the database
-        import_voucher_codes(filename, model)
+        with transaction.atomic():
+            model.save()
+            create_voucher_codes(model)
 
         return super().form_valid(form)
 